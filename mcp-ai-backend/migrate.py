@@ -23,7 +23,11 @@ def init_database(config_name='development'):
     with app.app_context():
         # Importar todos os modelos para garantir que sejam criados
         from src.models.campaign import Campaign, ProductDatabase, SalesInteraction
-        from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow
+        from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow, AgentMetricShard
+        from src.models.broadcast import BroadcastJob, WhatsAPISessionLimit
+        from src.models.webhook import WebhookEvent, WebhookConversationLock
+        from src.models.conversation import Conversation, ConversationTurn
+        from src.models.strategy_job import StrategyJob
         from src.models.user import User
         
         try:
@@ -0,0 +1,19 @@
+"""
+Migration para vincular um agente a cada campanha (campaigns.agent_id) e versionar a configuração dos agentes (mcp_agents.config_version).
+"""
+revision = 'adiciona_agent_id_campaigns_e_config_version'
+down_revision = 'adiciona_satisfaction_count_mcp_agents'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('mcp_agents', sa.Column('config_version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('campaigns', sa.Column('agent_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_campaigns_agent_id', 'campaigns', 'mcp_agents', ['agent_id'], ['id'])
+
+def downgrade():
+    op.drop_constraint('fk_campaigns_agent_id', 'campaigns', type_='foreignkey')
+    op.drop_column('campaigns', 'agent_id')
+    op.drop_column('mcp_agents', 'config_version')
@@ -0,0 +1,15 @@
+"""
+Migration para contar as tentativas (claims) de cada broadcast_job e marcar como failed os que sempre travam.
+"""
+revision = 'adiciona_attempts_broadcast_jobs'
+down_revision = 'adiciona_agent_id_campaigns_e_config_version'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('broadcast_jobs', sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+
+def downgrade():
+    op.drop_column('broadcast_jobs', 'attempts')
@@ -0,0 +1,17 @@
+"""
+Migration para adicionar as colunas de embedding (busca vetorial) na tabela agent_knowledge.
+"""
+revision = 'adiciona_embedding_agent_knowledge'
+down_revision = 'adiciona_runtime_config_mcp_agents'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('agent_knowledge', sa.Column('embedding', sa.LargeBinary(), nullable=True))
+    op.add_column('agent_knowledge', sa.Column('embedding_model', sa.String(length=100), nullable=True))
+
+def downgrade():
+    op.drop_column('agent_knowledge', 'embedding_model')
+    op.drop_column('agent_knowledge', 'embedding')
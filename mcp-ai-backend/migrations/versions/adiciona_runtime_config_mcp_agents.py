@@ -0,0 +1,15 @@
+"""
+Migration para adicionar a coluna runtime_config (JSON) na tabela mcp_agents.
+"""
+revision = 'adiciona_runtime_config_mcp_agents'
+down_revision = 'aumenta_password_hash_para_256'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('mcp_agents', sa.Column('runtime_config', sa.Text(), nullable=True))
+
+def downgrade():
+    op.drop_column('mcp_agents', 'runtime_config')
@@ -0,0 +1,17 @@
+"""
+Migration para adicionar satisfaction_count na tabela mcp_agents (média móvel de satisfação com contagem).
+"""
+revision = 'adiciona_satisfaction_count_mcp_agents'
+down_revision = 'adiciona_embedding_agent_knowledge'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('mcp_agents', sa.Column('satisfaction_count', sa.Integer(), nullable=False, server_default='0'))
+    # O valor atual entra na média como uma amostra
+    op.execute("UPDATE mcp_agents SET satisfaction_count = 1 WHERE customer_satisfaction > 0")
+
+def downgrade():
+    op.drop_column('mcp_agents', 'satisfaction_count')
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Recalcula sentiment, stage e conversion_probability das sales_interactions
+com o classificador atual (depois de mudar léxicos ou regras). Cada linha é
+classificada no idioma do agente da sua campanha; linhas sem ai_response
+(registradas manualmente) não são tocadas.
+
+As linhas são lidas em blocos por paginação keyset (id > último id) com
+cursor do lado do servidor, classificadas em um pool de processos e
+gravadas com um UPDATE em lote por bloco, só das linhas que mudaram. O
+último id gravado fica em um arquivo de checkpoint, então o comando pode
+ser interrompido e retomado; --max-rows-per-second e --pause-ms limitam a
+carga sobre o banco em produção.
+
+Exemplos:
+    python rescore_interactions.py --config production --dry-run
+    python rescore_interactions.py --config production --workers 4 --max-rows-per-second 2000
+    python rescore_interactions.py --campaign 12 --restart
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Adicionar o diretório raiz ao path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import bindparam, text
+from src.services.interaction_classifier import interaction_classifier
+from src.services.rate_limit import TokenBucket
+
+
+def score_chunk(rows, language=None):
+    """
+    Classifica um bloco de (id, mensagem, sentiment, stage, conversion_probability, idioma do agente)
+    e retorna só as linhas cujo resultado mudou, como dicts prontos para o UPDATE.
+    Cada linha usa o léxico do idioma do seu agente (como na classificação ao vivo);
+    `language` vale para as linhas sem agente/idioma.
+    Roda nos processos do pool (função de módulo para poder ser serializada).
+    """
+    by_language = {}
+    for row in rows:
+        by_language.setdefault(row[5] or language, []).append(row)
+    changed = []
+    for row_language, group in by_language.items():
+        results = interaction_classifier.classify_batch([row[1] for row in group], row_language)
+        for row, result in zip(group, results):
+            if (row[2], row[3], row[4]) != (result['sentiment'], result['stage'], result['confidence']):
+                changed.append({'row_id': row[0], 'sentiment': result['sentiment'],
+                                'stage': result['stage'], 'conversion_probability': result['confidence']})
+    return changed
+
+
+class Checkpoint:
+    """
+    Progresso gravado em JSON (escrita atômica) para retomar a partir do último id.
+    Com persist=False (--dry-run) o progresso fica só em memória: o arquivo não é alterado.
+    """
+
+    def __init__(self, path, filters, persist=True):
+        self.path = path
+        self.filters = filters
+        self.persist = persist
+        self.state = {'last_id': 0, 'scanned': 0, 'updated': 0, 'filters': filters,
+                      'started_at': datetime.utcnow().isoformat(), 'finished_at': None}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('filters') != self.filters:
+            raise SystemExit(f"Checkpoint {self.path} foi criado com outros filtros; use --restart ou outro --checkpoint")
+        self.state = state
+        return True
+
+    def save(self, **values):
+        self.state.update(values)
+        if not self.persist:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def read_chunks(engine, table, last_id, chunk_size, campaign_id=None, max_id=None):
+    """
+    Gera blocos em ordem de id: cada bloco é uma consulta keyset curta com cursor do lado do servidor.
+    Traz o idioma do agente da campanha (campaigns.agent_id -> mcp_agents.language) e pula as
+    linhas sem ai_response: essas vieram de /sales-interactions com valores do cliente.
+    """
+    from src.models.campaign import Campaign
+    from src.models.mcp_agent import MCPAgent
+
+    campaigns = Campaign.__table__
+    agents = MCPAgent.__table__
+    columns = [table.c.id, table.c.message_content, table.c.sentiment, table.c.stage,
+               table.c.conversion_probability, agents.c.language]
+    source = table.outerjoin(campaigns, campaigns.c.id == table.c.campaign_id).outerjoin(
+        agents, agents.c.id == campaigns.c.agent_id)
+    while True:
+        query = table.select().with_only_columns(*columns).select_from(source).where(
+            table.c.id > last_id, table.c.ai_response.isnot(None))
+        if campaign_id is not None:
+            query = query.where(table.c.campaign_id == campaign_id)
+        if max_id is not None:
+            query = query.where(table.c.id <= max_id)
+        query = query.order_by(table.c.id).limit(chunk_size)
+        # Uma transação curta por bloco: nenhum snapshot fica aberto durante o processamento
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=1000).execute(query)
+            rows = [tuple(row) for row in result]
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+        if len(rows) < chunk_size:
+            return
+
+
+def write_chunk(engine, table, changed):
+    """Um UPDATE em lote por bloco (UPDATE ... FROM (VALUES ...) no PostgreSQL, executemany nos demais)."""
+    if not changed:
+        return
+    with engine.begin() as connection:
+        if engine.dialect.name == 'postgresql':
+            values = ', '.join(f"(:id{n}, :sentiment{n}, :stage{n}, CAST(:probability{n} AS double precision))"
+                               for n in range(len(changed)))
+            params = {}
+            for n, row in enumerate(changed):
+                params.update({f'id{n}': row['row_id'], f'sentiment{n}': row['sentiment'],
+                               f'stage{n}': row['stage'], f'probability{n}': row['conversion_probability']})
+            connection.execute(text(
+                f"UPDATE {table.name} AS s SET sentiment = v.sentiment, stage = v.stage, "
+                f"conversion_probability = v.probability "
+                f"FROM (VALUES {values}) AS v(id, sentiment, stage, probability) WHERE s.id = v.id"
+            ), params)
+        else:
+            connection.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(
+                    sentiment=bindparam('sentiment'), stage=bindparam('stage'),
+                    conversion_probability=bindparam('conversion_probability')),
+                changed
+            )
+
+
+def create_maintenance_app(config_name):
+    """
+    App Flask só com a configuração e o banco. Não usa src.main: o create_app de lá
+    inicia a fila de webhooks, broadcasts, jobs e demais threads de serviço, que não
+    devem rodar (nem ser herdadas pelos processos do pool) neste comando.
+    """
+    from flask import Flask
+    from config import config
+    from src.models.db_instance import db
+
+    app = Flask(__name__)
+    config_obj = config[config_name]()
+    app.config.from_object(config_obj)
+    app.config['SQLALCHEMY_DATABASE_URI'] = config_obj.SQLALCHEMY_DATABASE_URI
+    db.init_app(app)
+    return app
+
+
+def rescore(args):
+    from src.models.db_instance import db
+    from src.models.campaign import SalesInteraction
+
+    app = create_maintenance_app(args.config)
+    filters = {'campaign_id': args.campaign, 'max_id': args.max_id, 'language': args.language}
+    # --dry-run não grava o checkpoint: uma execução real depois dela começa de onde deveria
+    checkpoint = Checkpoint(args.checkpoint, filters, persist=not args.dry_run)
+    if args.restart and os.path.exists(args.checkpoint) and not args.dry_run:
+        os.remove(args.checkpoint)
+    if not args.restart and checkpoint.load():
+        print(f"Retomando do checkpoint: id > {checkpoint.state['last_id']} "
+              f"({checkpoint.state['scanned']} lidas, {checkpoint.state['updated']} atualizadas)")
+
+    throttle = TokenBucket(args.max_rows_per_second, capacity=args.chunk_size) if args.max_rows_per_second else None
+    started = time.monotonic()
+    scanned_now = 0
+
+    with app.app_context():
+        engine = db.engine
+        table = SalesInteraction.__table__
+        max_id = args.max_id or checkpoint.state.get('max_id')
+        if max_id is None:
+            # Linhas criadas durante a execução já são classificadas pelo código novo
+            with engine.connect() as connection:
+                max_id = connection.execute(db.select(db.func.max(table.c.id))).scalar() or 0
+        checkpoint.save(max_id=max_id)
+
+        chunks = read_chunks(engine, table, checkpoint.state['last_id'], args.chunk_size,
+                             campaign_id=args.campaign, max_id=max_id)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            pending = []
+            for rows in chunks:
+                if throttle is not None:
+                    throttle.acquire(len(rows))
+                pending.append((rows[-1][0], len(rows), pool.submit(score_chunk, rows, args.language)))
+                # Lê os próximos blocos enquanto o pool classifica; grava em ordem de id
+                while len(pending) > args.workers * 2 or (pending and pending[0][2].done()):
+                    scanned_now += flush(engine, table, checkpoint, pending.pop(0), args)
+            while pending:
+                scanned_now += flush(engine, table, checkpoint, pending.pop(0), args)
+
+    checkpoint.save(finished_at=datetime.utcnow().isoformat())
+    elapsed = time.monotonic() - started
+    print(f"{checkpoint.state['scanned']} linhas lidas, {checkpoint.state['updated']} "
+          f"{'mudariam' if args.dry_run else 'atualizadas'} "
+          f"({scanned_now / elapsed if elapsed else 0:.0f} linhas/s nesta execução)")
+    return True
+
+
+def flush(engine, table, checkpoint, item, args):
+    """Grava um bloco classificado, avança o checkpoint e aplica a pausa entre blocos."""
+    last_id, count, future = item
+    changed = future.result()
+    if not args.dry_run:
+        write_chunk(engine, table, changed)
+    checkpoint.save(last_id=last_id,
+                    scanned=checkpoint.state['scanned'] + count,
+                    updated=checkpoint.state['updated'] + len(changed))
+    if args.verbose:
+        print(f"  até id {last_id}: {count} lidas, {len(changed)} alteradas")
+    if args.pause_ms:
+        time.sleep(args.pause_ms / 1000.0)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recalcula sentiment/stage das sales_interactions')
+    parser.add_argument('--config', default='development',
+                        choices=['development', 'production', 'testing'],
+                        help='Configuração do ambiente')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Linhas por bloco (keyset)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='Processos de classificação')
+    parser.add_argument('--max-rows-per-second', type=float, default=0,
+                        help='Limite de linhas lidas por segundo (0 = sem limite)')
+    parser.add_argument('--pause-ms', type=int, default=0, help='Pausa depois de gravar cada bloco')
+    parser.add_argument('--campaign', type=int, help='Só as interações desta campanha')
+    parser.add_argument('--max-id', type=int, help='Último id a processar (padrão: o maior id no início)')
+    parser.add_argument('--language',
+                        help='Léxico para linhas sem agente com idioma (padrão: CLASSIFIER_LANGUAGE)')
+    parser.add_argument('--checkpoint', default='rescore_interactions.checkpoint.json',
+                        help='Arquivo de progresso para retomar')
+    parser.add_argument('--restart', action='store_true', help='Ignora o checkpoint e começa do início')
+    parser.add_argument('--dry-run', action='store_true', help='Só conta as linhas que mudariam')
+    parser.add_argument('--verbose', action='store_true', help='Mostra o progresso de cada bloco')
+
+    args = parser.parse_args()
+
+    print(f"Marketing AI System - Reclassificacao de interacoes")
+    print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("-" * 50)
+
+    success = rescore(args)
+
+    print("-" * 50)
+    if success:
+        print("Operação concluída com sucesso!")
+    else:
+        print("Operação falhou!")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,11 @@ from flask_cors import CORS
 from src.models.db_instance import db
 from src.models.user import User
 from src.models.campaign import Campaign, ProductDatabase, SalesInteraction
-from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow
+from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow, AgentMetricShard
+from src.models.broadcast import BroadcastJob, WhatsAPISessionLimit
+from src.models.webhook import WebhookEvent, WebhookConversationLock
+from src.models.conversation import Conversation, ConversationTurn
+from src.models.strategy_job import StrategyJob
 from src.routes.user import user_bp
 from src.routes.mcp_agent import mcp_agent_bp
 from src.routes.sales_strategy import sales_strategy_bp
@@ -122,13 +126,47 @@ def create_app(config_name=None):
     from src.routes.whatsapi_misc import whatsapi_misc_bp
     app.register_blueprint(whatsapi_misc_bp)
 
+    from src.routes.whatsapi_broadcast import whatsapi_broadcast_bp
+    app.register_blueprint(whatsapi_broadcast_bp)
+
+    # Retomar broadcasts interrompidos e processar novos jobs
+    from src.services.broadcast_service import broadcast_service
+    broadcast_service.init_app(app)
+
+    # Processar webhooks enfileirados em segundo plano
+    from src.services.webhook_queue import webhook_queue
+    webhook_queue.init_app(app)
+
+    # Resumir conversas longas em segundo plano
+    from src.services.conversation_store import conversation_store
+    conversation_store.init_app(app)
+
+    # Gerações longas de estratégias rodam como jobs
+    from src.services.strategy_jobs import strategy_jobs
+    strategy_jobs.init_app(app)
+
+    # Interações e métricas dos agentes são gravadas em lote
+    from src.services.write_behind import write_behind
+    write_behind.init_app(app)
+
+    # Consolidar periodicamente os contadores de métricas dos agentes
+    from src.services.agent_metrics import agent_metrics
+    agent_metrics.init_app(app)
+
+    # Verificar periodicamente a versão dos agentes e campanhas em cache
+    from src.services.agent_cache import agent_cache
+    agent_cache.init_app(app)
+
     return app
 
 app = create_app()
 
 # Import all models to ensure they're created
 from src.models.campaign import Campaign, ProductDatabase, SalesInteraction
-from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow
+from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow, AgentMetricShard
+from src.models.broadcast import BroadcastJob, WhatsAPISessionLimit
+from src.models.webhook import WebhookEvent, WebhookConversationLock
+from src.models.conversation import Conversation, ConversationTurn
 
 with app.app_context():
     db.create_all()
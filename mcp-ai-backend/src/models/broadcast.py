@@ -0,0 +1,75 @@
+from datetime import datetime
+import json
+from src.models.db_instance import db
+
+class BroadcastJob(db.Model):
+    __tablename__ = 'broadcast_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    session = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(255))
+
+    # Content
+    template = db.Column(db.Text, nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # JSON string of recipients
+    options = db.Column(db.Text)  # JSON string merged into every send-message payload
+
+    # Progress / checkpoint
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, cancelled, failed
+    total = db.Column(db.Integer, default=0)
+    cursor = db.Column(db.Integer, default=0)  # index of the next recipient to send
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_errors = db.Column(db.Text)  # JSON string of the most recent failures
+    rate_per_second = db.Column(db.Float)  # optional per-job cap below the session limit
+
+    # Lease held by the worker currently running the job
+    locked_by = db.Column(db.String(255))
+    heartbeat_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # claims so far
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        processed = (self.sent_count or 0) + (self.failed_count or 0)
+        elapsed = None
+        if self.started_at:
+            elapsed = ((self.finished_at or self.heartbeat_at or datetime.utcnow()) - self.started_at).total_seconds()
+        return {
+            'id': self.id,
+            'name': self.name,
+            'session': self.session,
+            'status': self.status,
+            'progress': {
+                'total': self.total,
+                'sent': self.sent_count,
+                'failed': self.failed_count,
+                'pending': max(0, (self.total or 0) - (self.cursor or 0)),
+                'throughput_per_second': round(processed / elapsed, 2) if elapsed else 0.0
+            },
+            'rate_per_second': self.rate_per_second,
+            'last_errors': json.loads(self.last_errors) if self.last_errors else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class WhatsAPISessionLimit(db.Model):
+    __tablename__ = 'whatsapi_session_limits'
+
+    id = db.Column(db.Integer, primary_key=True)
+    session = db.Column(db.String(100), unique=True, nullable=False)
+    rate_per_second = db.Column(db.Float, nullable=False)
+    burst = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'session': self.session,
+            'rate_per_second': self.rate_per_second,
+            'burst': self.burst,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -38,6 +38,7 @@ class Campaign(db.Model):
     # Sales specific
     sales_strategy = db.Column(db.String(50))  # consultative, direct, nurturing, upsell
     product_database_id = db.Column(db.Integer, db.ForeignKey('product_databases.id'))
+    agent_id = db.Column(db.Integer, db.ForeignKey('mcp_agents.id'))  # agent answering this campaign
     
     # Metrics
     reach = db.Column(db.Integer, default=0)
@@ -78,6 +79,7 @@ class Campaign(db.Model):
                 'timezone': self.timezone
             },
             'sales_strategy': self.sales_strategy,
+            'agent_id': self.agent_id,
             'metrics': {
                 'reach': self.reach,
                 'conversions': self.conversions,
@@ -0,0 +1,62 @@
+from datetime import datetime
+from src.models.db_instance import db
+
+class Conversation(db.Model):
+    """Server-side conversation of one customer with one agent on one platform."""
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        db.UniqueConstraint('agent_id', 'platform', 'customer_key', name='uq_conversations_agent_platform_customer'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('mcp_agents.id'), nullable=False)
+    platform = db.Column(db.String(50), nullable=False)
+    customer_key = db.Column(db.String(255), nullable=False)  # customer id, phone or email
+
+    # Rolling summary of the turns that were compacted away
+    summary = db.Column(db.Text)
+    summarized_turns = db.Column(db.Integer, default=0)
+
+    turn_count = db.Column(db.Integer, default=0)
+    pending_turns = db.Column(db.Integer, default=0)  # turns kept verbatim (not summarized yet)
+    pending_tokens = db.Column(db.Integer, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_turn_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'agent_id': self.agent_id,
+            'platform': self.platform,
+            'customer_key': self.customer_key,
+            'summary': self.summary,
+            'summarized_turns': self.summarized_turns,
+            'turn_count': self.turn_count,
+            'pending_turns': self.pending_turns,
+            'pending_tokens': self.pending_tokens,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_turn_at': self.last_turn_at.isoformat() if self.last_turn_at else None
+        }
+
+class ConversationTurn(db.Model):
+    __tablename__ = 'conversation_turns'
+    __table_args__ = (
+        db.Index('ix_conversation_turns_conversation_id_id', 'conversation_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'role': self.role,
+            'content': self.content,
+            'tokens': self.tokens,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -26,11 +26,18 @@ class MCPAgent(db.Model):
     max_tokens = db.Column(db.Integer, default=1000)
     system_prompt = db.Column(db.Text)
     
+    # Runtime tuning (JSON): coalesce_window_seconds, coalesce_max_wait_seconds, ...
+    runtime_config = db.Column(db.Text)
+    
+    # Bumped on every configuration change; cached agent snapshots compare against it
+    config_version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    
     # Performance metrics
     total_interactions = db.Column(db.Integer, default=0)
     successful_conversions = db.Column(db.Integer, default=0)
     average_response_time = db.Column(db.Float, default=0.0)
-    customer_satisfaction = db.Column(db.Float, default=0.0)
+    customer_satisfaction = db.Column(db.Float, default=0.0)  # running mean of satisfaction_count samples
+    satisfaction_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     # Status
     is_active = db.Column(db.Boolean, default=True)
@@ -43,6 +50,9 @@ class MCPAgent(db.Model):
     # User relationship
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    def get_runtime_config(self):
+        return json.loads(self.runtime_config) if self.runtime_config else {}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -58,13 +68,16 @@ class MCPAgent(db.Model):
                     'temperature': self.temperature,
                     'max_tokens': self.max_tokens,
                     'system_prompt': self.system_prompt
-                }
+                },
+                'runtime': self.get_runtime_config(),
+                'version': self.config_version
             },
             'metrics': {
                 'total_interactions': self.total_interactions,
                 'successful_conversions': self.successful_conversions,
                 'average_response_time': self.average_response_time,
                 'customer_satisfaction': self.customer_satisfaction,
+                'satisfaction_count': self.satisfaction_count or 0,
                 'conversion_rate': (self.successful_conversions / self.total_interactions * 100) if self.total_interactions > 0 else 0
             },
             'status': {
@@ -75,6 +88,18 @@ class MCPAgent(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+class AgentMetricShard(db.Model):
+    """Pending metric deltas of an agent, spread over shards so workers never contend on one row."""
+    __tablename__ = 'agent_metric_shards'
+    
+    agent_id = db.Column(db.Integer, db.ForeignKey('mcp_agents.id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    interactions = db.Column(db.Integer, default=0, nullable=False)
+    conversions = db.Column(db.Integer, default=0, nullable=False)
+    satisfaction_sum = db.Column(db.Float, default=0.0, nullable=False)
+    satisfaction_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class AgentKnowledge(db.Model):
     __tablename__ = 'agent_knowledge'
     
@@ -92,6 +117,10 @@ class AgentKnowledge(db.Model):
     usage_count = db.Column(db.Integer, default=0)
     effectiveness_score = db.Column(db.Float, default=0.0)
     
+    # Dense retrieval: float16 vector bytes and the embedder that produced them
+    embedding = db.Column(db.LargeBinary)
+    embedding_model = db.Column(db.String(100))
+    
     # Status
     is_active = db.Column(db.Boolean, default=True)
     
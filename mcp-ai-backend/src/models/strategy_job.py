@@ -0,0 +1,55 @@
+from datetime import datetime
+import json
+from src.models.db_instance import db
+
+class StrategyJob(db.Model):
+    """Long-running sales strategy generation run by the job workers."""
+    __tablename__ = 'strategy_jobs'
+    __table_args__ = (
+        db.Index('ix_strategy_jobs_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # analyze_products, generate_strategies, ...
+    input_hash = db.Column(db.String(64), nullable=False, unique=True)  # sha256 of kind + params
+    params = db.Column(db.Text, nullable=False)  # JSON string of the method arguments
+    user_id = db.Column(db.Integer)
+
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    result = db.Column(db.Text)  # JSON string of the generation result
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    requests = db.Column(db.Integer, default=1)  # submissions served by this job (dedupe hits + 1)
+
+    # Lease held by the worker currently running the job
+    locked_by = db.Column(db.String(255))
+    heartbeat_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    def to_dict(self, include_result=True):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'input_hash': self.input_hash,
+            'attempts': self.attempts,
+            'requests': self.requests,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_seconds': (self.finished_at - self.started_at).total_seconds()
+            if self.finished_at and self.started_at else None
+        }
+        if include_result:
+            data['result'] = self.get_result()
+        return data
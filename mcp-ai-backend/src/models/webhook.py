@@ -0,0 +1,56 @@
+from datetime import datetime
+import json
+from src.models.db_instance import db
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        db.Index('ix_webhook_events_status_conversation', 'status', 'conversation_key', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(50), nullable=False)  # zapi, whatsapp, ...
+    conversation_key = db.Column(db.String(255), nullable=False)  # events sharing a key run in order
+    user_id = db.Column(db.Integer)
+    payload = db.Column(db.Text, nullable=False)  # JSON string of the provider event
+
+    status = db.Column(db.String(20), default='pending')  # pending, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # retry backoff
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+    def get_payload(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'provider': self.provider,
+            'conversation_key': self.conversation_key,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
+class WebhookConversationLock(db.Model):
+    """Lease that gives one worker exclusive, in-order processing of a conversation."""
+    __tablename__ = 'webhook_conversation_locks'
+
+    conversation_key = db.Column(db.String(255), primary_key=True)
+    locked_by = db.Column(db.String(255))
+    locked_at = db.Column(db.DateTime)
+
+class WebhookMessageId(db.Model):
+    """Provider message ids already accepted, used to drop redelivered webhooks."""
+    __tablename__ = 'webhook_message_ids'
+
+    provider = db.Column(db.String(50), primary_key=True)
+    message_id = db.Column(db.String(255), primary_key=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
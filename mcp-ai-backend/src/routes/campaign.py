@@ -3,12 +3,14 @@ import json
 from flask import Blueprint, request, jsonify
 from src.models.campaign import Campaign
 from src.models.db_instance import db
+from src.services.agent_cache import agent_cache
 
 campaign_bp = Blueprint('campaign', __name__)
 
 @campaign_bp.route('/campaigns/<int:campaign_id>', methods=['PUT'])
 def update_campaign(campaign_id):
     campaign = Campaign.query.get_or_404(campaign_id)
+    previous_user_id = campaign.user_id
     data = request.get_json()
     campaign.name = data.get('name', campaign.name)
     campaign.objective = data.get('objective', campaign.objective)
@@ -28,14 +30,18 @@ def update_campaign(campaign_id):
     campaign.sales_strategy = data.get('sales_strategy', campaign.sales_strategy)
     campaign.user_id = data.get('user_id', campaign.user_id)
     campaign.product_database_id = data.get('product_database_id', campaign.product_database_id)
+    campaign.agent_id = data.get('agent_id', campaign.agent_id)
     db.session.commit()
+    agent_cache.invalidate_campaign(campaign.id, previous_user_id, campaign.user_id)
     return jsonify(campaign.to_dict())
 
 @campaign_bp.route('/campaigns/<int:campaign_id>', methods=['DELETE'])
 def delete_campaign(campaign_id):
     campaign = Campaign.query.get_or_404(campaign_id)
+    user_id = campaign.user_id
     db.session.delete(campaign)
     db.session.commit()
+    agent_cache.invalidate_campaign(campaign_id, user_id)
     return '', 204
 
 @campaign_bp.route('/campaigns', methods=['POST'])
@@ -60,10 +66,12 @@ def create_campaign():
             timezone=data.get('schedule', {}).get('timezone'),
             sales_strategy=data.get('sales_strategy'),
             user_id=data.get('user_id'),
-            product_database_id=data.get('product_database_id')
+            product_database_id=data.get('product_database_id'),
+            agent_id=data.get('agent_id')
         )
         db.session.add(campaign)
         db.session.commit()
+        agent_cache.invalidate_campaign(campaign.id, campaign.user_id)
         return jsonify(campaign.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -1,5 +1,19 @@
 from flask import Blueprint, request, jsonify
 from src.services.mcp_agent_service import mcp_agent_service
+from src.services.sse import sse_event, sse_response, wants_stream
+from src.services.response_cache import response_cache
+from src.services.knowledge_index import knowledge_index
+from src.services.vector_index import vector_index
+from src.services.prompt_builder import prompt_builder
+from src.services.conversation_store import conversation_store
+from src.services.model_router import model_router
+from src.services.llm_gateway import llm_gateway
+from src.services.structured_output import structured_output
+from src.services.interaction_classifier import interaction_classifier
+from src.services.write_behind import write_behind
+from src.services.agent_metrics import agent_metrics
+from src.services.agent_cache import agent_cache
+from src.models.db_instance import db
 from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow
 from src.models.campaign import Campaign, SalesInteraction
 import json
@@ -39,7 +53,8 @@ def create_agent():
             'model_name': data.get('model_name', 'gpt-4'),
             'temperature': data.get('temperature', 0.7),
             'max_tokens': data.get('max_tokens', 1000),
-            'system_prompt': data.get('system_prompt')
+            'system_prompt': data.get('system_prompt'),
+            'runtime_config': data.get('runtime_config', {})
         }
         
         # Create agent using service
@@ -105,11 +120,15 @@ def update_agent(agent_id):
             agent.max_tokens = data['max_tokens']
         if 'system_prompt' in data:
             agent.system_prompt = data['system_prompt']
+        if 'runtime_config' in data:
+            agent.runtime_config = json.dumps(data['runtime_config'])
         if 'is_active' in data:
             agent.is_active = data['is_active']
         
-        # Save changes (would need db session here)
-        # db.session.commit()
+        # New configuration version: cached snapshots of this agent are stale in every worker
+        agent.config_version = MCPAgent.config_version + 1
+        db.session.commit()
+        agent_cache.invalidate_agent(agent.id, agent.user_id)
         
         return jsonify({
             'success': True,
@@ -121,15 +140,15 @@ def update_agent(agent_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @mcp_agent_bp.route('/agents/<int:agent_id>/chat', methods=['POST'])
-def chat_with_agent():
-    """Send a message to the agent and get AI response."""
+def chat_with_agent(agent_id):
+    """Send a message to the agent and get AI response (SSE stream when requested)."""
     try:
         data = request.get_json()
         
         if not data.get('message'):
             return jsonify({'success': False, 'error': 'Mensagem é obrigatória'}), 400
         
-        agent = MCPAgent.query.get(agent_id)
+        agent = agent_cache.agent(agent_id)
         if not agent:
             return jsonify({'success': False, 'error': 'Agente não encontrado'}), 404
         
@@ -141,6 +160,12 @@ def chat_with_agent():
             'conversation_history': data.get('conversation_history', [])
         }
         
+        if wants_stream(data, request):
+            def generate():
+                for event, payload in mcp_agent_service.stream_message(agent, data['message'], context):
+                    yield sse_event(event, payload)
+            return sse_response(generate())
+        
         # Process message with agent
         result = mcp_agent_service.process_message(
             agent=agent,
@@ -242,9 +267,8 @@ def add_agent_knowledge(agent_id):
             priority=data.get('priority', 1)
         )
         
-        # Save to database (would need db session here)
-        # db.session.add(knowledge)
-        # db.session.commit()
+        db.session.add(knowledge)
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -252,9 +276,99 @@ def add_agent_knowledge(agent_id):
             'message': 'Conhecimento adicionado com sucesso!'
         })
         
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@mcp_agent_bp.route('/agents/<int:agent_id>/knowledge/<int:knowledge_id>', methods=['PUT'])
+def update_agent_knowledge(agent_id, knowledge_id):
+    """Update a knowledge entry of an agent."""
+    try:
+        knowledge = AgentKnowledge.query.filter_by(id=knowledge_id, agent_id=agent_id).first()
+        if not knowledge:
+            return jsonify({'success': False, 'error': 'Conhecimento não encontrado'}), 404
+        
+        data = request.get_json()
+        for field in ('category', 'title', 'content', 'priority', 'effectiveness_score', 'is_active'):
+            if field in data:
+                setattr(knowledge, field, data[field])
+        if 'tags' in data:
+            knowledge.tags = json.dumps(data['tags'])
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'knowledge': knowledge.to_dict(),
+            'message': 'Conhecimento atualizado com sucesso!'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@mcp_agent_bp.route('/agents/<int:agent_id>/knowledge/search', methods=['GET'])
+def search_agent_knowledge(agent_id):
+    """Rank an agent's knowledge entries for a query (what the agent would see)."""
+    try:
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', type=int)
+        mode = request.args.get('mode', 'bm25')
+        
+        if mode in ('dense', 'hybrid'):
+            results = vector_index.search(agent_id, query, limit, hybrid=(mode == 'hybrid'))
+        else:
+            results = knowledge_index.search(agent_id, query, limit)
+        
+        return jsonify({
+            'success': True,
+            'mode': mode,
+            'results': results
+        })
+        
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@mcp_agent_bp.route('/agents/<int:agent_id>/conversation', methods=['GET'])
+def get_agent_conversation(agent_id):
+    """Stored history of one customer: rolling summary plus the most recent turns."""
+    try:
+        platform = request.args.get('platform', 'web')
+        customer = request.args.get('customer')
+        if not customer:
+            return jsonify({'success': False, 'error': 'Parâmetro customer é obrigatório'}), 400
+        
+        summary, turns = conversation_store.load(agent_id, platform, customer, request.args.get('limit', type=int))
+        
+        return jsonify({
+            'success': True,
+            'summary': summary,
+            'turns': turns
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@mcp_agent_bp.route('/agents/<int:agent_id>/conversation', methods=['DELETE'])
+def delete_agent_conversation(agent_id):
+    """Forget the stored history of one customer."""
+    try:
+        platform = request.args.get('platform', 'web')
+        customer = request.args.get('customer')
+        if not customer:
+            return jsonify({'success': False, 'error': 'Parâmetro customer é obrigatório'}), 400
+        
+        deleted = conversation_store.forget(agent_id, platform, customer)
+        
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @mcp_agent_bp.route('/agents/<int:agent_id>/flows', methods=['GET'])
 def get_conversation_flows(agent_id):
     """Get conversation flows for an agent."""
@@ -337,3 +451,27 @@ def test_openai_connection():
             'message': 'Erro na conexão com OpenAI. Verifique as configurações.'
         }), 500
 
+
+@mcp_agent_bp.route('/metrics', methods=['GET'])
+def get_agent_runtime_metrics():
+    """Runtime metrics of the agent pipeline (response cache, ...)."""
+    try:
+        return jsonify({
+            'success': True,
+            'metrics': {
+                'response_cache': response_cache.stats(),
+                'knowledge_index': knowledge_index.stats(),
+                'vector_index': vector_index.stats(),
+                'prompt_builder': prompt_builder.stats(),
+                'conversation_store': conversation_store.stats(),
+                'model_router': model_router.stats(),
+                'llm_gateway': llm_gateway.stats(),
+                'structured_output': structured_output.stats(),
+                'interaction_classifier': interaction_classifier.stats(),
+                'write_behind': write_behind.stats(),
+                'agent_metrics': agent_metrics.stats(),
+                'agent_cache': agent_cache.stats()
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
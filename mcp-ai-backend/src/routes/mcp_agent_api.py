@@ -3,6 +3,8 @@ import json
 from flask import Blueprint, request, jsonify
 from src.models.mcp_agent import MCPAgent
 from src.models.db_instance import db
+from src.services.agent_cache import agent_cache
+from src.services.agent_metrics import agent_metrics
 
 mcp_agent_api_bp = Blueprint('mcp_agent_api', __name__)
 
@@ -20,16 +22,23 @@ def update_mcp_agent(agent_id):
     agent.temperature = data.get('temperature', agent.temperature)
     agent.max_tokens = data.get('max_tokens', agent.max_tokens)
     agent.system_prompt = data.get('system_prompt', agent.system_prompt)
+    agent.runtime_config = json.dumps(data.get('runtime_config', agent.get_runtime_config()))
     agent.is_active = data.get('is_active', agent.is_active)
     agent.is_learning = data.get('is_learning', agent.is_learning)
+    agent.config_version = MCPAgent.config_version + 1
     db.session.commit()
+    agent_cache.invalidate_agent(agent.id, agent.user_id)
     return jsonify(agent.to_dict())
 
 @mcp_agent_api_bp.route('/mcp_agents/<int:agent_id>', methods=['DELETE'])
 def delete_mcp_agent(agent_id):
     agent = MCPAgent.query.get_or_404(agent_id)
+    user_id = agent.user_id
+    # Pending metric shards reference the agent until the next rollup
+    agent_metrics.forget(agent_id)
     db.session.delete(agent)
     db.session.commit()
+    agent_cache.invalidate_agent(agent_id, user_id)
     return '', 204
 
 @mcp_agent_api_bp.route('/mcp_agents', methods=['POST'])
@@ -47,11 +56,13 @@ def create_mcp_agent():
             temperature=data.get('temperature', 0.7),
             max_tokens=data.get('max_tokens', 1000),
             system_prompt=data.get('system_prompt'),
+            runtime_config=json.dumps(data.get('runtime_config', {})),
             is_active=data.get('is_active', True),
             is_learning=data.get('is_learning', True)
         )
         db.session.add(agent)
         db.session.commit()
+        agent_cache.invalidate_agent(agent.id, agent.user_id)
         return jsonify(agent.to_dict()), 201
     except Exception as e:
         db.session.rollback()
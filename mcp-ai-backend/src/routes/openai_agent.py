@@ -1,7 +1,8 @@
 import os
 import logging
 from flask import Blueprint, request, jsonify
-import openai
+from src.services.llm_gateway import llm_gateway, PRIORITY_LIVE
+from src.services.sse import sse_event, sse_response, wants_stream
 
 openai_bp = Blueprint('openai_bp', __name__)
 
@@ -22,9 +23,8 @@ if not logger.hasHandlers():
     logger.addHandler(console_handler)
 
 
-# Nova forma de autenticação e uso do client OpenAI v1.x
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Client OpenAI v1.x compartilhado: chamadas passam pelo gateway (concorrência, RPM/TPM, prioridade)
+client = llm_gateway.client(PRIORITY_LIVE)
 
 @openai_bp.route('/api/ai/ask', methods=['POST'])
 def ask_openai():
@@ -42,9 +42,12 @@ def ask_openai():
                 "Responda sempre com foco em estratégias, dicas, análise de resultados, sugestões de conteúdo, segmentação de público, otimização de campanhas e melhores práticas para anúncios em plataformas como Facebook, Instagram, WhatsApp, Google Ads e outras. Seja prático, objetivo e use linguagem acessível para profissionais de marketing e empreendedores."
             )
         }
+        messages = [system_message, {"role": "user", "content": prompt}]
+        if wants_stream(data, request):
+            return sse_response(stream_answer(messages))
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[system_message, {"role": "user", "content": prompt}]
+            messages=messages
         )
         answer = response.choices[0].message.content
         logger.info(f"Resposta da OpenAI: {answer}")
@@ -52,3 +55,27 @@ def ask_openai():
     except Exception as e:
         logger.error(f"Erro ao consultar OpenAI: {e}")
         return jsonify({'error': str(e)}), 500
+
+def stream_answer(messages):
+    """Repassa os tokens da OpenAI como eventos SSE e encerra com a resposta completa"""
+    try:
+        stream = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        parts = []
+        tokens_used = None
+        for chunk in stream:
+            if chunk.usage:
+                tokens_used = chunk.usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield sse_event('token', {'content': chunk.choices[0].delta.content})
+        answer = ''.join(parts)
+        logger.info(f"Resposta da OpenAI (stream): {answer}")
+        yield sse_event('done', {'response': answer, 'tokens_used': tokens_used})
+    except Exception as e:
+        logger.error(f"Erro ao consultar OpenAI: {e}")
+        yield sse_event('error', {'error': str(e)})
@@ -1,9 +1,54 @@
 from flask import Blueprint, request, jsonify
 from src.services.sales_strategy_service import sales_strategy_service
+from src.services.strategy_jobs import strategy_jobs
+from src.services.sse import sse_event, sse_response, wants_stream
+from src.models.db_instance import db
+import os
 import json
+import time
 
 sales_strategy_bp = Blueprint('sales_strategy', __name__)
 
+VALID_PLATFORMS = ['whatsapp', 'instagram', 'facebook', 'tiktok', 'linkedin', 'email']
+
+# Long-poll e SSE terminam antes do timeout do worker (gunicorn sync: 30s por padrão)
+JOB_MAX_WAIT_SECONDS = float(os.getenv('STRATEGY_JOB_MAX_WAIT', 20))
+
+# Mesmos campos obrigatórios das rotas síncronas
+JOB_REQUIRED_PARAMS = {
+    'analyze_products': ['products'],
+    'generate_strategies': ['product_analysis', 'target_audience', 'campaign_objective'],
+    'create_conversation_flow': ['strategy', 'platform'],
+    'optimize_strategy': ['strategy', 'platform']
+}
+
+def _wants_job(data):
+    """Modo assíncrono: {"async": true} ou ?async=1 devolve um job em vez de esperar a geração."""
+    return bool(data.get('async')) or request.args.get('async') in ('1', 'true')
+
+def _job_params_error(kind, params):
+    """Mensagem de erro se os parâmetros do job não servem para o kind, senão None."""
+    if not isinstance(params, dict):
+        return 'Campo params deve ser um objeto'
+    for field in JOB_REQUIRED_PARAMS.get(kind, []):
+        if field not in params:
+            return f'Campo params.{field} é obrigatório'
+    if kind == 'analyze_products' and (not isinstance(params['products'], list) or not params['products']):
+        return 'Lista de produtos deve conter pelo menos um item'
+    if kind == 'optimize_strategy' and str(params['platform']).lower() not in VALID_PLATFORMS:
+        return f'Plataforma deve ser uma das seguintes: {", ".join(VALID_PLATFORMS)}'
+    return None
+
+def _job_response(kind, params, data):
+    job, deduplicated = strategy_jobs.submit(kind, params, force=bool(data.get('force')))
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'deduplicated': deduplicated,
+        'job': job.to_dict(include_result=job.status == 'completed')
+    }), 202
+
 @sales_strategy_bp.route('/analyze-products', methods=['POST'])
 def analyze_products():
     """Analisa banco de dados de produtos e gera insights."""
@@ -23,6 +68,9 @@ def analyze_products():
                 'error': 'Lista de produtos deve conter pelo menos um item'
             }), 400
         
+        if _wants_job(data):
+            return _job_response('analyze_products', {'products': products}, data)
+        
         # Analisar produtos
         analysis_result = sales_strategy_service.analyze_product_database(products)
         
@@ -49,6 +97,9 @@ def generate_strategies():
                     'error': f'Campo {field} é obrigatório'
                 }), 400
         
+        if _wants_job(data):
+            return _job_response('generate_strategies', {field: data[field] for field in required_fields}, data)
+        
         # Gerar estratégias
         strategies = sales_strategy_service.generate_sales_strategies(
             product_analysis=data['product_analysis'],
@@ -85,11 +136,10 @@ def optimize_strategy():
         platform = data['platform']
         
         # Validar plataforma
-        valid_platforms = ['whatsapp', 'instagram', 'facebook', 'tiktok', 'linkedin', 'email']
-        if platform.lower() not in valid_platforms:
+        if platform.lower() not in VALID_PLATFORMS:
             return jsonify({
                 'success': False,
-                'error': f'Plataforma deve ser uma das seguintes: {", ".join(valid_platforms)}'
+                'error': f'Plataforma deve ser uma das seguintes: {", ".join(VALID_PLATFORMS)}'
             }), 400
         
         # Otimizar estratégia
@@ -111,6 +161,91 @@ def optimize_strategy():
             'error': f'Erro ao otimizar estratégia: {str(e)}'
         }), 500
 
+@sales_strategy_bp.route('/optimize-strategy/batch', methods=['POST'])
+def optimize_strategy_batch():
+    """Otimiza uma estratégia para várias plataformas em paralelo (SSE com ?stream=1 ou tudo de uma vez)."""
+    try:
+        data = request.get_json()
+        
+        if not data or 'strategy' not in data or not data.get('platforms'):
+            return jsonify({
+                'success': False,
+                'error': 'Estratégia e lista de plataformas são obrigatórias'
+            }), 400
+        
+        if not isinstance(data['platforms'], list) or not all(isinstance(p, str) for p in data['platforms']):
+            return jsonify({
+                'success': False,
+                'error': 'Campo platforms deve ser uma lista de nomes de plataforma'
+            }), 400
+        
+        max_concurrency = data.get('max_concurrency')
+        if max_concurrency is not None and (isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int)
+                                            or max_concurrency < 1):
+            return jsonify({
+                'success': False,
+                'error': 'Campo max_concurrency deve ser um inteiro positivo'
+            }), 400
+        
+        strategy = data['strategy']
+        platforms = list(dict.fromkeys(p.lower() for p in data['platforms']))
+        invalid = [p for p in platforms if p not in VALID_PLATFORMS]
+        if invalid:
+            return jsonify({
+                'success': False,
+                'error': f'Plataformas inválidas: {", ".join(invalid)}. Use: {", ".join(VALID_PLATFORMS)}'
+            }), 400
+        
+        results = sales_strategy_service.optimize_strategy_for_platforms(
+            strategy=strategy,
+            platforms=platforms,
+            max_concurrency=max_concurrency
+        )
+        
+        if wants_stream(data, request):
+            return sse_response(_stream_optimizations(results))
+        
+        started = time.perf_counter()
+        optimized, timing = {}, {}
+        for platform, optimized_strategy, seconds in results:
+            optimized[platform] = optimized_strategy
+            timing[platform] = round(seconds * 1000, 1)
+        
+        return jsonify({
+            'success': True,
+            'optimized_strategies': optimized,
+            'timing_ms': timing,
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            'sequential_ms': round(sum(timing.values()), 1),
+            'message': f'Estratégia otimizada para {len(optimized)} plataformas!'
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Erro ao otimizar estratégia: {str(e)}'
+        }), 500
+
+def _stream_optimizations(results):
+    """Um evento 'result' por plataforma assim que termina e 'done' com o tempo de cada uma."""
+    started = time.perf_counter()
+    timing = {}
+    try:
+        for platform, optimized_strategy, seconds in results:
+            timing[platform] = round(seconds * 1000, 1)
+            yield sse_event('result', {
+                'platform': platform,
+                'optimized_strategy': optimized_strategy,
+                'elapsed_ms': timing[platform]
+            })
+        yield sse_event('done', {
+            'timing_ms': timing,
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            'sequential_ms': round(sum(timing.values()), 1)
+        })
+    except Exception as e:
+        yield sse_event('error', {'error': str(e)})
+
 @sales_strategy_bp.route('/create-conversation-flow', methods=['POST'])
 def create_conversation_flow():
     """Cria um fluxo de conversa para uma estratégia específica."""
@@ -126,6 +261,9 @@ def create_conversation_flow():
         strategy = data['strategy']
         platform = data['platform']
         
+        if _wants_job(data):
+            return _job_response('create_conversation_flow', {'strategy': strategy, 'platform': platform}, data)
+        
         # Criar fluxo de conversa
         conversation_flow = sales_strategy_service.create_conversation_flow(
             strategy=strategy,
@@ -144,6 +282,89 @@ def create_conversation_flow():
             'error': f'Erro ao criar fluxo de conversa: {str(e)}'
         }), 500
 
+@sales_strategy_bp.route('/jobs', methods=['POST'])
+def create_strategy_job():
+    """Enfileira uma geração longa (analyze_products, generate_strategies, create_conversation_flow, optimize_strategy)."""
+    try:
+        data = request.get_json() or {}
+        
+        kind = data.get('kind')
+        if kind not in strategy_jobs.kinds:
+            return jsonify({
+                'success': False,
+                'error': f'Campo kind deve ser um dos seguintes: {", ".join(strategy_jobs.kinds)}'
+            }), 400
+        
+        params = data.get('params') or {}
+        error = _job_params_error(kind, params)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        
+        return _job_response(kind, params, data)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'Erro ao criar job: {str(e)}'
+        }), 500
+
+@sales_strategy_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_strategy_job(job_id):
+    """Status e resultado de um job; ?wait=N espera até N segundos (máx. STRATEGY_JOB_MAX_WAIT) e ?stream=1 acompanha via SSE."""
+    try:
+        if wants_stream({}, request):
+            return sse_response(_stream_job(job_id))
+        
+        wait = min(request.args.get('wait', 0, type=float), JOB_MAX_WAIT_SECONDS)
+        job = strategy_jobs.wait(job_id, wait) if wait > 0 else strategy_jobs.get_job(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job.to_dict()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Erro ao consultar job: {str(e)}'
+        }), 500
+
+def _stream_job(job_id):
+    """
+    Emite 'status' a cada mudança e termina com 'done' (ou 'error') trazendo o resultado.
+    
+    Passado STRATEGY_JOB_MAX_WAIT termina com 'timeout' (job ainda em andamento): o cliente reconecta.
+    """
+    last_status = None
+    deadline = time.monotonic() + JOB_MAX_WAIT_SECONDS
+    while True:
+        job = strategy_jobs.get_job(job_id)
+        if job is None:
+            yield sse_event('error', {'error': 'Job não encontrado'})
+            return
+        if job.status in ('completed', 'failed'):
+            yield sse_event('done' if job.status == 'completed' else 'error', job.to_dict())
+            return
+        if time.monotonic() >= deadline:
+            yield sse_event('timeout', job.to_dict(include_result=False))
+            return
+        if job.status != last_status:
+            last_status = job.status
+            yield sse_event('status', job.to_dict(include_result=False))
+        db.session.commit()
+        time.sleep(1.0)
+
+@sales_strategy_bp.route('/jobs/stats', methods=['GET'])
+def strategy_job_stats():
+    """Fila de jobs de estratégia"""
+    try:
+        return jsonify({'success': True, 'data': strategy_jobs.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @sales_strategy_bp.route('/evaluate-performance', methods=['POST'])
 def evaluate_performance():
     """Avalia a performance de uma estratégia."""
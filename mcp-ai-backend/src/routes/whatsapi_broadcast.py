@@ -0,0 +1,79 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from src.services.broadcast_service import broadcast_service
+from src.models.broadcast import BroadcastJob
+from src.services.credential_service import get_user_session
+
+whatsapi_broadcast_bp = Blueprint('whatsapi_broadcast', __name__)
+
+@whatsapi_broadcast_bp.route('/api/whatsapi/broadcasts', methods=['POST'])
+@jwt_required()
+def create_broadcast():
+    """Create a broadcast job that sends a template to many recipients"""
+    try:
+        data = request.get_json()
+        session = data.get('session') or get_user_session()
+        template = data.get('template')
+        recipients = data.get('recipients')
+
+        if not session:
+            return jsonify({'success': False, 'error': 'session is required'}), 400
+        if not template or not isinstance(recipients, list) or not recipients:
+            return jsonify({'success': False, 'error': 'template and recipients are required'}), 400
+        rate_per_second = data.get('rate_per_second')
+        if rate_per_second is not None:
+            try:
+                rate_per_second = float(rate_per_second)
+            except (TypeError, ValueError):
+                rate_per_second = 0
+            if rate_per_second <= 0:
+                return jsonify({'success': False, 'error': 'rate_per_second must be a positive number'}), 400
+
+        job = broadcast_service.create_job(
+            session=session,
+            template=template,
+            recipients=recipients,
+            user_id=get_jwt_identity(),
+            name=data.get('name'),
+            options=data.get('options'),
+            rate_per_second=rate_per_second
+        )
+        return jsonify({'success': True, 'data': job.to_dict()}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@whatsapi_broadcast_bp.route('/api/whatsapi/broadcasts', methods=['GET'])
+@jwt_required()
+def list_broadcasts():
+    """List the current user's broadcast jobs"""
+    try:
+        jobs = BroadcastJob.query.filter_by(user_id=get_jwt_identity()).order_by(BroadcastJob.id.desc()).all()
+        return jsonify({'success': True, 'data': [job.to_dict() for job in jobs]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@whatsapi_broadcast_bp.route('/api/whatsapi/broadcasts/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_broadcast(job_id):
+    """Get broadcast job progress"""
+    try:
+        job = broadcast_service.get_job(job_id, user_id=get_jwt_identity())
+        if not job:
+            return jsonify({'success': False, 'error': 'broadcast not found'}), 404
+
+        return jsonify({'success': True, 'data': job.to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@whatsapi_broadcast_bp.route('/api/whatsapi/broadcasts/<int:job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_broadcast(job_id):
+    """Cancel a queued or running broadcast job"""
+    try:
+        user_id = get_jwt_identity()
+        if not broadcast_service.cancel_job(job_id, user_id=user_id):
+            return jsonify({'success': False, 'error': 'broadcast not found or already finished'}), 404
+
+        return jsonify({'success': True, 'data': broadcast_service.get_job(job_id, user_id=user_id).to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_business_bp = Blueprint('whatsapi_business', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 # Products Management
 @whatsapi_business_bp.route('/api/whatsapi/business/products', methods=['GET'])
@@ -27,7 +19,7 @@ def get_products():
         result = whatsapi_service.get_products(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/by-id', methods=['GET'])
 @jwt_required()
@@ -44,7 +36,7 @@ def get_product_by_id():
         result = whatsapi_service.get_product_by_id(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products', methods=['POST'])
 @jwt_required()
@@ -60,7 +52,7 @@ def add_product():
         result = whatsapi_service.add_product(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/edit', methods=['POST'])
 @jwt_required()
@@ -76,7 +68,7 @@ def edit_product():
         result = whatsapi_service.edit_product(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/delete', methods=['POST'])
 @jwt_required()
@@ -92,7 +84,7 @@ def delete_products():
         result = whatsapi_service.delete_products(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/change-image', methods=['POST'])
 @jwt_required()
@@ -108,7 +100,7 @@ def change_product_image():
         result = whatsapi_service.change_product_image(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/add-image', methods=['POST'])
 @jwt_required()
@@ -124,7 +116,7 @@ def add_product_image():
         result = whatsapi_service.add_product_image(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/remove-image', methods=['POST'])
 @jwt_required()
@@ -140,7 +132,7 @@ def remove_product_image():
         result = whatsapi_service.remove_product_image(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/products/set-visibility', methods=['POST'])
 @jwt_required()
@@ -156,7 +148,7 @@ def set_product_visibility():
         result = whatsapi_service.set_product_visibility(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Collections Management
 @whatsapi_business_bp.route('/api/whatsapi/business/collections', methods=['GET'])
@@ -171,7 +163,7 @@ def get_collections():
         result = whatsapi_service.get_collections(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/collections', methods=['POST'])
 @jwt_required()
@@ -187,7 +179,7 @@ def create_collection():
         result = whatsapi_service.create_collection(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/collections/edit', methods=['POST'])
 @jwt_required()
@@ -203,7 +195,7 @@ def edit_collection():
         result = whatsapi_service.edit_collection(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/collections/delete', methods=['POST'])
 @jwt_required()
@@ -219,7 +211,7 @@ def delete_collection():
         result = whatsapi_service.delete_collection(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Cart and Business Settings
 @whatsapi_business_bp.route('/api/whatsapi/business/set-cart-enabled', methods=['POST'])
@@ -236,7 +228,7 @@ def set_cart_enabled():
         result = whatsapi_service.set_cart_enabled(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/profiles-products', methods=['GET'])
 @jwt_required()
@@ -250,7 +242,7 @@ def get_business_profiles_products():
         result = whatsapi_service.get_business_profiles_products(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/orders/<message_id>', methods=['GET'])
 @jwt_required()
@@ -264,7 +256,7 @@ def get_order_by_message_id(message_id):
         result = whatsapi_service.get_order_by_message_id(session, message_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Community Management
 @whatsapi_business_bp.route('/api/whatsapi/business/community/create', methods=['POST'])
@@ -281,7 +273,7 @@ def create_community():
         result = whatsapi_service.create_community(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/deactivate', methods=['POST'])
 @jwt_required()
@@ -297,7 +289,7 @@ def deactivate_community():
         result = whatsapi_service.deactivate_community(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/add-subgroup', methods=['POST'])
 @jwt_required()
@@ -313,7 +305,7 @@ def add_community_subgroup():
         result = whatsapi_service.add_community_subgroup(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/remove-subgroup', methods=['POST'])
 @jwt_required()
@@ -329,7 +321,7 @@ def remove_community_subgroup():
         result = whatsapi_service.remove_community_subgroup(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/promote-participant', methods=['POST'])
 @jwt_required()
@@ -345,7 +337,7 @@ def promote_community_participant():
         result = whatsapi_service.promote_community_participant(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/demote-participant', methods=['POST'])
 @jwt_required()
@@ -361,7 +353,7 @@ def demote_community_participant():
         result = whatsapi_service.demote_community_participant(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/community/<community_id>/participants', methods=['GET'])
 @jwt_required()
@@ -375,7 +367,7 @@ def get_community_participants(community_id):
         result = whatsapi_service.get_community_participants(session, community_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Newsletter Management
 @whatsapi_business_bp.route('/api/whatsapi/business/newsletter', methods=['POST'])
@@ -392,7 +384,7 @@ def create_newsletter():
         result = whatsapi_service.create_newsletter(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/newsletter/<newsletter_id>', methods=['PUT'])
 @jwt_required()
@@ -408,7 +400,7 @@ def update_newsletter(newsletter_id):
         result = whatsapi_service.update_newsletter(session, newsletter_id, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/newsletter/<newsletter_id>', methods=['DELETE'])
 @jwt_required()
@@ -422,7 +414,7 @@ def delete_newsletter(newsletter_id):
         result = whatsapi_service.delete_newsletter(session, newsletter_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_business_bp.route('/api/whatsapi/business/newsletter/<newsletter_id>/mute', methods=['POST'])
 @jwt_required()
@@ -438,7 +430,7 @@ def mute_newsletter(newsletter_id):
         result = whatsapi_service.mute_newsletter(session, newsletter_id, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Send catalog link
 @whatsapi_business_bp.route('/api/whatsapi/business/send-catalog-link', methods=['POST'])
@@ -455,4 +447,4 @@ def send_link_catalog():
         result = whatsapi_service.send_link_catalog(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_chats_bp = Blueprint('whatsapi_chats', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/list', methods=['POST'])
 @jwt_required()
@@ -28,7 +20,7 @@ def list_chats():
         result = whatsapi_service.list_chats(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/archived', methods=['GET'])
 @jwt_required()
@@ -42,7 +34,7 @@ def get_archived_chats():
         result = whatsapi_service.get_all_chats_archived(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/<phone>/messages', methods=['GET'])
 @jwt_required()
@@ -56,7 +48,7 @@ def get_all_messages_in_chat(phone):
         result = whatsapi_service.get_all_messages_in_chat(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/messages/new', methods=['GET'])
 @jwt_required()
@@ -70,7 +62,7 @@ def get_all_new_messages():
         result = whatsapi_service.get_all_new_messages(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/messages/unread', methods=['GET'])
 @jwt_required()
@@ -84,7 +76,7 @@ def get_all_unread_messages():
         result = whatsapi_service.get_all_unread_messages(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/<phone>', methods=['GET'])
 @jwt_required()
@@ -98,7 +90,7 @@ def get_chat_by_id(phone):
         result = whatsapi_service.get_chat_by_id(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/<phone>/online', methods=['GET'])
 @jwt_required()
@@ -112,7 +104,7 @@ def check_chat_is_online(phone):
         result = whatsapi_service.check_chat_is_online(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/<phone>/last-seen', methods=['GET'])
 @jwt_required()
@@ -126,7 +118,7 @@ def get_last_seen(phone):
         result = whatsapi_service.get_last_seen(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/mutes/<type_param>', methods=['GET'])
 @jwt_required()
@@ -140,7 +132,7 @@ def list_mutes(type_param):
         result = whatsapi_service.list_mutes(session, type_param)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/<phone>/load-messages', methods=['GET'])
 @jwt_required()
@@ -154,7 +146,7 @@ def load_messages_in_chat(phone):
         result = whatsapi_service.load_messages_in_chat(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/archive', methods=['POST'])
 @jwt_required()
@@ -170,7 +162,7 @@ def archive_chat():
         result = whatsapi_service.archive_chat(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/archive-all', methods=['POST'])
 @jwt_required()
@@ -186,7 +178,7 @@ def archive_all_chats():
         result = whatsapi_service.archive_all_chats(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/clear', methods=['POST'])
 @jwt_required()
@@ -202,7 +194,7 @@ def clear_chat():
         result = whatsapi_service.clear_chat(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/clear-all', methods=['POST'])
 @jwt_required()
@@ -218,7 +210,7 @@ def clear_all_chats():
         result = whatsapi_service.clear_all_chats(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/delete', methods=['POST'])
 @jwt_required()
@@ -234,7 +226,7 @@ def delete_chat():
         result = whatsapi_service.delete_chat(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/delete-all', methods=['POST'])
 @jwt_required()
@@ -250,7 +242,7 @@ def delete_all_chats():
         result = whatsapi_service.delete_all_chats(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/pin', methods=['POST'])
 @jwt_required()
@@ -266,7 +258,7 @@ def pin_chat():
         result = whatsapi_service.pin_chat(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/mute', methods=['POST'])
 @jwt_required()
@@ -282,7 +274,7 @@ def send_mute():
         result = whatsapi_service.send_mute(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/seen', methods=['POST'])
 @jwt_required()
@@ -298,7 +290,7 @@ def send_seen():
         result = whatsapi_service.send_seen(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/state', methods=['POST'])
 @jwt_required()
@@ -314,7 +306,7 @@ def set_chat_state():
         result = whatsapi_service.set_chat_state(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/typing', methods=['POST'])
 @jwt_required()
@@ -330,7 +322,7 @@ def set_typing():
         result = whatsapi_service.set_typing(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_chats_bp.route('/api/whatsapi/chats/recording', methods=['POST'])
 @jwt_required()
@@ -346,4 +338,4 @@ def set_recording():
         result = whatsapi_service.set_recording(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
@@ -1,18 +1,12 @@
+import os
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.async_whatsapi_service import async_whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_contacts_bp = Blueprint('whatsapi_contacts', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>', methods=['GET'])
 @jwt_required()
@@ -26,7 +20,7 @@ def get_contact(phone):
         result = whatsapi_service.get_contact(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>/profile', methods=['GET'])
 @jwt_required()
@@ -40,7 +34,7 @@ def get_profile(phone):
         result = whatsapi_service.get_profile(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>/profile-pic', methods=['GET'])
 @jwt_required()
@@ -54,7 +48,7 @@ def get_profile_pic(phone):
         result = whatsapi_service.get_profile_pic(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>/profile-status', methods=['GET'])
 @jwt_required()
@@ -68,7 +62,7 @@ def get_profile_status(phone):
         result = whatsapi_service.get_profile_status(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/all', methods=['GET'])
 @jwt_required()
@@ -82,7 +76,7 @@ def get_all_contacts():
         result = whatsapi_service.get_all_contacts(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>/check-number', methods=['GET'])
 @jwt_required()
@@ -96,7 +90,7 @@ def check_number_status(phone):
         result = whatsapi_service.check_number_status(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/blocklist', methods=['GET'])
 @jwt_required()
@@ -110,7 +104,7 @@ def get_blocklist():
         result = whatsapi_service.get_blocklist(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/block', methods=['POST'])
 @jwt_required()
@@ -126,7 +120,7 @@ def block_contact():
         result = whatsapi_service.block_contact(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/unblock', methods=['POST'])
 @jwt_required()
@@ -142,7 +136,7 @@ def unblock_contact():
         result = whatsapi_service.unblock_contact(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_contacts_bp.route('/api/whatsapi/contacts/vcard', methods=['POST'])
 @jwt_required()
@@ -158,4 +152,63 @@ def send_contact_vcard():
         result = whatsapi_service.contact_vcard(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
+
+CONTACT_OVERVIEW_CALLS = ('get_contact', 'get_profile', 'get_profile_pic', 'get_profile_status')
+CONTACT_OVERVIEW_MAX_PHONES = int(os.getenv('WHATSAPI_OVERVIEW_MAX_PHONES', 50))
+
+def _contact_overviews(session, phones, concurrency=None):
+    """Fetch contact, profile, picture and status for every phone concurrently"""
+    calls = [(name, session, phone) for phone in phones for name in CONTACT_OVERVIEW_CALLS]
+    results = async_whatsapi_service.run(async_whatsapi_service.gather_many(calls, concurrency=concurrency))
+    overviews = {}
+    for (name, _, phone), result in zip(calls, results):
+        key = name.replace('get_', '', 1)
+        if isinstance(result, Exception):
+            overviews.setdefault(phone, {})[key] = {'error': str(result)}
+        else:
+            overviews.setdefault(phone, {})[key] = result
+    return overviews
+
+@whatsapi_contacts_bp.route('/api/whatsapi/contacts/<phone>/overview', methods=['GET'])
+@jwt_required()
+def get_contact_overview(phone):
+    """Get contact, profile, profile picture and status in one concurrent round"""
+    try:
+        session = request.args.get('session') or get_user_session()
+        if not session:
+            return jsonify({'success': False, 'error': 'session is required'}), 400
+        
+        result = _contact_overviews(session, [phone])
+        return jsonify({'success': True, 'data': result[phone]})
+    except Exception as e:
+        return error_response(e)
+
+@whatsapi_contacts_bp.route('/api/whatsapi/contacts/overview', methods=['POST'])
+@jwt_required()
+def get_contacts_overview():
+    """Get overviews for many contacts with bounded concurrency"""
+    try:
+        data = request.get_json()
+        session = data.get('session') or get_user_session()
+        phones = data.get('phones') or []
+        
+        if not session or not phones:
+            return jsonify({'success': False, 'error': 'session and phones are required'}), 400
+        if not isinstance(phones, list):
+            return jsonify({'success': False, 'error': 'phones must be a list'}), 400
+        if len(phones) > CONTACT_OVERVIEW_MAX_PHONES:
+            return jsonify({'success': False, 'error': f'at most {CONTACT_OVERVIEW_MAX_PHONES} phones per request'}), 400
+        
+        concurrency = data.get('concurrency')
+        if concurrency is not None:
+            try:
+                concurrency = int(concurrency)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'concurrency must be an integer'}), 400
+            concurrency = max(1, min(concurrency, async_whatsapi_service.max_connections))
+        
+        result = _contact_overviews(session, phones, concurrency)
+        return jsonify({'success': True, 'data': result})
+    except Exception as e:
+        return error_response(e)
@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_groups_bp = Blueprint('whatsapi_groups', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/<group_id>/members', methods=['GET'])
 @jwt_required()
@@ -26,7 +18,7 @@ def get_group_members(group_id):
         result = whatsapi_service.get_group_members(session, group_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/<group_id>/members/ids', methods=['GET'])
 @jwt_required()
@@ -40,7 +32,7 @@ def get_group_members_ids(group_id):
         result = whatsapi_service.get_group_members_ids(session, group_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/<group_id>/admins', methods=['GET'])
 @jwt_required()
@@ -54,7 +46,7 @@ def get_group_admins(group_id):
         result = whatsapi_service.get_group_admins(session, group_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/<group_id>/invite-link', methods=['GET'])
 @jwt_required()
@@ -68,7 +60,7 @@ def get_group_invite_link(group_id):
         result = whatsapi_service.get_group_invite_link(session, group_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/<group_id>/revoke-link', methods=['GET'])
 @jwt_required()
@@ -82,7 +74,7 @@ def revoke_group_invite_link(group_id):
         result = whatsapi_service.revoke_group_invite_link(session, group_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/common/<wid>', methods=['GET'])
 @jwt_required()
@@ -96,7 +88,7 @@ def get_common_groups(wid):
         result = whatsapi_service.get_common_groups(session, wid)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/create', methods=['POST'])
 @jwt_required()
@@ -112,7 +104,7 @@ def create_group():
         result = whatsapi_service.create_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/leave', methods=['POST'])
 @jwt_required()
@@ -128,7 +120,7 @@ def leave_group():
         result = whatsapi_service.leave_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/join-by-code', methods=['POST'])
 @jwt_required()
@@ -144,7 +136,7 @@ def join_group_by_code():
         result = whatsapi_service.join_group_by_code(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/add-participant', methods=['POST'])
 @jwt_required()
@@ -160,7 +152,7 @@ def add_participant_group():
         result = whatsapi_service.add_participant_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/remove-participant', methods=['POST'])
 @jwt_required()
@@ -176,7 +168,7 @@ def remove_participant_group():
         result = whatsapi_service.remove_participant_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/promote-participant', methods=['POST'])
 @jwt_required()
@@ -192,7 +184,7 @@ def promote_participant_group():
         result = whatsapi_service.promote_participant_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/demote-participant', methods=['POST'])
 @jwt_required()
@@ -208,7 +200,7 @@ def demote_participant_group():
         result = whatsapi_service.demote_participant_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/info-from-invite-link', methods=['POST'])
 @jwt_required()
@@ -224,7 +216,7 @@ def get_group_info_from_invite_link():
         result = whatsapi_service.get_group_info_from_invite_link(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/set-description', methods=['POST'])
 @jwt_required()
@@ -240,7 +232,7 @@ def set_group_description():
         result = whatsapi_service.set_group_description(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/set-property', methods=['POST'])
 @jwt_required()
@@ -256,7 +248,7 @@ def set_group_property():
         result = whatsapi_service.set_group_property(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/set-subject', methods=['POST'])
 @jwt_required()
@@ -272,7 +264,7 @@ def set_group_subject():
         result = whatsapi_service.set_group_subject(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/messages-admins-only', methods=['POST'])
 @jwt_required()
@@ -288,7 +280,7 @@ def set_messages_admins_only():
         result = whatsapi_service.set_messages_admins_only(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/set-pic', methods=['POST'])
 @jwt_required()
@@ -304,7 +296,7 @@ def set_group_pic():
         result = whatsapi_service.set_group_pic(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_groups_bp.route('/api/whatsapi/groups/change-privacy', methods=['POST'])
 @jwt_required()
@@ -320,4 +312,4 @@ def change_privacy_group():
         result = whatsapi_service.change_privacy_group(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
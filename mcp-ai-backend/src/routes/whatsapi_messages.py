@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_messages_bp = Blueprint('whatsapi_messages', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/<message_id>', methods=['GET'])
 @jwt_required()
@@ -26,7 +18,7 @@ def get_message_by_id(message_id):
         result = whatsapi_service.get_message_by_id(session, message_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/<phone>/all', methods=['GET'])
 @jwt_required()
@@ -40,7 +32,7 @@ def get_messages(phone):
         result = whatsapi_service.get_messages(session, phone)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/unread', methods=['GET'])
 @jwt_required()
@@ -54,7 +46,7 @@ def get_unread_messages():
         result = whatsapi_service.get_unread_messages(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/<message_id>/media', methods=['GET'])
 @jwt_required()
@@ -68,7 +60,7 @@ def get_media_by_message(message_id):
         result = whatsapi_service.get_media_by_message(session, message_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/<message_id>/reactions', methods=['GET'])
 @jwt_required()
@@ -82,7 +74,7 @@ def get_reactions(message_id):
         result = whatsapi_service.get_reactions(session, message_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/<poll_id>/votes', methods=['GET'])
 @jwt_required()
@@ -96,7 +88,7 @@ def get_votes(poll_id):
         result = whatsapi_service.get_votes(session, poll_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/download-media', methods=['POST'])
 @jwt_required()
@@ -112,7 +104,7 @@ def download_media():
         result = whatsapi_service.download_media(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-text', methods=['POST'])
 @jwt_required()
@@ -125,10 +117,10 @@ def send_message():
         if not session:
             return jsonify({'success': False, 'error': 'session is required'}), 400
         
-        result = whatsapi_service.send_message(session, data)
+        result = whatsapi_service.send_message(session, data, idempotency_key=request.headers.get('Idempotency-Key'))
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/edit', methods=['POST'])
 @jwt_required()
@@ -144,7 +136,7 @@ def edit_message():
         result = whatsapi_service.edit_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-image', methods=['POST'])
 @jwt_required()
@@ -160,7 +152,7 @@ def send_image():
         result = whatsapi_service.send_image(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-sticker', methods=['POST'])
 @jwt_required()
@@ -176,7 +168,7 @@ def send_sticker():
         result = whatsapi_service.send_sticker(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-sticker-gif', methods=['POST'])
 @jwt_required()
@@ -192,7 +184,7 @@ def send_sticker_gif():
         result = whatsapi_service.send_sticker_gif(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-reply', methods=['POST'])
 @jwt_required()
@@ -208,7 +200,7 @@ def send_reply():
         result = whatsapi_service.send_reply(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-file', methods=['POST'])
 @jwt_required()
@@ -224,7 +216,7 @@ def send_file():
         result = whatsapi_service.send_file(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-file-base64', methods=['POST'])
 @jwt_required()
@@ -240,7 +232,7 @@ def send_file_base64():
         result = whatsapi_service.send_file_base64(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-voice', methods=['POST'])
 @jwt_required()
@@ -256,7 +248,7 @@ def send_voice():
         result = whatsapi_service.send_voice(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-voice-base64', methods=['POST'])
 @jwt_required()
@@ -272,7 +264,7 @@ def send_voice_base64():
         result = whatsapi_service.send_voice_base64(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-location', methods=['POST'])
 @jwt_required()
@@ -288,7 +280,7 @@ def send_location():
         result = whatsapi_service.send_location(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-link-preview', methods=['POST'])
 @jwt_required()
@@ -304,7 +296,7 @@ def send_link_preview():
         result = whatsapi_service.send_link_preview(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-mentioned', methods=['POST'])
 @jwt_required()
@@ -320,7 +312,7 @@ def send_mentioned():
         result = whatsapi_service.send_mentioned(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-buttons', methods=['POST'])
 @jwt_required()
@@ -336,7 +328,7 @@ def send_buttons():
         result = whatsapi_service.send_buttons(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-list', methods=['POST'])
 @jwt_required()
@@ -352,7 +344,7 @@ def send_list_message():
         result = whatsapi_service.send_list_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-order', methods=['POST'])
 @jwt_required()
@@ -368,7 +360,7 @@ def send_order_message():
         result = whatsapi_service.send_order_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-poll', methods=['POST'])
 @jwt_required()
@@ -384,7 +376,7 @@ def send_poll_message():
         result = whatsapi_service.send_poll_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/send-status', methods=['POST'])
 @jwt_required()
@@ -400,7 +392,7 @@ def send_status():
         result = whatsapi_service.send_status(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/delete', methods=['POST'])
 @jwt_required()
@@ -416,7 +408,7 @@ def delete_message():
         result = whatsapi_service.delete_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/react', methods=['POST'])
 @jwt_required()
@@ -432,7 +424,7 @@ def react_message():
         result = whatsapi_service.react_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/forward', methods=['POST'])
 @jwt_required()
@@ -448,7 +440,7 @@ def forward_messages():
         result = whatsapi_service.forward_messages(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/mark-unseen', methods=['POST'])
 @jwt_required()
@@ -464,7 +456,7 @@ def mark_unseen():
         result = whatsapi_service.mark_unseen(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/temporary', methods=['POST'])
 @jwt_required()
@@ -480,7 +472,7 @@ def temporary_messages():
         result = whatsapi_service.temporary_messages(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_messages_bp.route('/api/whatsapi/messages/star', methods=['POST'])
 @jwt_required()
@@ -496,4 +488,4 @@ def star_message():
         result = whatsapi_service.star_message(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
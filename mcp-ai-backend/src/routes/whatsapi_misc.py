@@ -1,18 +1,12 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.async_whatsapi_service import async_whatsapi_service
+from src.services.broadcast_service import broadcast_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session, credential_resolver
 
 whatsapi_misc_bp = Blueprint('whatsapi_misc', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 # Status Stories
 @whatsapi_misc_bp.route('/api/whatsapi/stories/send-text', methods=['POST'])
@@ -29,7 +23,7 @@ def send_text_story():
         result = whatsapi_service.send_text_story(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/stories/send-image', methods=['POST'])
 @jwt_required()
@@ -45,7 +39,7 @@ def send_image_story():
         result = whatsapi_service.send_image_story(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/stories/send-video', methods=['POST'])
 @jwt_required()
@@ -61,7 +55,7 @@ def send_video_story():
         result = whatsapi_service.send_video_story(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Labels Management
 @whatsapi_misc_bp.route('/api/whatsapi/labels/add', methods=['POST'])
@@ -78,7 +72,7 @@ def add_new_label():
         result = whatsapi_service.add_new_label(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/labels/add-or-remove', methods=['POST'])
 @jwt_required()
@@ -94,7 +88,7 @@ def add_or_remove_label():
         result = whatsapi_service.add_or_remove_label(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/labels/all', methods=['GET'])
 @jwt_required()
@@ -108,7 +102,7 @@ def get_all_labels():
         result = whatsapi_service.get_all_labels(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/labels/delete-all', methods=['DELETE'])
 @jwt_required()
@@ -122,7 +116,7 @@ def delete_all_labels():
         result = whatsapi_service.delete_all_labels(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/labels/<label_id>', methods=['DELETE'])
 @jwt_required()
@@ -136,7 +130,7 @@ def delete_label(label_id):
         result = whatsapi_service.delete_label(session, label_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Broadcast Lists
 @whatsapi_misc_bp.route('/api/whatsapi/broadcast-lists', methods=['GET'])
@@ -151,7 +145,7 @@ def get_all_broadcast_list():
         result = whatsapi_service.get_all_broadcast_list(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Call Management
 @whatsapi_misc_bp.route('/api/whatsapi/calls/reject', methods=['POST'])
@@ -168,7 +162,7 @@ def reject_call():
         result = whatsapi_service.reject_call(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Presence Management
 @whatsapi_misc_bp.route('/api/whatsapi/presence/subscribe', methods=['POST'])
@@ -185,7 +179,7 @@ def subscribe_presence():
         result = whatsapi_service.subscribe_presence(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Platform Info
 @whatsapi_misc_bp.route('/api/whatsapi/messages/<message_id>/platform', methods=['GET'])
@@ -200,7 +194,7 @@ def get_platform_from_message(message_id):
         result = whatsapi_service.get_platform_from_message(session, message_id)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Session Backup and Restore
 @whatsapi_misc_bp.route('/api/whatsapi/sessions/backup', methods=['GET'])
@@ -215,7 +209,7 @@ def backup_sessions():
         result = whatsapi_service.backup_sessions(secretkey)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/sessions/restore', methods=['POST'])
 @jwt_required()
@@ -231,7 +225,7 @@ def restore_sessions():
         result = whatsapi_service.restore_sessions(secretkey, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Limits and Configuration
 @whatsapi_misc_bp.route('/api/whatsapi/settings/set-limit', methods=['POST'])
@@ -245,10 +239,21 @@ def set_limit():
         if not session:
             return jsonify({'success': False, 'error': 'session is required'}), 400
         
+        # Rate fields (messages_per_second/minute, burst) also shape local broadcasts
+        try:
+            broadcast_service.parse_session_limit(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         result = whatsapi_service.set_limit(session, data)
-        return jsonify({'success': True, 'data': result})
+        local_limit = broadcast_service.set_session_limit(session, data)
+        return jsonify({
+            'success': True,
+            'data': result,
+            'broadcast_limit': local_limit.to_dict() if local_limit else None
+        })
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Chatwoot Integration
 @whatsapi_misc_bp.route('/api/whatsapi/integrations/chatwoot', methods=['POST'])
@@ -265,7 +270,7 @@ def chatwoot_integration():
         result = whatsapi_service.chatwoot_integration(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 # Health Checks
 @whatsapi_misc_bp.route('/api/whatsapi/health', methods=['GET'])
@@ -275,7 +280,7 @@ def health_check():
         result = whatsapi_service.health_check()
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/unhealthy', methods=['GET'])
 def unhealthy_check():
@@ -284,7 +289,7 @@ def unhealthy_check():
         result = whatsapi_service.unhealthy_check()
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_misc_bp.route('/api/whatsapi/metrics', methods=['GET'])
 def get_metrics():
@@ -293,4 +298,16 @@ def get_metrics():
         result = whatsapi_service.get_metrics()
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
+
+@whatsapi_misc_bp.route('/api/whatsapi/client-stats', methods=['GET'])
+@jwt_required()
+def get_client_stats():
+    """Local WhatsAPI client metrics (connection pools)"""
+    try:
+        stats = whatsapi_service.get_client_stats()
+        stats.update(async_whatsapi_service.get_client_stats())
+        stats['credentials_cache'] = credential_resolver.stats()
+        return jsonify({'success': True, 'data': stats})
+    except Exception as e:
+        return error_response(e)
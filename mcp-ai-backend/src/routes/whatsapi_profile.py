@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_profile_bp = Blueprint('whatsapi_profile', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/set-pic', methods=['POST'])
 @jwt_required()
@@ -28,7 +20,7 @@ def set_profile_pic():
         result = whatsapi_service.set_profile_pic(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/set-status', methods=['POST'])
 @jwt_required()
@@ -44,7 +36,7 @@ def set_profile_status():
         result = whatsapi_service.set_profile_status(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/change-username', methods=['POST'])
 @jwt_required()
@@ -60,7 +52,7 @@ def change_username():
         result = whatsapi_service.change_username(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/edit-business', methods=['POST'])
 @jwt_required()
@@ -76,7 +68,7 @@ def edit_business_profile():
         result = whatsapi_service.edit_business_profile(session, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/phone-number', methods=['GET'])
 @jwt_required()
@@ -90,7 +82,7 @@ def get_phone_number():
         result = whatsapi_service.get_phone_number(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/device-info', methods=['GET'])
 @jwt_required()
@@ -104,7 +96,7 @@ def get_host_device():
         result = whatsapi_service.get_host_device(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/battery-level', methods=['GET'])
 @jwt_required()
@@ -118,7 +110,7 @@ def get_battery_level():
         result = whatsapi_service.get_battery_level(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_profile_bp.route('/api/whatsapi/profile/screenshot', methods=['GET'])
 @jwt_required()
@@ -132,4 +124,4 @@ def take_screenshot():
         result = whatsapi_service.take_screenshot(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
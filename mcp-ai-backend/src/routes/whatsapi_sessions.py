@@ -1,18 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.services.whatsapi_service import WhatsAPIService
-from src.models.zapi_credentials import ZapiCredentials
+from flask_jwt_extended import jwt_required
+from src.services.whatsapi_service import whatsapi_service
+from src.services.resilience import error_response
+from src.services.credential_service import get_user_session
 
 whatsapi_sessions_bp = Blueprint('whatsapi_sessions', __name__)
-whatsapi_service = WhatsAPIService()
-
-def get_user_session():
-    """Get user's session ID from their credentials"""
-    user_id = get_jwt_identity()
-    cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
-    if not cred:
-        return None
-    return cred.instance_id
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/generate-token', methods=['POST'])
 @jwt_required()
@@ -29,7 +21,7 @@ def generate_token():
         result = whatsapi_service.generate_token(session, secretkey)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/all', methods=['GET'])
 @jwt_required()
@@ -43,7 +35,7 @@ def show_all_sessions():
         result = whatsapi_service.show_all_sessions(secretkey)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/start-all', methods=['POST'])
 @jwt_required()
@@ -59,7 +51,7 @@ def start_all_sessions():
         result = whatsapi_service.start_all_sessions(secretkey)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/check-connection', methods=['GET'])
 @jwt_required()
@@ -73,7 +65,7 @@ def check_connection_session():
         result = whatsapi_service.check_connection_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/qrcode', methods=['GET'])
 @jwt_required()
@@ -87,7 +79,7 @@ def get_qrcode_session():
         result = whatsapi_service.get_qrcode_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/start', methods=['POST'])
 @jwt_required()
@@ -103,7 +95,7 @@ def start_session():
         result = whatsapi_service.start_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/logout', methods=['POST'])
 @jwt_required()
@@ -119,7 +111,7 @@ def logout_session():
         result = whatsapi_service.logout_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/close', methods=['POST'])
 @jwt_required()
@@ -135,7 +127,7 @@ def close_session():
         result = whatsapi_service.close_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/status', methods=['GET'])
 @jwt_required()
@@ -149,7 +141,7 @@ def get_status_session():
         result = whatsapi_service.get_status_session(session)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @whatsapi_sessions_bp.route('/api/whatsapi/sessions/clear-data', methods=['POST'])
 @jwt_required()
@@ -166,4 +158,4 @@ def clear_session_data():
         result = whatsapi_service.clear_session_data(session, secretkey, data)
         return jsonify({'success': True, 'data': result})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
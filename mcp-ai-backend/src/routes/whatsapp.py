@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from src.services.whatsapp_api_service import *
+from src.services.webhook_dedupe import webhook_dedupe, extract_message_id
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
@@ -50,6 +51,9 @@ def api_send_location():
 @whatsapp_bp.route('/api/webhook/whatsapp', methods=['POST'])
 def whatsapp_webhook():
     event = request.json
+    if webhook_dedupe.is_duplicate('whatsapi', extract_message_id(event or {})):
+        # Reentrega da mesma mensagem: confirma sem reprocessar
+        return jsonify({"status": "duplicate"})
     # Aqui você pode processar o evento recebido do WhatsApi
     # Exemplo: salvar no banco, disparar automação, etc.
     return jsonify({"status": "received"})
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.zapi_credentials import ZapiCredentials
 from src.models.db_instance import db
+from src.services.credential_service import credential_resolver
 import requests
 
 zapi_bp = Blueprint('zapi', __name__)
@@ -23,6 +24,7 @@ def save_zapi_credentials():
         cred = ZapiCredentials(user_id=user_id, instance_id=instance_id, token=token)
         db.session.add(cred)
     db.session.commit()
+    credential_resolver.invalidate(user_id)
     return jsonify({'success': True})
 
 @zapi_bp.route('/api/zapi/credentials', methods=['GET'])
@@ -1,19 +1,45 @@
 from flask import Blueprint, request, jsonify
 from src.models.zapi_credentials import ZapiCredentials
 from src.models.db_instance import db
+from src.services.webhook_queue import webhook_queue
+from src.services.webhook_dedupe import extract_message_id
 import requests
 
 zapi_webhook_bp = Blueprint('zapi_webhook', __name__)
 
 @zapi_webhook_bp.route('/webhook/zapi', methods=['POST'])
 def zapi_webhook():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
+    # Só persiste o evento; a resposta da IA é gerada pelos workers da fila
+    phone = data.get('phone') or data.get('from')
+    user_id = data.get('user_id')  # ou defina a lógica para identificar o usuário
+    event = webhook_queue.enqueue(
+        'zapi', data,
+        conversation_key=f"zapi:{user_id}:{phone}",
+        user_id=int(user_id) if str(user_id).isdigit() else None,
+        message_id=extract_message_id(data)
+    )
+    if event is None:
+        # Reentrega da mesma mensagem: confirma sem reprocessar
+        return jsonify({'success': True, 'duplicate': True})
+    return jsonify({'success': True, 'event_id': event.id})
+
+@zapi_webhook_bp.route('/webhook/zapi/stats', methods=['GET'])
+def zapi_webhook_stats():
+    """Webhook queue depth and lag"""
+    try:
+        return jsonify({'success': True, 'data': webhook_queue.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def processar_evento_zapi(data):
+    """Processa um evento da Z-API fora do request (executado pelo webhook_queue)"""
     # Exemplo: extrair número e mensagem recebida
     phone = data.get('phone') or data.get('from')
     message = data.get('message') or data.get('body')
-    user_id = data.get('user_id')  # ou defina a lógica para identificar o usuário
+    user_id = data.get('user_id')
     # Aqui você pode acionar o agente IA para gerar uma resposta automática
-    resposta_ia = gerar_resposta_ia(message)  # Implemente sua IA aqui
+    resposta_ia = gerar_resposta_ia(message, data)
     # Enviar resposta automática via Z-API
     if resposta_ia and phone and user_id:
         cred = ZapiCredentials.query.filter_by(user_id=user_id).first()
@@ -21,48 +47,67 @@ def zapi_webhook():
             url = f"https://api.z-api.io/instances/{cred.instance_id}/token/{cred.token}/send-text"
             payload = {"phone": phone, "message": resposta_ia}
             try:
-                resp = requests.post(url, json=payload)
+                resp = requests.post(url, json=payload, timeout=30)
                 print('Resposta enviada:', resp.json())
             except Exception as e:
                 print('Erro ao enviar resposta automática:', str(e))
     print('Evento recebido da Z-API:', data)
-    return jsonify({'success': True})
 
-def gerar_resposta_ia(mensagem):
+def agente_do_usuario(user_id):
+    """(agente, campanha ativa) do usuário, resolvidos pelo cache de agentes (sem consultas com o cache quente)"""
+    from src.services.agent_cache import agent_cache
+
+    campaign = agent_cache.active_campaign(user_id)
+    agent = agent_cache.agent_for_campaign(campaign) if campaign else agent_cache.agent_for_user(user_id)
+    return agent, campaign
+
+def janela_de_agrupamento(data, user_id):
+    """(janela, espera máxima) em segundos para agrupar mensagens seguidas do cliente"""
+    from src.services.mcp_agent_service import mcp_agent_service
+
+    agent, _ = agente_do_usuario(user_id)
+    return mcp_agent_service.get_coalescing_window(agent)
+
+def agrupar_eventos_zapi(eventos):
+    """Junta uma rajada de mensagens do mesmo cliente em um único evento"""
+    agrupado = dict(eventos[-1])
+    textos = [e.get('message') or e.get('body') for e in eventos]
+    agrupado['message'] = '\n'.join(t for t in textos if isinstance(t, str) and t.strip())
+    agrupado.pop('body', None)
+    agrupado['coalesced_messages'] = len(eventos)
+    return agrupado
+
+webhook_queue.register_handler('zapi', processar_evento_zapi,
+                               coalesce=janela_de_agrupamento, merge=agrupar_eventos_zapi)
+
+def gerar_resposta_ia(mensagem, data):
     # Integração real com o agente IA de vendas
     if not mensagem:
         return None
 
     # Importações locais para evitar ciclos
-    from src.models.mcp_agent import MCPAgent
-    from src.services.mcp_agent_service import MCPAgentService
-    from src.models.campaign import Campaign
-    from src.models.user import User
+    from src.services.mcp_agent_service import mcp_agent_service
 
-    # Exemplo: buscar o usuário e o agente IA padrão
-    user_id = request.json.get('user_id')
-    user = User.query.get(user_id) if user_id else None
-    agent = MCPAgent.query.filter_by(user_id=user_id, is_active=True).first() if user_id else None
+    # Agente da campanha ativa do usuário ou, sem vínculo, o agente ativo dele
+    user_id = data.get('user_id')
+    agent, campaign = agente_do_usuario(user_id)
 
     # Contexto mínimo para IA
     context = {
         'platform': 'whatsapp',
         'customer': {
-            'id': request.json.get('from'),
-            'name': request.json.get('senderName') or '',
-            'phone': request.json.get('phone') or request.json.get('from'),
+            'id': data.get('from'),
+            'name': data.get('senderName') or '',
+            'phone': data.get('phone') or data.get('from'),
         }
     }
 
-    # Opcional: buscar campanha ativa do usuário
-    campaign = Campaign.query.filter_by(user_id=user_id, status='active').first() if user_id else None
     if campaign:
         context['campaign'] = campaign.to_dict()
         context['sales_strategy'] = campaign.sales_strategy
 
     if agent:
-        ia_service = MCPAgentService()
-        result = ia_service.process_message(agent, mensagem, context)
+        result = mcp_agent_service.process_message(agent, mensagem, context)
         return result.get('response')
     else:
         return "Recebido: {}. (IA não configurada para este usuário)".format(mensagem)
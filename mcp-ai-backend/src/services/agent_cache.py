@@ -0,0 +1,249 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Mapping
+from src.models.db_instance import db
+from src.models.mcp_agent import MCPAgent
+from src.models.campaign import Campaign
+from src.services.cache import TTLCache
+
+logger = logging.getLogger("agent_cache")
+
+_NONE = 0  # cached "this user has no active agent/campaign"
+
+
+class _Frozen:
+    """Immutable __slots__ record: attributes are set once in __init__."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _fill(self, values: Dict[str, Any]):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+
+class AgentSnapshot(_Frozen):
+    """
+    What the message pipeline reads from an MCPAgent (prompt, model and
+    parameters), copied at config_version and shared by every thread.
+    Duck-types the agent for process_message and the services it calls.
+    """
+    _FIELDS = ('id', 'user_id', 'name', 'sales_approach', 'language', 'model_name', 'temperature',
+               'max_tokens', 'system_prompt', 'is_active', 'config_version')
+    __slots__ = _FIELDS + ('runtime_config',)
+
+    def __init__(self, agent: MCPAgent):
+        self._fill({field: getattr(agent, field) for field in self._FIELDS})
+        self._fill({'runtime_config': MappingProxyType(agent.get_runtime_config())})
+
+    def get_runtime_config(self) -> Mapping[str, Any]:
+        return self.runtime_config
+
+    def __repr__(self):
+        return f"<AgentSnapshot {self.id} v{self.config_version}>"
+
+
+class CampaignBinding(_Frozen):
+    """A campaign's agent binding and the fields the sales interaction uses, as of updated_at."""
+    __slots__ = ('id', 'user_id', 'agent_id', 'name', 'status', 'sales_strategy', 'product_database_id',
+                 'updated_at', '_data')
+
+    def __init__(self, campaign: Campaign):
+        self._fill({'id': campaign.id, 'user_id': campaign.user_id, 'agent_id': campaign.agent_id,
+                    'name': campaign.name, 'status': campaign.status, 'sales_strategy': campaign.sales_strategy,
+                    'product_database_id': campaign.product_database_id, 'updated_at': campaign.updated_at,
+                    '_data': campaign.to_dict()})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+    def __repr__(self):
+        return f"<CampaignBinding {self.id} agent={self.agent_id}>"
+
+
+class AgentCache:
+    """
+    Read-through cache of agent snapshots and campaign→agent bindings.
+
+    Resolving the agent of an inbound message (campaign binding, or the
+    user's active agent) is served from memory: a miss loads the row once
+    and caches an immutable snapshot. update_agent/update_mcp_agent bump
+    MCPAgent.config_version and invalidate here; a refresher thread in every
+    process compares the cached versions (and campaigns' updated_at) with
+    the database every AGENT_CACHE_REFRESH_SECONDS and evicts stale entries,
+    so other workers pick up changes within that interval without the hot
+    path querying. Which agent/campaign is active for a user is cached for
+    AGENT_CACHE_USER_TTL seconds.
+    """
+
+    def __init__(self):
+        maxsize = int(os.getenv('AGENT_CACHE_MAXSIZE', 10000))
+        ttl = float(os.getenv('AGENT_CACHE_TTL', 3600))  # backstop if the refresher stops
+        self.refresh_interval = float(os.getenv('AGENT_CACHE_REFRESH_SECONDS', 2))
+        self.agents = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.campaigns = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.users = TTLCache(maxsize=maxsize, ttl=float(os.getenv('AGENT_CACHE_USER_TTL', 60)))
+        self.app = None
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+        self.loads = 0
+        self.refreshes = 0
+        self.stale_evictions = 0
+        self.last_refresh_at = None
+
+    def init_app(self, app):
+        """Bind to the Flask app and start the refresher thread in this process."""
+        self.app = app
+        app.before_request(self._ensure_refresher)
+        self._ensure_refresher()
+
+    @staticmethod
+    def _user_key(user_id) -> Optional[int]:
+        return int(user_id) if user_id is not None and str(user_id).isdigit() else None
+
+    # Lookups
+    def agent(self, agent_id) -> Optional[AgentSnapshot]:
+        """Snapshot of an agent, or None if it does not exist."""
+        if agent_id is None:
+            return None
+        snapshot = self.agents.get(agent_id)
+        if snapshot is None:
+            row = db.session.get(MCPAgent, agent_id)
+            if row is None:
+                return None
+            snapshot = AgentSnapshot(row)
+            self.agents.set(agent_id, snapshot)
+            self.loads += 1
+        return snapshot
+
+    def campaign(self, campaign_id) -> Optional[CampaignBinding]:
+        """Binding of a campaign, or None if it does not exist."""
+        if campaign_id is None:
+            return None
+        binding = self.campaigns.get(campaign_id)
+        if binding is None:
+            row = db.session.get(Campaign, campaign_id)
+            if row is None:
+                return None
+            binding = CampaignBinding(row)
+            self.campaigns.set(campaign_id, binding)
+            self.loads += 1
+        return binding
+
+    def agent_for_user(self, user_id) -> Optional[AgentSnapshot]:
+        """The user's active agent (lowest id when there are several)."""
+        user_id = self._user_key(user_id)
+        if user_id is None:
+            return None
+        agent_id = self.users.get(('agent', user_id))
+        if agent_id is None:
+            agent_id = db.session.execute(
+                db.select(MCPAgent.id).filter_by(user_id=user_id, is_active=True).order_by(MCPAgent.id).limit(1)
+            ).scalar() or _NONE
+            self.users.set(('agent', user_id), agent_id)
+        return self.agent(agent_id) if agent_id != _NONE else None
+
+    def active_campaign(self, user_id) -> Optional[CampaignBinding]:
+        """The user's active campaign (lowest id when there are several)."""
+        user_id = self._user_key(user_id)
+        if user_id is None:
+            return None
+        campaign_id = self.users.get(('campaign', user_id))
+        if campaign_id is None:
+            campaign_id = db.session.execute(
+                db.select(Campaign.id).filter_by(user_id=user_id, status='active').order_by(Campaign.id).limit(1)
+            ).scalar() or _NONE
+            self.users.set(('campaign', user_id), campaign_id)
+        return self.campaign(campaign_id) if campaign_id != _NONE else None
+
+    def agent_for_campaign(self, binding: CampaignBinding) -> Optional[AgentSnapshot]:
+        """The agent bound to the campaign, or the campaign owner's active agent."""
+        agent = self.agent(binding.agent_id)
+        if agent is not None and agent.is_active:
+            return agent
+        return self.agent_for_user(binding.user_id)
+
+    # Invalidation
+    def invalidate_agent(self, agent_id, *user_ids):
+        """Drop an agent's snapshot and the active-agent entries of its users (call after commit)."""
+        self.agents.delete(agent_id)
+        for user_id in filter(None, map(self._user_key, user_ids)):
+            self.users.delete(('agent', user_id))
+
+    def invalidate_campaign(self, campaign_id, *user_ids):
+        """Drop a campaign's binding and the active-campaign entries of its users (call after commit)."""
+        self.campaigns.delete(campaign_id)
+        for user_id in filter(None, map(self._user_key, user_ids)):
+            self.users.delete(('campaign', user_id))
+
+    # Refresher
+    def _ensure_refresher(self):
+        if self.app is None or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            threading.Thread(target=self._run, name='agent-cache-refresher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                logger.exception("Agent cache refresh failed")
+            finally:
+                with self.app.app_context():
+                    db.session.remove()
+
+    def refresh(self) -> int:
+        """Evict snapshots whose row changed (or is gone); returns how many were evicted."""
+        evicted = 0
+        agents = dict(self.agents.items())
+        if agents:
+            versions = dict(db.session.execute(
+                db.select(MCPAgent.id, MCPAgent.config_version).where(MCPAgent.id.in_(list(agents)))
+            ).all())
+            for agent_id, snapshot in agents.items():
+                if versions.get(agent_id) != snapshot.config_version:
+                    self.invalidate_agent(agent_id, snapshot.user_id)
+                    evicted += 1
+        campaigns = dict(self.campaigns.items())
+        if campaigns:
+            stamps = dict(db.session.execute(
+                db.select(Campaign.id, Campaign.updated_at).where(Campaign.id.in_(list(campaigns)))
+            ).all())
+            for campaign_id, binding in campaigns.items():
+                if stamps.get(campaign_id) != binding.updated_at:
+                    self.invalidate_campaign(campaign_id, binding.user_id)
+                    evicted += 1
+        db.session.commit()
+        self.refreshes += 1
+        self.stale_evictions += evicted
+        self.last_refresh_at = datetime.utcnow()
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'agents': self.agents.stats(),
+            'campaigns': self.campaigns.stats(),
+            'users': self.users.stats(),
+            'loads': self.loads,
+            'refresh_interval_seconds': self.refresh_interval,
+            'refreshes': self.refreshes,
+            'stale_evictions': self.stale_evictions,
+            'last_refresh_at': self.last_refresh_at.isoformat() if self.last_refresh_at else None
+        }
+
+# Singleton instance
+agent_cache = AgentCache()
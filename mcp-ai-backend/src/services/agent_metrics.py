@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any
+from sqlalchemy import bindparam
+from src.models.db_instance import db
+from src.models.mcp_agent import MCPAgent, AgentMetricShard
+
+logger = logging.getLogger("agent_metrics")
+
+COUNTERS = ('interactions', 'conversions', 'satisfaction_sum', 'satisfaction_count')
+
+
+class AgentMetrics:
+    """
+    Contention-free agent performance counters.
+
+    Deltas (aggregated in memory by the write-behind buffer) are added to
+    the agent's row in agent_metric_shards for this process's shard with
+    one upsert per flush, so concurrent workers increment different rows
+    instead of serializing on the mcp_agents row. A rollup thread in every
+    process periodically drains the shard rows (DELETE ... RETURNING, or
+    SELECT ... FOR UPDATE + DELETE) and folds them into mcp_agents in the
+    same transaction: counts are added and customer_satisfaction is kept
+    as a running mean over satisfaction_count samples. A drained row is
+    gone, so concurrent rollups never count it twice; increments that
+    arrive meanwhile simply create it again.
+    """
+
+    def __init__(self):
+        self.shards = int(os.getenv('AGENT_METRIC_SHARDS', 16))
+        self.rollup_interval = float(os.getenv('AGENT_METRIC_ROLLUP_SECONDS', 30))
+        self.app = None
+        self._lock = threading.Lock()
+        self._rollup_pid = None
+        self.rollups = 0
+        self.rolled_up_agents = 0
+        self.rolled_up_shards = 0
+        self.last_rollup_at = None
+        self._rollup_seconds = 0.0
+
+    @property
+    def shard(self) -> int:
+        return os.getpid() % self.shards
+
+    def init_app(self, app):
+        """Bind to the Flask app and start the rollup thread in this process."""
+        self.app = app
+        app.before_request(self._ensure_rollup)
+        self._ensure_rollup()
+
+    # Recording
+    def apply(self, deltas: Dict[int, Dict[str, float]]):
+        """Add per-agent deltas to this process's shard rows (caller commits); deleted agents' deltas are dropped."""
+        if not deltas:
+            return
+        existing = set(db.session.execute(
+            db.select(MCPAgent.id).where(MCPAgent.id.in_(list(deltas)))
+        ).scalars())
+        now = datetime.utcnow()
+        rows = [dict({counter: delta.get(counter, 0) for counter in COUNTERS},
+                     agent_id=agent_id, shard=self.shard, updated_at=now)
+                for agent_id, delta in deltas.items() if agent_id in existing]
+        if len(rows) < len(deltas):
+            logger.debug("Dropped metric deltas of deleted agents %s", sorted(set(deltas) - existing))
+        if rows:
+            db.session.execute(self._upsert(), rows)
+
+    def forget(self, agent_id: int):
+        """Delete an agent's pending shard rows before the agent itself (caller commits)."""
+        table = AgentMetricShard.__table__
+        db.session.execute(table.delete().where(table.c.agent_id == agent_id))
+
+    def _upsert(self):
+        table = AgentMetricShard.__table__
+        dialect = db.engine.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            statement = insert(table)
+            return statement.on_conflict_do_update(
+                index_elements=[table.c.agent_id, table.c.shard],
+                set_=dict({counter: table.c[counter] + statement.excluded[counter] for counter in COUNTERS},
+                          updated_at=statement.excluded.updated_at)
+            )
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(table)
+            return statement.on_duplicate_key_update(
+                **{counter: table.c[counter] + statement.inserted[counter] for counter in COUNTERS},
+                updated_at=statement.inserted.updated_at
+            )
+        raise NotImplementedError(f"Upsert de métricas não suportado no dialeto {dialect}")
+
+    # Rollup
+    def _ensure_rollup(self):
+        if self.app is None or self._rollup_pid == os.getpid():
+            return
+        with self._lock:
+            if self._rollup_pid == os.getpid():
+                return
+            self._rollup_pid = os.getpid()
+            threading.Thread(target=self._run, name='agent-metrics-rollup', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.rollup_interval)
+            try:
+                with self.app.app_context():
+                    self.rollup()
+            except Exception:
+                logger.exception("Agent metrics rollup failed")
+            finally:
+                with self.app.app_context():
+                    db.session.remove()
+
+    def rollup(self) -> int:
+        """Fold every pending shard row into mcp_agents; returns the number of agents updated."""
+        started = time.perf_counter()
+        table = AgentMetricShard.__table__
+        columns = [table.c.agent_id] + [table.c[counter] for counter in COUNTERS]
+        if db.engine.dialect.delete_returning:
+            rows = db.session.execute(table.delete().returning(*columns)).all()
+        else:
+            rows = db.session.execute(db.select(table.c.shard, *columns).with_for_update()).all()
+            if rows:
+                db.session.execute(table.delete().where(table.c.agent_id == bindparam('key_agent'),
+                                                        table.c.shard == bindparam('key_shard')),
+                                   [{'key_agent': row.agent_id, 'key_shard': row.shard} for row in rows])
+        if not rows:
+            db.session.commit()
+            return 0
+
+        totals: Dict[int, Dict[str, float]] = {}
+        for row in rows:
+            total = totals.setdefault(row.agent_id, dict.fromkeys(COUNTERS, 0))
+            for counter in COUNTERS:
+                total[counter] += getattr(row, counter) or 0
+
+        agents = MCPAgent.__table__
+        count = db.func.coalesce(agents.c.satisfaction_count, 0)
+        db.session.execute(agents.update().where(agents.c.id == bindparam('key_agent')).values(
+            total_interactions=db.func.coalesce(agents.c.total_interactions, 0) + bindparam('add_interactions'),
+            successful_conversions=db.func.coalesce(agents.c.successful_conversions, 0) + bindparam('add_conversions'),
+            customer_satisfaction=db.case(
+                (bindparam('add_samples') > 0,
+                 (db.func.coalesce(agents.c.customer_satisfaction, 0.0) * count + bindparam('add_sum'))
+                 / (count + bindparam('add_samples'))),
+                else_=agents.c.customer_satisfaction
+            ),
+            satisfaction_count=count + bindparam('add_samples')
+        ), [{'key_agent': agent_id,
+             'add_interactions': int(total['interactions']),
+             'add_conversions': int(total['conversions']),
+             'add_sum': float(total['satisfaction_sum']),
+             'add_samples': int(total['satisfaction_count'])} for agent_id, total in totals.items()])
+        db.session.commit()
+
+        self.rollups += 1
+        self.rolled_up_agents += len(totals)
+        self.rolled_up_shards += len(rows)
+        self.last_rollup_at = datetime.utcnow()
+        self._rollup_seconds += time.perf_counter() - started
+        return len(totals)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'shards': self.shards,
+            'shard': self.shard,
+            'rollup_interval_seconds': self.rollup_interval,
+            'rollups': self.rollups,
+            'rolled_up_agents': self.rolled_up_agents,
+            'rolled_up_shards': self.rolled_up_shards,
+            'avg_rollup_ms': round(self._rollup_seconds / self.rollups * 1000, 2) if self.rollups else 0.0,
+            'last_rollup_at': self.last_rollup_at.isoformat() if self.last_rollup_at else None
+        }
+
+# Singleton instance
+agent_metrics = AgentMetrics()
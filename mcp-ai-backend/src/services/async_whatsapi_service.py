@@ -0,0 +1,197 @@
+import os
+import asyncio
+import logging
+import threading
+import httpx
+from typing import Dict, Any, Optional, List, Iterable, Union, Callable, Awaitable, Tuple
+from src.services.whatsapi_service import (
+    WhatsAPIService, WHATSAPI_BASE_URL, whatsapi_breakers, whatsapi_response_cache, _CACHE_MISS
+)
+from src.services.cache import TTLCache
+from src.services.resilience import RetryPolicy, CircuitBreakerRegistry, CircuitOpenError
+
+logger = logging.getLogger("async_whatsapi")
+
+# A call for gather_many: ('method_name', *args) or a zero-argument callable returning an awaitable
+WhatsAPICall = Union[Tuple[Any, ...], Callable[[], Awaitable[Any]]]
+
+
+class _EventLoopThread:
+    """Background event loop so synchronous Flask views can await coroutines."""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name='async-whatsapi-loop', daemon=True)
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+
+class AsyncWhatsAPIService(WhatsAPIService):
+    """
+    asyncio client for WhatsAPI.
+
+    Exposes the same methods as WhatsAPIService (they are inherited and
+    return awaitables because _make_request is a coroutine here), plus
+    gather_many() for bounded concurrent fan-out.
+    """
+
+    def __init__(self, base_url: str = WHATSAPI_BASE_URL, client: Optional[httpx.AsyncClient] = None,
+                 max_connections: Optional[int] = None, default_concurrency: Optional[int] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breakers: Optional[CircuitBreakerRegistry] = None,
+                 cache: Optional[TTLCache] = None):
+        self.base_url = base_url
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or whatsapi_breakers
+        self.cache = cache if cache is not None else whatsapi_response_cache
+        self.retries = 0
+        self.max_connections = max_connections or int(os.getenv('WHATSAPI_POOL_MAXSIZE', 20))
+        self.default_concurrency = default_concurrency or int(os.getenv('WHATSAPI_ASYNC_CONCURRENCY', 8))
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._runner = _EventLoopThread()
+        self._requests = 0
+        self._in_flight = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.AsyncClient(
+                        timeout=httpx.Timeout(
+                            float(os.getenv('WHATSAPI_READ_TIMEOUT', 30)),
+                            connect=float(os.getenv('WHATSAPI_CONNECT_TIMEOUT', 3.05))
+                        ),
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                            keepalive_expiry=float(os.getenv('WHATSAPI_KEEPALIVE_IDLE', 60))
+                        )
+                    )
+        return self._client
+
+    async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None,
+                            idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Make async HTTP request to WhatsAPI, with the same retry/breaker/cache rules as the sync client"""
+        url = f"{self.base_url}{endpoint}"
+        method = method.upper()
+        if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        kwargs = {}
+        if method == 'GET':
+            kwargs['params'] = params
+        elif method in ('POST', 'PUT'):
+            kwargs['json'] = data
+        if idempotency_key:
+            kwargs['headers'] = {'Idempotency-Key': idempotency_key}
+
+        cache_key = self._cache_key(method, endpoint, params)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key, _CACHE_MISS)
+            if cached is not _CACHE_MISS:
+                return cached
+
+        breaker = self.breakers.get(self._breaker_key(endpoint))
+        retryable = self.retry_policy.can_retry(method, idempotency_key)
+        self._requests += 1
+        self._in_flight += 1
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                if not breaker.allow():
+                    raise CircuitOpenError(breaker.key, breaker.retry_in())
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    breaker.record_failure()
+                    safe = retryable or isinstance(e, httpx.ConnectTimeout)
+                    if safe and attempt < self.retry_policy.max_attempts:
+                        self.retries += 1
+                        await asyncio.sleep(self.retry_policy.delay(attempt))
+                        continue
+                    logger.error(f"WhatsAPI request failed: {e}")
+                    raise
+
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if (retryable and self.retry_policy.should_retry_status(response.status_code)
+                        and attempt < self.retry_policy.max_attempts):
+                    self.retries += 1
+                    await asyncio.sleep(self.retry_policy.delay(attempt, response.headers.get('Retry-After')))
+                    continue
+
+                try:
+                    response.raise_for_status()
+                except httpx.HTTPError as e:
+                    logger.error(f"WhatsAPI request failed: {e}")
+                    raise
+                result = response.json() if response.text else {}
+                self._after_response(method, endpoint, cache_key, result)
+                return result
+        finally:
+            self._in_flight -= 1
+
+    async def gather_many(self, calls: Iterable[WhatsAPICall], concurrency: Optional[int] = None) -> List[Any]:
+        """
+        Run many WhatsAPI calls concurrently, at most `concurrency` at a time.
+
+        Each call is either a tuple ('get_contact', session, phone) or a
+        zero-argument callable returning an awaitable. Results come back in
+        input order; a failed call yields its exception instead of a result.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.default_concurrency)
+
+        async def run_one(call: WhatsAPICall):
+            async with semaphore:
+                if callable(call):
+                    return await call()
+                name, *args = call
+                return await getattr(self, name)(*args)
+
+        return await asyncio.gather(*(run_one(call) for call in calls), return_exceptions=True)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Block until `coro` finishes on this client's background event loop."""
+        return self._runner.run(coro, timeout)
+
+    def get_client_stats(self) -> Dict[str, Any]:
+        return {
+            'async': {
+                'requests': self._requests,
+                'in_flight': self._in_flight,
+                'retries': self.retries,
+                'max_connections': self.max_connections,
+                'default_concurrency': self.default_concurrency
+            }
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+# Singleton bound to its own background loop; call it from sync code through .run()
+async_whatsapi_service = AsyncWhatsAPIService()
@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+from src.models.db_instance import db
+from src.models.broadcast import BroadcastJob, WhatsAPISessionLimit
+from src.services.whatsapi_service import whatsapi_service
+from src.services.rate_limit import TokenBucket
+
+logger = logging.getLogger("broadcast")
+
+
+class _TemplateVars(dict):
+    """format_map() helper that renders unknown placeholders as empty strings."""
+
+    def __missing__(self, key):
+        return ''
+
+
+class BroadcastService:
+    """
+    Bulk WhatsAPI broadcast engine.
+
+    Jobs are persisted in `broadcast_jobs` and streamed through
+    WhatsAPIService.send_message by a worker thread, shaped per session by a
+    token bucket whose rate comes from `whatsapi_session_limits` (written
+    by the set-limit endpoint). Progress is checkpointed every few sends, and
+    a lease (locked_by + heartbeat_at, renewed by a heartbeat thread while the
+    job runs) lets any gunicorn worker resume a job whose owner died. A job
+    claimed more than BROADCAST_MAX_ATTEMPTS times (it keeps crashing or
+    killing its worker) is marked failed.
+    """
+
+    def __init__(self):
+        self.default_rate = float(os.getenv('BROADCAST_DEFAULT_RATE', 1.0))
+        self.checkpoint_every = int(os.getenv('BROADCAST_CHECKPOINT_EVERY', 10))
+        self.lease_seconds = int(os.getenv('BROADCAST_LEASE_SECONDS', 60))
+        self.poll_interval = int(os.getenv('BROADCAST_POLL_INTERVAL', 15))
+        self.max_running = int(os.getenv('BROADCAST_MAX_RUNNING', 4))
+        self.max_attempts = int(os.getenv('BROADCAST_MAX_ATTEMPTS', 3))
+        self.max_errors_kept = 20
+        self.app = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._running: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._supervisor_pid = None
+
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app):
+        """Bind to the Flask app and start resuming interrupted jobs in this process."""
+        self.app = app
+        app.before_request(self._ensure_supervisor)
+        self._ensure_supervisor()
+
+    # Public API
+    def create_job(self, session: str, template: str, recipients: List[Any], user_id: Optional[int] = None,
+                   name: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                   rate_per_second: Optional[float] = None) -> BroadcastJob:
+        if rate_per_second is not None and rate_per_second <= 0:
+            raise ValueError('rate_per_second must be positive')
+        job = BroadcastJob(
+            user_id=user_id,
+            session=session,
+            name=name,
+            template=template,
+            recipients=json.dumps(recipients, ensure_ascii=False),
+            options=json.dumps(options or {}, ensure_ascii=False),
+            total=len(recipients),
+            rate_per_second=rate_per_second,
+            status='queued'
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._ensure_supervisor()
+        self._try_start(job.id)
+        return job
+
+    def get_job(self, job_id: int, user_id: Optional[int] = None) -> Optional[BroadcastJob]:
+        """The job, or None if it does not exist or (when `user_id` is given) belongs to someone else."""
+        query = BroadcastJob.query.filter_by(id=job_id)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        return query.first()
+
+    def cancel_job(self, job_id: int, user_id: Optional[int] = None) -> bool:
+        query = BroadcastJob.query.filter(
+            BroadcastJob.id == job_id,
+            BroadcastJob.status.in_(('queued', 'running'))
+        )
+        if user_id is not None:
+            query = query.filter(BroadcastJob.user_id == user_id)
+        updated = query.update({'status': 'cancelled', 'finished_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return updated == 1
+
+    @staticmethod
+    def parse_session_limit(data: Dict[str, Any]) -> Optional[Tuple[float, Optional[float]]]:
+        """
+        (rate_per_second, burst) from a set-limit payload, or None without rate fields.
+
+        Raises ValueError unless the rate (and burst, if given) is a number above 0.
+        """
+        def positive(name: str) -> float:
+            try:
+                value = float(data[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} must be a positive number')
+            if not value > 0 or value == float('inf'):
+                raise ValueError(f'{name} must be a positive number')
+            return value
+
+        if data.get('messages_per_second') is not None:
+            rate = positive('messages_per_second')
+        elif data.get('messages_per_minute') is not None:
+            rate = positive('messages_per_minute') / 60.0
+        else:
+            return None
+        burst = positive('burst') if data.get('burst') is not None else None
+        return rate, burst
+
+    def set_session_limit(self, session: str, data: Dict[str, Any]) -> Optional[WhatsAPISessionLimit]:
+        """
+        Record a send-rate limit for a session from a set-limit payload.
+
+        Reads `messages_per_second` or `messages_per_minute` (and an optional
+        `burst`); payloads without them leave the current limit untouched.
+        Invalid values raise ValueError (see parse_session_limit).
+        """
+        parsed = self.parse_session_limit(data)
+        if parsed is None:
+            return None
+        rate, burst = parsed
+
+        limit = WhatsAPISessionLimit.query.filter_by(session=session).first()
+        if limit:
+            limit.rate_per_second = rate
+            limit.burst = burst
+        else:
+            limit = WhatsAPISessionLimit(session=session, rate_per_second=rate, burst=burst)
+            db.session.add(limit)
+        db.session.commit()
+        self._bucket_for(session).set_rate(rate, burst or max(1.0, rate))
+        return limit
+
+    def get_running_jobs(self) -> List[int]:
+        with self._lock:
+            return list(self._running.keys())
+
+    # Scheduling
+    def _ensure_supervisor(self):
+        if self.app is None or self._supervisor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._supervisor_pid == os.getpid():
+                return
+            self._supervisor_pid = os.getpid()
+            self._running = {}
+            thread = threading.Thread(target=self._supervise, name='broadcast-supervisor', daemon=True)
+            thread.start()
+
+    def _supervise(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with self.app.app_context():
+                    stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+                    job_ids = [row.id for row in BroadcastJob.query.with_entities(BroadcastJob.id).filter(
+                        BroadcastJob.status.in_(('queued', 'running')),
+                        db.or_(BroadcastJob.locked_by.is_(None), BroadcastJob.heartbeat_at < stale)
+                    ).order_by(BroadcastJob.id).limit(self.max_running).all()]
+                    db.session.remove()
+                for job_id in job_ids:
+                    self._try_start(job_id)
+            except Exception:
+                logger.exception("Broadcast supervisor scan failed")
+
+    def _try_start(self, job_id: int) -> bool:
+        with self._lock:
+            if job_id in self._running or len(self._running) >= self.max_running:
+                return False
+            if not self._claim(job_id):
+                return False
+            thread = threading.Thread(target=self._run_job, args=(job_id,), name=f'broadcast-{job_id}', daemon=True)
+            self._running[job_id] = thread
+        thread.start()
+        return True
+
+    def _claim(self, job_id: int) -> bool:
+        with self.app.app_context():
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=self.lease_seconds)
+            claimed = BroadcastJob.query.filter(
+                BroadcastJob.id == job_id,
+                BroadcastJob.status.in_(('queued', 'running')),
+                db.or_(BroadcastJob.locked_by.is_(None), BroadcastJob.heartbeat_at < stale)
+            ).update({'locked_by': self.worker_id, 'heartbeat_at': now,
+                      'attempts': db.func.coalesce(BroadcastJob.attempts, 0) + 1}, synchronize_session=False)
+            db.session.commit()
+            db.session.remove()
+            return claimed == 1
+
+    # Execution
+    def _bucket_for(self, session: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(session)
+            if bucket is None:
+                bucket = TokenBucket(self.default_rate)
+                self._buckets[session] = bucket
+            return bucket
+
+    def _refresh_bucket(self, session: str) -> TokenBucket:
+        bucket = self._bucket_for(session)
+        limit = WhatsAPISessionLimit.query.filter_by(session=session).first()
+        rate = limit.rate_per_second if limit else self.default_rate
+        burst = (limit.burst if limit else None) or max(1.0, rate)
+        if rate != bucket.rate or burst != bucket.capacity:
+            bucket.set_rate(rate, burst)
+        return bucket
+
+    def _build_payload(self, template: str, recipient: Any, options: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(recipient, dict):
+            phone = recipient.get('phone')
+            variables = dict(recipient)
+            variables.update(recipient.get('vars') or {})
+        else:
+            phone = str(recipient)
+            variables = {'phone': phone}
+        if not phone:
+            raise ValueError('recipient without phone')
+        payload = {'phone': phone, 'isGroup': False}
+        payload.update(options)
+        payload['message'] = template.format_map(_TemplateVars(variables))
+        return payload
+
+    def _checkpoint(self, job_id: int, values: Dict[str, Any]) -> bool:
+        """Persist progress while we still hold the lease; False means stop (cancelled or lease lost)."""
+        values['heartbeat_at'] = datetime.utcnow()
+        updated = BroadcastJob.query.filter_by(
+            id=job_id, locked_by=self.worker_id, status='running'
+        ).update(values, synchronize_session=False)
+        db.session.commit()
+        return updated == 1
+
+    @staticmethod
+    def _wait(bucket: TokenBucket, stop: threading.Event) -> bool:
+        """Take a send token, checking `stop` every second; False once the job must stop."""
+        while not bucket.acquire(timeout=1.0):
+            if stop.is_set():
+                return False
+        return True
+
+    def _heartbeat(self, job_id: int, done: threading.Event, stop: threading.Event):
+        """Renew the lease while the job runs; sets `stop` once it is cancelled or the lease is lost."""
+        with self.app.app_context():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    renewed = BroadcastJob.query.filter_by(id=job_id, locked_by=self.worker_id, status='running').update(
+                        {'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                    db.session.commit()
+                except Exception:
+                    logger.exception(f"Broadcast job {job_id} heartbeat failed")
+                    db.session.rollback()
+                    continue
+                if renewed == 0:
+                    stop.set()
+                    break
+            db.session.remove()
+
+    def _run_job(self, job_id: int):
+        with self.app.app_context():
+            try:
+                self._process(job_id)
+            except Exception:
+                logger.exception(f"Broadcast job {job_id} crashed")
+                db.session.rollback()
+                # Give up after max_attempts claims; otherwise release the lease for a retry
+                BroadcastJob.query.filter(
+                    BroadcastJob.id == job_id, BroadcastJob.locked_by == self.worker_id,
+                    BroadcastJob.attempts >= self.max_attempts
+                ).update({'status': 'failed', 'finished_at': datetime.utcnow(), 'locked_by': None},
+                         synchronize_session=False)
+                BroadcastJob.query.filter_by(id=job_id, locked_by=self.worker_id).update(
+                    {'locked_by': None}, synchronize_session=False)
+                db.session.commit()
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._running.pop(job_id, None)
+
+    def _process(self, job_id: int):
+        job = db.session.get(BroadcastJob, job_id)
+        if job is None or job.locked_by != self.worker_id:
+            return
+        if (job.attempts or 0) > self.max_attempts:
+            # Its previous owners died mid-run (e.g. killed by this job) too many times
+            logger.error(f"Broadcast job {job_id} abandoned {job.attempts - 1} times; marking failed")
+            job.status, job.finished_at, job.locked_by = 'failed', datetime.utcnow(), None
+            db.session.commit()
+            return
+        session = job.session
+        template = job.template
+        recipients = json.loads(job.recipients)
+        options = json.loads(job.options) if job.options else {}
+        errors = json.loads(job.last_errors) if job.last_errors else []
+        index = job.cursor or 0
+        sent = job.sent_count or 0
+        failed = job.failed_count or 0
+        job_bucket = TokenBucket(job.rate_per_second) if job.rate_per_second else None
+
+        if job.started_at is None:
+            job.started_at = datetime.utcnow()
+        job.status = 'running'
+        db.session.commit()
+
+        # Lease renewed on a timer: a slow rate or WhatsAPI retries can outlast several checkpoints
+        done, stop = threading.Event(), threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, done, stop), name=f'broadcast-{job_id}-lease',
+                         daemon=True).start()
+        try:
+            session_bucket = self._refresh_bucket(session)
+            while index < len(recipients):
+                if stop.is_set():
+                    logger.info(f"Broadcast job {job_id} stopped at {index}/{len(recipients)}")
+                    return
+                if not self._wait(session_bucket, stop) or (job_bucket and not self._wait(job_bucket, stop)):
+                    logger.info(f"Broadcast job {job_id} stopped at {index}/{len(recipients)}")
+                    return
+
+                recipient = recipients[index]
+                try:
+                    payload = self._build_payload(template, recipient, options)
+                    whatsapi_service.send_message(session, payload, idempotency_key=f"broadcast-{job_id}-{index}")
+                    sent += 1
+                except Exception as e:
+                    failed += 1
+                    phone = recipient.get('phone') if isinstance(recipient, dict) else recipient
+                    errors = (errors + [{'index': index, 'phone': phone, 'error': str(e)}])[-self.max_errors_kept:]
+                index += 1
+
+                if index % self.checkpoint_every == 0 and index < len(recipients):
+                    if not self._checkpoint(job_id, {
+                        'cursor': index, 'sent_count': sent, 'failed_count': failed,
+                        'last_errors': json.dumps(errors, ensure_ascii=False)
+                    }):
+                        logger.info(f"Broadcast job {job_id} stopped at {index}/{len(recipients)}")
+                        return
+                    session_bucket = self._refresh_bucket(session)
+
+            self._checkpoint(job_id, {
+                'cursor': index, 'sent_count': sent, 'failed_count': failed,
+                'last_errors': json.dumps(errors, ensure_ascii=False),
+                'status': 'completed', 'finished_at': datetime.utcnow(), 'locked_by': None
+            })
+        finally:
+            done.set()
+
+# Singleton instance
+broadcast_service = BroadcastService()
@@ -0,0 +1,276 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from src.models.db_instance import db
+from src.models.conversation import Conversation, ConversationTurn
+from src.services.cache import TTLCache
+from src.services.prompt_builder import prompt_builder
+from src.services.llm_gateway import llm_gateway, PRIORITY_BATCH
+
+logger = logging.getLogger("conversation_store")
+
+ROLE_LABELS = {'user': 'Cliente', 'assistant': 'Agente'}
+
+
+class ConversationStore:
+    """
+    Server-side conversation history keyed by (agent, platform, customer).
+
+    Appending a reply is one counter UPDATE plus one multi-row INSERT of
+    the turns. The conversation id is cached; an UPDATE that matches no row
+    means the cached id is stale (the conversation was forgotten), so it is
+    evicted and resolved again. Once the turns not yet summarized exceed
+    CONVERSATION_MAX_TURNS or CONVERSATION_MAX_TOKENS, a background thread
+    folds all but the last CONVERSATION_KEEP_TURNS into the conversation's
+    rolling summary and deletes them, so the history loaded into the prompt
+    stays bounded. load() fetches the summary and the most recent turns in
+    a single query over the unique key and the (conversation_id, id) index.
+    """
+
+    def __init__(self):
+        self.max_turns = int(os.getenv('CONVERSATION_MAX_TURNS', 20))
+        self.max_tokens = int(os.getenv('CONVERSATION_MAX_TOKENS', 2000))
+        self.keep_turns = int(os.getenv('CONVERSATION_KEEP_TURNS', 8))
+        self.load_limit = int(os.getenv('CONVERSATION_LOAD_TURNS', 30))
+        self.summary_tokens = int(os.getenv('CONVERSATION_SUMMARY_TOKENS', 300))
+        self.summary_model = os.getenv('CONVERSATION_SUMMARY_MODEL', 'gpt-3.5-turbo')
+        self.compact_workers = int(os.getenv('CONVERSATION_COMPACT_WORKERS', 1))
+        self.openai_client = llm_gateway.client(PRIORITY_BATCH) if llm_gateway.configured else None
+        self.app = None
+        self._ids = TTLCache(maxsize=int(os.getenv('CONVERSATION_ID_CACHE_MAXSIZE', 20000)), ttl=3600)
+        self._executor = None
+        self._executor_pid = None
+        self._compacting = set()
+        self._lock = threading.Lock()
+        self.appended_turns = 0
+        self.loads = 0
+        self.compactions = 0
+        self.compacted_turns = 0
+        self.summary_failures = 0
+        self._load_seconds = 0.0
+
+    def init_app(self, app):
+        """Bind to the Flask app so compaction can run in background threads."""
+        self.app = app
+
+    # Hot path
+    def load(self, agent_id: int, platform: str, customer_key: str,
+             limit: Optional[int] = None) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """(rolling summary, most recent turns oldest first) of a conversation."""
+        started = time.perf_counter()
+        rows = db.session.query(
+            Conversation.summary, ConversationTurn.role, ConversationTurn.content
+        ).outerjoin(
+            ConversationTurn, ConversationTurn.conversation_id == Conversation.id
+        ).filter(
+            Conversation.agent_id == agent_id,
+            Conversation.platform == platform,
+            Conversation.customer_key == customer_key
+        ).order_by(ConversationTurn.id.desc()).limit(limit or self.load_limit).all()
+        self.loads += 1
+        self._load_seconds += time.perf_counter() - started
+        if not rows:
+            return None, []
+        turns = [{'role': row.role, 'content': row.content} for row in reversed(rows) if row.role]
+        return rows[0].summary, turns
+
+    def append(self, agent_id: int, platform: str, customer_key: str, turns: List[Tuple[str, str]]):
+        """Append (role, content) turns and schedule compaction when the conversation grows too long."""
+        now = datetime.utcnow()
+        rows = [{'role': role, 'content': content, 'tokens': prompt_builder.count(content), 'created_at': now}
+                for role, content in turns if content]
+        if not rows:
+            return
+        key = (agent_id, platform, customer_key)
+        tokens = sum(row['tokens'] for row in rows)
+        conversation_id, pending = self._bump_counters(key, len(rows), tokens, now)
+        if pending is None:
+            # The cached id is stale (the conversation was forgotten by another worker): resolve it again
+            self._ids.delete(key)
+            conversation_id, pending = self._bump_counters(key, len(rows), tokens, now)
+        for row in rows:
+            row['conversation_id'] = conversation_id
+        db.session.execute(ConversationTurn.__table__.insert(), rows)
+        db.session.commit()
+        self._ids.set(key, conversation_id)
+        self.appended_turns += len(rows)
+
+        if pending is not None and (pending[0] > self.max_turns or pending[1] > self.max_tokens):
+            self._schedule_compaction(conversation_id)
+
+    def _bump_counters(self, key: Tuple[int, str, str], turns: int, tokens: int, now: datetime):
+        """Add turns to the conversation's counters; returns (id, (pending_turns, pending_tokens)) or (id, None) if the row is gone."""
+        conversation_id = self._conversation_id(*key)
+        table = Conversation.__table__
+        agent_id, platform, customer_key = key
+        # Matching the key too keeps a stale id from hitting a conversation that reused it
+        statement = table.update().where(
+            table.c.id == conversation_id,
+            table.c.agent_id == agent_id,
+            table.c.platform == platform,
+            table.c.customer_key == customer_key
+        ).values(
+            turn_count=table.c.turn_count + turns,
+            pending_turns=table.c.pending_turns + turns,
+            pending_tokens=table.c.pending_tokens + tokens,
+            last_turn_at=now
+        )
+        if db.engine.dialect.update_returning:
+            return conversation_id, db.session.execute(
+                statement.returning(table.c.pending_turns, table.c.pending_tokens)).first()
+        if db.session.execute(statement).rowcount == 0:
+            return conversation_id, None
+        return conversation_id, db.session.query(Conversation.pending_turns, Conversation.pending_tokens).filter(
+            Conversation.id == conversation_id).first()
+
+    def forget(self, agent_id: int, platform: str, customer_key: str) -> bool:
+        """Delete a conversation (summary and turns)."""
+        conversation = Conversation.query.filter_by(agent_id=agent_id, platform=platform,
+                                                    customer_key=customer_key).first()
+        self._ids.delete((agent_id, platform, customer_key))
+        if conversation is None:
+            return False
+        ConversationTurn.query.filter_by(conversation_id=conversation.id).delete()
+        db.session.delete(conversation)
+        db.session.commit()
+        return True
+
+    def _conversation_id(self, agent_id: int, platform: str, customer_key: str) -> int:
+        key = (agent_id, platform, customer_key)
+        conversation_id = self._ids.get(key)
+        if conversation_id is not None:
+            return conversation_id
+        lookup = db.session.query(Conversation.id).filter_by(agent_id=agent_id, platform=platform,
+                                                             customer_key=customer_key)
+        conversation_id = lookup.scalar()
+        if conversation_id is None:
+            conversation = Conversation(agent_id=agent_id, platform=platform, customer_key=customer_key,
+                                        summarized_turns=0, turn_count=0, pending_turns=0, pending_tokens=0)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(conversation)
+                conversation_id = conversation.id
+            except IntegrityError:
+                # Another worker created it first
+                conversation_id = lookup.scalar()
+        return conversation_id
+
+    # Compaction
+    def _schedule_compaction(self, conversation_id: int):
+        with self._lock:
+            if conversation_id in self._compacting:
+                return
+            self._compacting.add(conversation_id)
+        if self.app is None:
+            self._compact_job(conversation_id)
+            return
+        self._get_executor().submit(self._compact_job, conversation_id)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads don't survive a gunicorn fork: one executor per process
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.compact_workers,
+                                                    thread_name_prefix='conversation-compact')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _compact_job(self, conversation_id: int):
+        try:
+            if self.app is None:
+                self.compact(conversation_id)
+            else:
+                with self.app.app_context():
+                    self.compact(conversation_id)
+        except Exception:
+            logger.exception("Compaction of conversation %s failed", conversation_id)
+        finally:
+            with self._lock:
+                self._compacting.discard(conversation_id)
+
+    def compact(self, conversation_id: int) -> bool:
+        """Fold all but the last keep_turns turns into the rolling summary."""
+        conversation = db.session.get(Conversation, conversation_id)
+        if conversation is None:
+            return False
+        turns = ConversationTurn.query.filter_by(conversation_id=conversation_id).order_by(ConversationTurn.id).all()
+        old = turns[:-self.keep_turns] if self.keep_turns else turns
+        if not old:
+            return False
+
+        summary = self._summarize(conversation.summary, old)
+        tokens = sum(turn.tokens or 0 for turn in old)
+        table = Conversation.__table__
+        # Optimistic guard: another process may have compacted the same turns meanwhile
+        result = db.session.execute(table.update().where(
+            table.c.id == conversation_id,
+            table.c.summarized_turns == (conversation.summarized_turns or 0)
+        ).values(
+            summary=summary,
+            summarized_turns=table.c.summarized_turns + len(old),
+            pending_turns=table.c.pending_turns - len(old),
+            pending_tokens=table.c.pending_tokens - tokens
+        ))
+        if result.rowcount == 0:
+            db.session.rollback()
+            return False
+        ConversationTurn.query.filter(
+            ConversationTurn.conversation_id == conversation_id,
+            ConversationTurn.id <= old[-1].id
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        self.compactions += 1
+        self.compacted_turns += len(old)
+        return True
+
+    def _summarize(self, previous: Optional[str], turns: List[ConversationTurn]) -> str:
+        transcript = '\n'.join(f"{ROLE_LABELS.get(turn.role, turn.role)}: {turn.content}" for turn in turns)
+        if self.openai_client:
+            try:
+                response = self.openai_client.chat.completions.create(
+                    model=self.summary_model,
+                    messages=[
+                        {"role": "system", "content": "Você resume conversas de vendas. Mantenha nome, necessidades, "
+                                                      "objeções, produtos e preços citados, compromissos e próximos passos. "
+                                                      "Responda só com o resumo, em português brasileiro."},
+                        {"role": "user", "content": f"Resumo anterior:\n{previous or '(nenhum)'}\n\n"
+                                                    f"Novas mensagens:\n{transcript}\n\nResumo atualizado:"}
+                    ],
+                    temperature=0.2,
+                    max_tokens=self.summary_tokens
+                )
+                summary = (response.choices[0].message.content or '').strip()
+                if summary:
+                    return summary
+            except Exception as e:
+                logger.warning("Summary model failed, using extractive summary: %s", e)
+            self.summary_failures += 1
+        return self._extractive_summary(previous, turns)
+
+    def _extractive_summary(self, previous: Optional[str], turns: List[ConversationTurn]) -> str:
+        """Offline fallback: the turns cut to a few tokens each, oldest lines dropped past the budget."""
+        lines = (previous or '').splitlines()
+        lines += [f"{ROLE_LABELS.get(turn.role, turn.role)}: {prompt_builder.counter.truncate(turn.content, 40)}"
+                  for turn in turns]
+        while len(lines) > 1 and prompt_builder.count('\n'.join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return '\n'.join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'appended_turns': self.appended_turns,
+            'loads': self.loads,
+            'avg_load_ms': round(self._load_seconds / self.loads * 1000, 4) if self.loads else 0.0,
+            'compactions': self.compactions,
+            'compacted_turns': self.compacted_turns,
+            'compacting': len(self._compacting),
+            'summary_failures': self.summary_failures
+        }
+
+# Singleton instance
+conversation_store = ConversationStore()
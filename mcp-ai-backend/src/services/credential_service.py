@@ -0,0 +1,107 @@
+import os
+import json
+import logging
+import threading
+from typing import Optional
+from flask_jwt_extended import get_jwt_identity
+from src.models.zapi_credentials import ZapiCredentials
+from src.services.cache import TTLCache
+
+try:
+    import redis
+except ImportError:  # optional: only needed for cross-worker invalidation
+    redis = None
+
+logger = logging.getLogger("credentials")
+
+_MISSING = object()
+
+
+class CredentialResolver:
+    """
+    Resolves a JWT identity to the user's WhatsAPI session (ZapiCredentials.instance_id).
+
+    Lookups are cached in-process (bounded by size and TTL) so proxied
+    WhatsAPI calls skip the credentials query. save_zapi_credentials calls
+    invalidate(); when CREDENTIALS_REDIS_URL is set (and redis is installed)
+    invalidations are also broadcast to the other gunicorn workers, otherwise
+    the TTL bounds how long another worker can serve a stale session.
+    """
+
+    CHANNEL = 'zapi-credentials-invalidate'
+
+    def __init__(self):
+        self.cache = TTLCache(
+            maxsize=int(os.getenv('CREDENTIALS_CACHE_MAXSIZE', 10000)),
+            ttl=float(os.getenv('CREDENTIALS_CACHE_TTL', 60))
+        )
+        self.redis_url = os.getenv('CREDENTIALS_REDIS_URL')
+        self._redis = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def get_session(self, user_id) -> Optional[str]:
+        """Return the user's session id, or None if they have no credentials."""
+        if user_id is None:
+            return None
+        self._ensure_listener()
+        key = str(user_id)
+        session = self.cache.get(key, _MISSING)
+        if session is _MISSING:
+            cred = ZapiCredentials.query.with_entities(ZapiCredentials.instance_id).filter_by(user_id=user_id).first()
+            session = cred.instance_id if cred else None
+            self.cache.set(key, session)
+        return session
+
+    def invalidate(self, user_id):
+        """Forget the cached session for `user_id` here and, if configured, in every worker."""
+        self.cache.delete(str(user_id))
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.publish(self.CHANNEL, json.dumps({'user_id': str(user_id)}))
+            except Exception as e:
+                logger.warning(f"Could not publish credentials invalidation: {e}")
+
+    def stats(self):
+        return self.cache.stats()
+
+    # Cross-worker invalidation
+    def _get_redis(self):
+        if not self.redis_url or redis is None:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid() or self._get_redis() is None:
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._redis = None  # connections must not be shared across a fork
+            thread = threading.Thread(target=self._listen, name='credentials-invalidation', daemon=True)
+            thread.start()
+
+    def _listen(self):
+        try:
+            pubsub = self._get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.CHANNEL)
+            for message in pubsub.listen():
+                try:
+                    self.cache.delete(json.loads(message['data'])['user_id'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        except Exception:
+            logger.exception("Credentials invalidation listener stopped; relying on cache TTL")
+
+
+# Singleton instance
+credential_resolver = CredentialResolver()
+
+
+def get_user_session():
+    """Get user's session ID from their credentials"""
+    return credential_resolver.get_session(get_jwt_identity())
@@ -0,0 +1,91 @@
+import os
+import zlib
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import List, Optional
+from src.services.knowledge_index import tokenize
+
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension."""
+
+    name = 'base'
+    dim = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """One L2-normalized row per text, shape (len(texts), dim)."""
+
+    @staticmethod
+    def to_bytes(vector: np.ndarray) -> bytes:
+        """Compact storage format: float16."""
+        return np.asarray(vector, dtype=np.float16).tobytes()
+
+    def from_bytes(self, data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic offline embedder (feature hashing).
+
+    Words and their character trigrams are hashed with CRC32 into `dim`
+    signed buckets, so the same text always yields the same vector without
+    any model download or network call; good enough for tests and for
+    agents whose knowledge is mostly keyword-like.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _features(self, text: str):
+        for word in tokenize(text):
+            yield word, 1.0
+            padded = f'<{word}>'
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        return self._normalize(matrix)
+
+
+class OpenAIEmbedder(Embedder):
+    """OpenAI embeddings endpoint (text-embedding-3-* supports reduced dimensions)."""
+
+    def __init__(self, model: str = 'text-embedding-3-small', dim: int = 256, client=None):
+        import openai
+        self.model = model
+        self.dim = dim
+        self.name = f'openai-{model}-{dim}'
+        self.client = client or openai.OpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        matrix = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return self._normalize(matrix)
+
+
+def get_embedder(kind: Optional[str] = None) -> Embedder:
+    """Embedder selected by KNOWLEDGE_EMBEDDER ('hashing' default, or 'openai')."""
+    kind = kind or os.getenv('KNOWLEDGE_EMBEDDER', 'hashing')
+    dim = int(os.getenv('KNOWLEDGE_EMBEDDING_DIM', 256))
+    if kind == 'openai':
+        return OpenAIEmbedder(os.getenv('KNOWLEDGE_EMBEDDING_MODEL', 'text-embedding-3-small'), dim)
+    return HashingEmbedder(dim)
@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import json
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Any, List, Iterable, Optional, Tuple
+
+# Terms per language and category; matched as whole words/phrases, case and accent insensitive
+LEXICONS: Dict[str, Dict[str, List[str]]] = {
+    'pt': {
+        'positive': ['ótimo', 'excelente', 'perfeito', 'interessante', 'quero', 'sim', 'gostei'],
+        'negative': ['não', 'ruim', 'caro', 'difícil', 'complicado', 'problema'],
+        'greeting': ['olá', 'oi', 'bom dia', 'boa tarde', 'boa noite'],
+        'pricing': ['preço', 'valor', 'quanto custa'],
+        'purchase': ['quero', 'comprar', 'fechar'],
+    },
+    'es': {
+        'positive': ['genial', 'excelente', 'perfecto', 'interesante', 'quiero', 'sí', 'me gusta'],
+        'negative': ['no', 'malo', 'caro', 'difícil', 'complicado', 'problema'],
+        'greeting': ['hola', 'buenos días', 'buenas tardes', 'buenas noches'],
+        'pricing': ['precio', 'valor', 'cuánto cuesta'],
+        'purchase': ['quiero', 'comprar', 'cerrar'],
+    },
+    'en': {
+        'positive': ['great', 'excellent', 'perfect', 'interesting', 'i want', 'yes', 'love it'],
+        'negative': ['no', 'not', 'bad', 'expensive', 'difficult', 'complicated', 'problem'],
+        'greeting': ['hello', 'hi', 'good morning', 'good afternoon', 'good evening'],
+        'pricing': ['price', 'cost', 'how much'],
+        'purchase': ['buy', 'purchase', 'i want', 'sign up'],
+    },
+}
+CATEGORIES = ('positive', 'negative', 'greeting', 'pricing', 'purchase')
+
+_MARKS = re.compile('[\u0300-\u036f]')
+_SPACES = re.compile(r'\s+')
+
+
+def strip_accents(text: str) -> str:
+    return _MARKS.sub('', unicodedata.normalize('NFD', text))
+
+
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """Regex alternation of the terms factored as a trie, so shared prefixes are matched once."""
+    trie: Dict[str, Any] = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node) -> str:
+        branches = [(r'\s+' if char == ' ' else re.escape(char)) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional tail: the longest term wins ('quanto custa' over a shorter overlap)
+        return f'(?:{pattern})?' if '' in node else pattern
+
+    return build(trie)
+
+
+class _Automaton:
+    """One compiled regex over every term of a lexicon, plus term -> category indexes."""
+
+    def __init__(self, lexicon: Dict[str, List[str]]):
+        self.categories: Dict[str, List[int]] = {}
+        for index, category in enumerate(CATEGORIES):
+            for term in lexicon.get(category, []):
+                term = _SPACES.sub(' ', unicodedata.normalize('NFC', term.lower()).strip())
+                # Customers often skip accents: 'nao' and 'preco' are terms too, so messages are only lowercased
+                for key in {term, strip_accents(term)}:
+                    if index not in self.categories.setdefault(key, []):
+                        self.categories[key].append(index)
+        self.pattern = re.compile(rf'(?<!\w){_trie_pattern(self.categories)}(?!\w)') if self.categories else None
+
+    def scan(self, text: str) -> Tuple[int, ...]:
+        """Number of distinct terms of each category found in the text."""
+        counts = [0] * len(CATEGORIES)
+        if self.pattern is None:
+            return tuple(counts)
+        for term in set(self.pattern.findall(text.lower())):
+            indexes = self.categories.get(term) or self.categories[_SPACES.sub(' ', term)]
+            for index in indexes:
+                counts[index] += 1
+        return tuple(counts)
+
+
+class InteractionClassifier:
+    """
+    Sentiment, conversation stage and interaction type of a customer message.
+
+    Each language's lexicon is compiled into a single regex with word
+    boundaries, so the message is lowercased once and scanned once for all
+    categories ('oi' no longer matches inside 'oito', nor 'não' inside a
+    longer word); accent-free spellings of the terms match as well. CLASSIFIER_LEXICONS (inline JSON or a path to a JSON
+    file) adds terms to the built-in lexicons or new languages, e.g.
+    {"pt": {"negative": ["caro demais"]}}. Scans are memoized per
+    (language, message); classify_batch serves backfills.
+    """
+
+    def __init__(self):
+        self.default_language = os.getenv('CLASSIFIER_LANGUAGE', 'pt')
+        self.lexicons = {language: {category: list(terms) for category, terms in lexicon.items()}
+                         for language, lexicon in LEXICONS.items()}
+        extra = os.getenv('CLASSIFIER_LEXICONS')
+        if extra:
+            if os.path.exists(extra):
+                with open(extra, encoding='utf-8') as f:
+                    extra = f.read()
+            for language, lexicon in json.loads(extra).items():
+                self.lexicons.setdefault(language, {})
+                for category, terms in lexicon.items():
+                    known = self.lexicons[language].setdefault(category, [])
+                    known.extend(term for term in terms if term not in known)
+        self._automata = {language: _Automaton(lexicon) for language, lexicon in self.lexicons.items()}
+        self._scan = lru_cache(maxsize=int(os.getenv('CLASSIFIER_CACHE_SIZE', 4096)))(self._scan_uncached)
+
+    def language(self, language: Optional[str] = None) -> str:
+        """Lexicon for a language tag ('pt-BR' -> 'pt'), falling back to the default one."""
+        base = (language or self.default_language).split('-')[0].split('_')[0].lower()
+        return base if base in self._automata else self.default_language
+
+    def _scan_uncached(self, language: str, message: str) -> Tuple[int, ...]:
+        return self._automata[language].scan(message)
+
+    def classify(self, message: str, language: Optional[str] = None) -> Dict[str, Any]:
+        """{'sentiment', 'stage', 'interaction_type', 'confidence', 'suggested_actions'} of a message."""
+        return self._result(self._scan(self.language(language), message or ''))
+
+    def classify_batch(self, messages: Iterable[str], language: Optional[str] = None) -> List[Dict[str, Any]]:
+        """classify() over many messages, e.g. backfills (bypasses the shared memo, repeats are scanned once)."""
+        scan = self._automata[self.language(language)].scan
+        seen: Dict[str, Tuple[int, ...]] = {}
+        results = []
+        for message in messages:
+            message = message or ''
+            counts = seen.get(message)
+            if counts is None:
+                counts = seen[message] = scan(message)
+            results.append(self._result(counts))
+        return results
+
+    @staticmethod
+    def _result(counts: Tuple[int, ...]) -> Dict[str, Any]:
+        positive, negative, greeting, pricing, purchase = counts
+
+        if positive > negative:
+            sentiment = 'positive'
+            confidence = min(0.8, 0.5 + (positive * 0.1))
+        elif negative > positive:
+            sentiment = 'negative'
+            confidence = min(0.8, 0.5 + (negative * 0.1))
+        else:
+            sentiment = 'neutral'
+            confidence = 0.5
+
+        if greeting:
+            stage, interaction_type = 'awareness', 'initial_contact'
+        elif pricing:
+            stage, interaction_type = 'consideration', 'pricing_inquiry'
+        elif purchase:
+            stage, interaction_type = 'purchase', 'purchase_intent'
+        else:
+            stage, interaction_type = 'interest', 'follow_up'
+
+        suggested_actions = []
+        if sentiment == 'positive' and stage == 'consideration':
+            suggested_actions.append('send_proposal')
+        elif sentiment == 'negative':
+            suggested_actions.append('address_objection')
+        elif stage == 'purchase':
+            suggested_actions.append('close_deal')
+
+        return {
+            'sentiment': sentiment,
+            'stage': stage,
+            'interaction_type': interaction_type,
+            'confidence': confidence,
+            'suggested_actions': suggested_actions
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        info = self._scan.cache_info()
+        return {
+            'languages': sorted(self._automata),
+            'default_language': self.default_language,
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            'cache_size': info.currsize
+        }
+
+# Singleton instance
+interaction_classifier = InteractionClassifier()
+
+
+def benchmark(count: int = 20000) -> Dict[str, float]:
+    """Microseconds per message of the compiled classifier vs the previous substring scans."""
+    samples = ['Oi, tudo bem?', 'Quanto custa o plano anual?', 'Achei caro, não sei se vale a pena',
+               'Quero comprar agora, como faço para fechar?', 'Pode me mandar mais detalhes do produto oito?',
+               'Ótimo, gostei muito da proposta, excelente atendimento!']
+    messages = [f"{samples[n % len(samples)]} #{n}" for n in range(count)]  # distinct, so the memo never hits
+
+    def legacy(message):
+        lowered = message.lower()
+        positive = sum(1 for word in LEXICONS['pt']['positive'] if word in lowered)
+        negative = sum(1 for word in LEXICONS['pt']['negative'] if word in lowered)
+        stage = ('awareness' if any(word in lowered for word in ['olá', 'oi', 'bom dia', 'boa tarde']) else
+                 'consideration' if any(word in lowered for word in ['preço', 'valor', 'quanto custa']) else
+                 'purchase' if any(word in lowered for word in ['quero', 'comprar', 'fechar']) else 'interest')
+        kind = ('initial_contact' if 'olá' in message.lower() or 'oi' in message.lower() else
+                'pricing_inquiry' if 'preço' in message.lower() or 'valor' in message.lower() else
+                'purchase_intent' if 'quero' in message.lower() or 'comprar' in message.lower() else 'follow_up')
+        return positive, negative, stage, kind
+
+    classifier = InteractionClassifier()
+    started = time.perf_counter()
+    for message in messages:
+        legacy(message)
+    legacy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    classifier.classify_batch(messages)
+    compiled_seconds = time.perf_counter() - started
+    # The agent classifies each message again for routing, analysis and logging: repeats hit the memo
+    started = time.perf_counter()
+    for message in messages[:len(samples)] * (count // len(samples)):
+        classifier.classify(message)
+    memoized_seconds = time.perf_counter() - started
+    return {
+        'messages': count,
+        'legacy_us_per_message': round(legacy_seconds / count * 1e6, 2),
+        'compiled_us_per_message': round(compiled_seconds / count * 1e6, 2),
+        'memoized_us_per_message': round(memoized_seconds / count * 1e6, 2)
+    }
+
+
+if __name__ == '__main__':
+    # python -m src.services.interaction_classifier [messages]
+    print(json.dumps(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000), indent=2))
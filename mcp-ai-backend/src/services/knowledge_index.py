@@ -0,0 +1,305 @@
+import os
+import json
+import math
+import time
+import heapq
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from src.models.db_instance import db
+from src.models.mcp_agent import AgentKnowledge
+from src.services.response_cache import normalize_message
+from src.services.prompt_builder import prompt_builder
+
+# Palavras muito frequentes que só diluem o ranking
+STOPWORDS = frozenset((
+    'a', 'o', 'as', 'os', 'e', 'de', 'do', 'da', 'dos', 'das', 'em', 'no', 'na', 'nos', 'nas', 'um', 'uma',
+    'para', 'pra', 'por', 'com', 'que', 'se', 'me', 'eu', 'voce', 'vc', 'qual', 'quais', 'ao', 'aos', 'ou',
+    'the', 'and', 'of', 'to', 'is', 'in', 'for', 'on', 'it'
+))
+
+TITLE_WEIGHT = 2  # title terms count twice
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in normalize_message(text).split() if len(t) > 1 and t not in STOPWORDS]
+
+
+def knowledge_prior(priority: Optional[int], effectiveness_score: Optional[float]) -> float:
+    """Ranking multiplier: priority 1-5 and effectiveness 0-1 scale the text relevance."""
+    return (1.0 + 0.15 * ((priority or 1) - 1)) * (1.0 + (effectiveness_score or 0.0))
+
+
+class _Doc:
+    __slots__ = ('id', 'length', 'prior', 'category', 'title', 'content', 'terms')
+
+    def __init__(self, row: Dict[str, Any]):
+        tags = row.get('tags')
+        if isinstance(tags, str):
+            try:
+                tags = json.loads(tags)
+            except ValueError:
+                tags = [tags]
+        terms = Counter(tokenize(row['title'] or '') * TITLE_WEIGHT)
+        terms.update(tokenize(row['content'] or ''))
+        terms.update(tokenize(' '.join(str(t) for t in (tags or []))))
+        self.id = row['id']
+        self.terms = terms
+        self.length = sum(terms.values()) or 1
+        self.prior = knowledge_prior(row.get('priority'), row.get('effectiveness_score'))
+        self.category = row['category']
+        self.title = row['title']
+        self.content = row['content']
+
+
+class _AgentIndex:
+    """BM25 inverted index of one agent's active knowledge entries."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_postings: int):
+        self.docs: Dict[int, _Doc] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_length = 0
+        self.max_postings = max_postings
+        self.signature = None
+        self.checked_at = 0.0
+        # term -> [(impact, doc_id)] sorted best first, rebuilt lazily after changes
+        self._impacts: Dict[str, List[Tuple[float, int]]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, doc: _Doc):
+        self.remove(doc.id)
+        self.docs[doc.id] = doc
+        self.total_length += doc.length
+        for term, tf in doc.terms.items():
+            self.postings.setdefault(term, {})[doc.id] = tf
+            self._impacts.pop(term, None)
+
+    def load(self, docs: List[_Doc]):
+        """Bulk-build from scratch (no per-document bookkeeping)."""
+        postings = self.postings
+        for doc in docs:
+            self.docs[doc.id] = doc
+            self.total_length += doc.length
+            for term, tf in doc.terms.items():
+                posting = postings.get(term)
+                if posting is None:
+                    postings[term] = {doc.id: tf}
+                else:
+                    posting[doc.id] = tf
+
+    def remove(self, doc_id: int):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_length -= doc.length
+        for term in doc.terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+            self._impacts.pop(term, None)
+
+    def _impact_list(self, term: str) -> List[Tuple[float, int]]:
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            posting = self.postings[term]
+            avg_length = self.total_length / len(self.docs)
+            idf = math.log(1 + (len(self.docs) - len(posting) + 0.5) / (len(posting) + 0.5))
+            impacts = []
+            for doc_id, tf in posting.items():
+                doc = self.docs[doc_id]
+                norm = tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * doc.length / avg_length))
+                impacts.append((idf * norm * doc.prior, doc_id))
+            impacts.sort(reverse=True)
+            self._impacts[term] = impacts
+        return impacts
+
+    def search(self, terms: List[str], top_k: int) -> List[Tuple[float, _Doc]]:
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            # Impact-ordered postings: only the strongest entries of very common terms are scanned
+            for impact, doc_id in self._impact_list(term)[:self.max_postings]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + impact
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.docs[doc_id]) for doc_id, score in best]
+
+
+class KnowledgeIndex:
+    """
+    In-memory retrieval over AgentKnowledge for the agent prompt.
+
+    Each agent gets a BM25 index over title (weighted), content and tags,
+    built on its first query. Inserts/updates/deletes committed through the
+    ORM are applied incrementally; other workers' writes are picked up by a
+    cheap count/max(updated_at) check every KNOWLEDGE_INDEX_CHECK_SECONDS.
+    Scores are scaled by priority and effectiveness_score and the top-k
+    snippets are packed into a token budget.
+    """
+
+    def __init__(self):
+        self.top_k = int(os.getenv('KNOWLEDGE_TOP_K', 5))
+        self.token_budget = int(os.getenv('KNOWLEDGE_TOKEN_BUDGET', 600))
+        self.check_interval = float(os.getenv('KNOWLEDGE_INDEX_CHECK_SECONDS', 60))
+        self.max_postings = int(os.getenv('KNOWLEDGE_MAX_POSTINGS', 2000))
+        self._indexes: Dict[int, _AgentIndex] = {}
+        self._listeners: List[Callable[[List[Tuple[str, Dict[str, Any]]]], None]] = []
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.builds = 0
+        self._query_seconds = 0.0
+
+    def search(self, agent_id: int, query: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        terms = tokenize(query)
+        if agent_id is None or not terms:
+            return []
+        index = self._get_index(agent_id)
+        started = time.perf_counter()
+        with index.lock:
+            results = index.search(terms, top_k or self.top_k)
+        self.queries += 1
+        self._query_seconds += time.perf_counter() - started
+        return [{
+            'id': doc.id,
+            'category': doc.category,
+            'title': doc.title,
+            'content': doc.content,
+            'score': round(score, 4)
+        } for score, doc in results]
+
+    def relevant_text(self, agent_id: int, query: str, token_budget: Optional[int] = None,
+                      top_k: Optional[int] = None) -> str:
+        """Top snippets formatted for the prompt, stopping at the token budget."""
+        return self.format_snippets(self.search(agent_id, query, top_k), token_budget)
+
+    def format_snippets(self, entries: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
+        """Format ranked entries for the prompt, stopping at the token budget."""
+        budget = token_budget or self.token_budget
+        lines = []
+        for line in self.snippet_lines(entries):
+            cost = prompt_builder.count(line, static=True)
+            if cost > budget:
+                if not lines and budget > 20:
+                    lines.append(prompt_builder.counter.truncate(line, budget))
+                break
+            lines.append(line)
+            budget -= cost
+        return '\n'.join(lines)
+
+    @staticmethod
+    def snippet_lines(entries: List[Dict[str, Any]]) -> List[str]:
+        return [f"- [{entry['category']}] {entry['title']}: {entry['content']}" for entry in entries]
+
+    def on_change(self, listener: Callable[[List[Tuple[str, Dict[str, Any]]]], None]):
+        """Also hand committed knowledge changes to `listener` (e.g. the vector index)."""
+        self._listeners.append(listener)
+
+    def apply(self, changes: List[Tuple[str, Dict[str, Any]]]):
+        """Apply committed ('upsert' | 'delete', row) changes to indexes already in memory."""
+        for listener in self._listeners:
+            listener(changes)
+        for op, row in changes:
+            index = self._indexes.get(row['agent_id'])
+            if index is None:
+                continue
+            with index.lock:
+                if op == 'delete' or not row.get('is_active', True):
+                    index.remove(row['id'])
+                else:
+                    index.add(_Doc(row))
+                index.signature = None  # resync signature on the next check
+
+    def invalidate(self, agent_id: int):
+        with self._lock:
+            self._indexes.pop(agent_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'agents_indexed': len(self._indexes),
+            'documents': sum(len(index.docs) for index in list(self._indexes.values())),
+            'builds': self.builds,
+            'queries': self.queries,
+            'avg_query_ms': round(self._query_seconds / self.queries * 1000, 4) if self.queries else 0.0
+        }
+
+    @staticmethod
+    def _signature(agent_id: int):
+        return tuple(db.session.query(
+            db.func.count(AgentKnowledge.id), db.func.max(AgentKnowledge.updated_at)
+        ).filter(AgentKnowledge.agent_id == agent_id, AgentKnowledge.is_active.is_(True)).one())
+
+    def _get_index(self, agent_id: int) -> _AgentIndex:
+        index = self._indexes.get(agent_id)
+        now = time.monotonic()
+        if index is not None and now - index.checked_at < self.check_interval:
+            return index
+        signature = self._signature(agent_id)
+        if index is not None:
+            index.checked_at = now
+            if index.signature is None:
+                index.signature = signature
+            if index.signature == signature:
+                return index
+        return self._build(agent_id, signature)
+
+    def _build(self, agent_id: int, signature) -> _AgentIndex:
+        rows = db.session.query(
+            AgentKnowledge.id, AgentKnowledge.agent_id, AgentKnowledge.category, AgentKnowledge.title,
+            AgentKnowledge.content, AgentKnowledge.tags, AgentKnowledge.priority, AgentKnowledge.effectiveness_score
+        ).filter(AgentKnowledge.agent_id == agent_id, AgentKnowledge.is_active.is_(True)).all()
+        index = _AgentIndex(self.max_postings)
+        index.load([_Doc(row._asdict()) for row in rows])
+        index.signature = signature
+        index.checked_at = time.monotonic()
+        with self._lock:
+            self._indexes[agent_id] = index
+        self.builds += 1
+        return index
+
+# Singleton instance
+knowledge_index = KnowledgeIndex()
+
+
+def _snapshot(target: AgentKnowledge) -> Dict[str, Any]:
+    return {
+        'id': target.id, 'agent_id': target.agent_id, 'category': target.category, 'title': target.title,
+        'content': target.content, 'tags': target.tags, 'priority': target.priority,
+        'effectiveness_score': target.effectiveness_score, 'is_active': target.is_active,
+        'embedding': target.embedding, 'embedding_model': target.embedding_model
+    }
+
+
+def _record(target: AgentKnowledge, op: str):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('knowledge_changes', []).append((op, _snapshot(target)))
+
+
+@event.listens_for(AgentKnowledge, 'after_insert')
+@event.listens_for(AgentKnowledge, 'after_update')
+def _knowledge_saved(mapper, connection, target):
+    _record(target, 'upsert')
+
+
+@event.listens_for(AgentKnowledge, 'after_delete')
+def _knowledge_deleted(mapper, connection, target):
+    _record(target, 'delete')
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_knowledge_changes(session):
+    changes = session.info.pop('knowledge_changes', None)
+    if changes:
+        knowledge_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_knowledge_changes(session):
+    session.info.pop('knowledge_changes', None)
@@ -0,0 +1,193 @@
+import os
+import time
+import heapq
+import itertools
+import logging
+import threading
+import openai
+from collections import deque, Counter
+from typing import Dict, Any, List, Optional
+from src.services.rate_limit import TokenBucket
+from src.services.prompt_builder import prompt_builder
+
+logger = logging.getLogger("llm_gateway")
+
+# Lower runs first
+PRIORITY_LIVE = 0    # customer chat, webhook replies
+PRIORITY_BATCH = 1   # strategy generation, summaries
+PRIORITY_NAMES = {PRIORITY_LIVE: 'live', PRIORITY_BATCH: 'batch'}
+
+
+class GatewayTimeout(Exception):
+    """The request waited longer than LLM_QUEUE_TIMEOUT for a slot."""
+
+
+class LLMGateway:
+    """
+    Single entry point for outbound OpenAI chat completions.
+
+    Callers wait in a priority queue (live chat ahead of batch work) for a
+    slot bounded by a global and a per-user concurrency limit (the user is
+    the request's `user` parameter), then take one request and the
+    estimated tokens (prompt + max_tokens) from the RPM/TPM token buckets.
+    Limits are per process: set them to the provider quota divided by the
+    number of gunicorn workers. Streams hold their slot until the last
+    chunk is read. Queue wait is recorded per priority.
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', 16))
+        self.max_per_user = int(os.getenv('LLM_MAX_CONCURRENCY_PER_USER', 4))
+        self.queue_timeout = float(os.getenv('LLM_QUEUE_TIMEOUT', 60))
+        rpm = float(os.getenv('LLM_REQUESTS_PER_MINUTE', 500))
+        tpm = float(os.getenv('LLM_TOKENS_PER_MINUTE', 200000))
+        self.requests = TokenBucket(rpm / 60.0, capacity=max(1.0, rpm / 6.0))
+        self.tokens = TokenBucket(tpm / 60.0, capacity=max(1.0, tpm / 6.0))
+        self.openai_client = None
+        self._cond = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._active_by_user = Counter()
+        self._waits: Dict[str, deque] = {name: deque(maxlen=2000) for name in PRIORITY_NAMES.values()}
+        self._served = Counter()
+        self.timeouts = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def configured(self) -> bool:
+        return self.openai_client is not None or bool(os.getenv('OPENAI_API_KEY'))
+
+    def client(self, priority: int = PRIORITY_LIVE) -> "GatewayClient":
+        """OpenAI-compatible client (client.chat.completions.create) whose calls go through the gateway."""
+        return GatewayClient(self, priority)
+
+    def _get_client(self):
+        if self.openai_client is None:
+            self.openai_client = openai.OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+            )
+        return self.openai_client
+
+    def create(self, priority: int = PRIORITY_LIVE, **kwargs):
+        """chat.completions.create through the gateway (streams keep their slot while being read)."""
+        if kwargs.get('stream'):
+            return self._stream(priority, kwargs)
+        user = self._acquire(priority, kwargs)
+        try:
+            return self._get_client().chat.completions.create(**kwargs)
+        finally:
+            self._release(user)
+
+    def _stream(self, priority: int, kwargs: Dict[str, Any]):
+        user = self._acquire(priority, kwargs)
+        try:
+            yield from self._get_client().chat.completions.create(**kwargs)
+        finally:
+            self._release(user)
+
+    def _acquire(self, priority: int, kwargs: Dict[str, Any]) -> Optional[str]:
+        user = kwargs.get('user')
+        ticket = (priority, next(self._sequence), user)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while not self._can_run(ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self.timeouts += 1
+                    self._cond.notify_all()
+                    raise GatewayTimeout(f"LLM gateway: no slot after {self.queue_timeout:.0f}s")
+                self._cond.wait(remaining)
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._active += 1
+            self._active_by_user[user] += 1
+
+        # Rate limits are taken while holding the slot, so they are also served in priority order
+        throttle_started = time.monotonic()
+        self.requests.acquire(1)
+        self.tokens.acquire(self._estimate_tokens(kwargs))
+        self.throttled_seconds += time.monotonic() - throttle_started
+        self._waits[PRIORITY_NAMES.get(priority, 'batch')].append(time.monotonic() - started)
+        self._served[PRIORITY_NAMES.get(priority, 'batch')] += 1
+        return user
+
+    def _can_run(self, ticket: tuple) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        # First waiter (by priority, then arrival) whose user is below its own limit
+        for waiting in sorted(self._waiting):
+            if waiting[2] is not None and self._active_by_user[waiting[2]] >= self.max_per_user:
+                continue
+            return waiting is ticket
+        return False
+
+    def _release(self, user: Optional[str]):
+        with self._cond:
+            self._active -= 1
+            self._active_by_user[user] -= 1
+            if self._active_by_user[user] <= 0:
+                del self._active_by_user[user]
+            self._cond.notify_all()
+
+    @staticmethod
+    def _estimate_tokens(kwargs: Dict[str, Any]) -> int:
+        prompt = sum(prompt_builder.count(message.get('content') or '', kwargs.get('model')) + 4
+                     for message in kwargs.get('messages') or [])
+        return prompt + (kwargs.get('max_tokens') or 500)
+
+    @staticmethod
+    def _percentile(samples: List[float], q: float) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = Counter(PRIORITY_NAMES.get(ticket[0], 'batch') for ticket in self._waiting)
+            active = self._active
+        queue_wait = {}
+        for name, samples in self._waits.items():
+            samples = list(samples)
+            queue_wait[name] = {
+                'served': self._served[name],
+                'queued': queued.get(name, 0),
+                'avg_ms': round(sum(samples) / len(samples) * 1000, 1) if samples else 0.0,
+                'p95_ms': round(self._percentile(samples, 0.95) * 1000, 1)
+            }
+        return {
+            'active': active,
+            'max_concurrency': self.max_concurrency,
+            'max_per_user': self.max_per_user,
+            'timeouts': self.timeouts,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+            'queue_wait': queue_wait
+        }
+
+
+class _Completions:
+    def __init__(self, gateway: LLMGateway, priority: int):
+        self._gateway = gateway
+        self._priority = priority
+
+    def create(self, **kwargs):
+        return self._gateway.create(self._priority, **kwargs)
+
+
+class _Chat:
+    def __init__(self, gateway: LLMGateway, priority: int):
+        self.completions = _Completions(gateway, priority)
+
+
+class GatewayClient:
+    """Drop-in for openai.OpenAI().chat at a fixed priority."""
+
+    def __init__(self, gateway: LLMGateway, priority: int):
+        self.chat = _Chat(gateway, priority)
+
+# Singleton instance
+llm_gateway = LLMGateway()
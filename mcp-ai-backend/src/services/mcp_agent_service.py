@@ -1,10 +1,24 @@
 import os
 import json
-import openai
+import time
+import logging
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Iterator
+from src.models.db_instance import db
 from src.models.mcp_agent import MCPAgent, AgentKnowledge, ConversationFlow
 from src.models.campaign import SalesInteraction, Campaign, ProductDatabase
+from src.services.response_cache import response_cache
+from src.services.knowledge_index import knowledge_index
+from src.services.vector_index import vector_index
+from src.services.prompt_builder import prompt_builder, product_line, MESSAGE_OVERHEAD
+from src.services.conversation_store import conversation_store
+from src.services.model_router import model_router
+from src.services.llm_gateway import llm_gateway, PRIORITY_LIVE
+from src.services.interaction_classifier import interaction_classifier
+from src.services.write_behind import write_behind
+from src.services.agent_cache import agent_cache, CampaignBinding
+
+logger = logging.getLogger("mcp_agent")
 
 class MCPAgentService:
     """
@@ -15,14 +29,14 @@ class MCPAgentService:
     """
     
     def __init__(self):
-        api_key = os.getenv('OPENAI_API_KEY')
-        if api_key:
-            self.openai_client = openai.OpenAI(
-                api_key=api_key,
-                base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-            )
-        else:
-            self.openai_client = None
+        # Calls go through the shared gateway (concurrency, rate limits, live chat first)
+        self.openai_client = llm_gateway.client(PRIORITY_LIVE) if llm_gateway.configured else None
+        
+        # Inbound message bursts are merged into one prompt (overridable per agent)
+        self.coalesce_window = float(os.getenv('COALESCE_WINDOW_SECONDS', 2.0))
+        self.coalesce_max_wait = float(os.getenv('COALESCE_MAX_WAIT_SECONDS', 8.0))
+        self.knowledge_retrieval = os.getenv('KNOWLEDGE_RETRIEVAL', 'bm25')
+        self.product_description_tokens = int(os.getenv('PROMPT_PRODUCT_DESCRIPTION_TOKENS', 40))
         
     def create_agent(self, user_id: int, config: Dict[str, Any]) -> MCPAgent:
         """Create a new MCP AI agent with specified configuration."""
@@ -63,7 +77,8 @@ class MCPAgentService:
             model_name=config.get('model_name', 'gpt-4'),
             temperature=config.get('temperature', 0.7),
             max_tokens=config.get('max_tokens', 1000),
-            system_prompt=config.get('system_prompt', default_system_prompt)
+            system_prompt=config.get('system_prompt', default_system_prompt),
+            runtime_config=json.dumps(config.get('runtime_config', {}))
         )
         
         return agent
@@ -82,57 +97,244 @@ class MCPAgentService:
         """
         
         try:
-            # Build conversation context
-            conversation_context = self._build_conversation_context(agent, context)
+            context = self._with_stored_history(agent, context)
+            messages, knowledge, prompt_report = self._build_messages(agent, message, context)
             
-            # Get relevant knowledge
-            relevant_knowledge = self._get_relevant_knowledge(agent.id, message, context)
+            # Near-identical FAQs are answered from the response cache
+            fingerprint = response_cache.fingerprint(agent, context)
+            if self._is_stored(agent):
+                cached, tier = response_cache.lookup(agent, message, fingerprint)
+                if cached:
+                    return self._finalize_response(agent, message, cached['response'], 0, cache_hit=tier,
+                                                   prompt_report=prompt_report, context=context)
             
-            # Build messages for OpenAI
-            messages = [
-                {"role": "system", "content": agent.system_prompt},
-                {"role": "system", "content": f"Contexto da conversa: {conversation_context}"},
-                {"role": "system", "content": f"Conhecimento relevante: {relevant_knowledge}"},
-                {"role": "user", "content": message}
-            ]
+            # Generate AI response: cheap model first, escalated on purchase stage or low confidence
+            decision = model_router.route(agent, message, self._analyze_interaction(message, '', agent.language))
+            response, routing = model_router.complete(self.openai_client, agent, messages, decision)
+            
+            ai_response = response.choices[0].message.content
+            if self._is_cacheable(agent, context, ai_response):
+                response_cache.store(agent, message, fingerprint, ai_response, response.usage.total_tokens)
+            return self._finalize_response(agent, message, ai_response, response.usage.total_tokens,
+                                           prompt_report=prompt_report, context=context, routing=routing)
+            
+        except Exception as e:
+            return self._error_response(e)
+    
+    def stream_message(self, agent: MCPAgent, message: str, context: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of process_message.
+        
+        Yields ('token', {'content': ...}) as the model generates text, then one
+        ('done', result) with the same payload process_message returns; the
+        sentiment/stage analysis and metrics update run after the last token.
+        On failure yields ('error', result) instead of 'done'.
+        """
+        
+        try:
+            context = self._with_stored_history(agent, context)
+            messages, knowledge, prompt_report = self._build_messages(agent, message, context)
             
-            # Generate AI response
-            response = self.openai_client.chat.completions.create(
-                model=agent.model_name,
+            fingerprint = response_cache.fingerprint(agent, context)
+            if self._is_stored(agent):
+                cached, tier = response_cache.lookup(agent, message, fingerprint)
+                if cached:
+                    yield 'token', {'content': cached['response']}
+                    yield 'done', self._finalize_response(agent, message, cached['response'], 0, cache_hit=tier,
+                                                          prompt_report=prompt_report, context=context)
+                    return
+            
+            # Tokens are already on the wire, so streamed turns are routed but never escalated afterwards
+            decision = model_router.route(agent, message, self._analyze_interaction(message, '', agent.language))
+            started = time.perf_counter()
+            stream = self.openai_client.chat.completions.create(
+                model=decision['model'],
                 messages=messages,
                 temperature=agent.temperature,
-                max_tokens=agent.max_tokens
+                max_tokens=agent.max_tokens,
+                stream=True,
+                stream_options={'include_usage': True},
+                **model_router.user_param(agent)
             )
             
-            ai_response = response.choices[0].message.content
-            
-            # Analyze sentiment and stage
-            analysis = self._analyze_interaction(message, ai_response)
+            parts = []
+            tokens_used = None
+            usage = None
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                    tokens_used = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield 'token', {'content': chunk.choices[0].delta.content}
             
-            # Update agent metrics
-            self._update_agent_metrics(agent, analysis)
+            model_router.record(decision['model'], time.perf_counter() - started, usage)
             
-            return {
-                'response': ai_response,
-                'sentiment': analysis['sentiment'],
-                'stage': analysis['stage'],
-                'confidence': analysis['confidence'],
-                'suggested_actions': analysis['suggested_actions'],
-                'metadata': {
-                    'model_used': agent.model_name,
-                    'tokens_used': response.usage.total_tokens,
-                    'response_time': datetime.utcnow().isoformat()
-                }
-            }
+            ai_response = ''.join(parts)
+            if self._is_cacheable(agent, context, ai_response):
+                response_cache.store(agent, message, fingerprint, ai_response, tokens_used)
+            routing = {'model': decision['model'], 'tier': decision['tier'], 'reason': decision['reason'],
+                       'escalated': False, 'answer_confidence': None}
+            yield 'done', self._finalize_response(agent, message, ai_response, tokens_used,
+                                                  prompt_report=prompt_report, context=context, routing=routing)
             
         except Exception as e:
-            return {
-                'response': 'Desculpe, ocorreu um erro técnico. Nossa equipe foi notificada e entrará em contato em breve.',
-                'error': str(e),
-                'sentiment': 'neutral',
-                'stage': 'error',
-                'confidence': 0.0
+            yield 'error', self._error_response(e)
+    
+    def _build_messages(self, agent: MCPAgent, message: str,
+                        context: Dict[str, Any]) -> Tuple[List[Dict[str, str]], str, Dict[str, Any]]:
+        """
+        Build the chat messages sent to OpenAI for a customer message.
+        
+        Sections are fitted to the agent's prompt token budget in priority
+        order (system, knowledge, history, products); returns the messages,
+        the knowledge text used and the per-section size report.
+        """
+        
+        runtime = agent.get_runtime_config()
+        prompt = prompt_builder.start(agent.model_name, agent.max_tokens, runtime.get('prompt_token_budget'))
+        prompt.reserve('message', message)
+        
+        # Build conversation context
+        conversation_context = self._build_conversation_context(agent, context)
+        system = prompt.take('system', [agent.system_prompt, f"Contexto da conversa: {conversation_context}"],
+                             per_item=MESSAGE_OVERHEAD)
+        
+        # Get relevant knowledge (bm25 | dense | hybrid, per agent runtime_config)
+        retrieval = runtime.get('knowledge_retrieval', self.knowledge_retrieval)
+        snippets = self._get_relevant_knowledge(agent.id if self._is_stored(agent) else None,
+                                                message, context, retrieval)
+        knowledge_header = "Conhecimento relevante: "
+        relevant_knowledge = '\n'.join(prompt.take('knowledge', snippets, header=knowledge_header,
+                                                   limit=knowledge_index.token_budget))
+        
+        # Rolling summary first, then the most recent turns; older ones are dropped when the budget runs out
+        summary = prompt.take('history', [f"Resumo da conversa até aqui: {context['conversation_summary']}"]
+                              if context.get('conversation_summary') else [], static=False)
+        history = self._history_messages(context.get('conversation_history'))
+        kept_turns = prompt.take('history', [turn['content'] for turn in history], per_item=MESSAGE_OVERHEAD,
+                                 newest_first=True, truncate=False, static=False)
+        history = history[len(history) - len(kept_turns):]
+        
+        products = (context.get('product_database') or {}).get('products') or []
+        product_header = "Produtos disponíveis:\n"
+        product_lines = prompt.take('products', [product_line(p, self.product_description_tokens, agent.model_name)
+                                                 for p in products], header=product_header)
+        
+        messages = [{"role": "system", "content": content} for content in system]
+        if relevant_knowledge:
+            messages.append({"role": "system", "content": knowledge_header + relevant_knowledge})
+        if product_lines:
+            messages.append({"role": "system", "content": product_header + '\n'.join(product_lines)})
+        messages.extend({"role": "system", "content": content} for content in summary)
+        messages.extend(history)
+        messages.append({"role": "user", "content": message})
+        return messages, relevant_knowledge, prompt.report()
+    
+    def _history_messages(self, history: Optional[List[Any]]) -> List[Dict[str, str]]:
+        """Normalize conversation_history entries ({role, content} or {sender, message}) into chat messages."""
+        
+        messages = []
+        for turn in history or []:
+            if isinstance(turn, str):
+                role, content = 'user', turn
+            elif isinstance(turn, dict):
+                role = turn.get('role') or turn.get('sender') or 'user'
+                content = turn.get('content') or turn.get('message') or ''
+            else:
+                continue
+            if content:
+                messages.append({
+                    "role": 'assistant' if role in ('assistant', 'agent', 'bot', 'ai') else 'user',
+                    "content": str(content)
+                })
+        return messages
+    
+    def _is_stored(self, agent: MCPAgent) -> bool:
+        """Whether the agent has a row of its own (snapshots of stored agents included)."""
+        return agent.id is not None and (not isinstance(agent, MCPAgent) or db.inspect(agent).persistent)
+    
+    def _is_cacheable(self, agent: MCPAgent, context: Dict[str, Any], reply: str) -> bool:
+        """
+        Whether a reply may be served to other customers: written without
+        conversation history and without naming this customer. Lookups are
+        open to every turn of a stored agent.
+        """
+        name = str((context.get('customer') or {}).get('name') or '').strip()
+        return (self._is_stored(agent) and not context.get('conversation_history')
+                and not context.get('conversation_summary')
+                and not (name and name.lower() in (reply or '').lower()))
+    
+    def _conversation_key(self, agent: MCPAgent, context: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        """(platform, customer key) identifying the stored conversation, if the customer is known."""
+        
+        customer = context.get('customer') or {}
+        customer_key = customer.get('id') or customer.get('phone') or customer.get('email')
+        if not customer_key or not self._is_stored(agent):
+            return None
+        return context.get('platform') or 'web', str(customer_key)
+    
+    def _with_stored_history(self, agent: MCPAgent, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Context plus the stored summary and recent turns, unless the client sent its own history."""
+        
+        key = self._conversation_key(agent, context)
+        if key is None or context.get('conversation_history'):
+            return context
+        summary, turns = conversation_store.load(agent.id, *key)
+        if not summary and not turns:
+            return context
+        return dict(context, conversation_history=turns, conversation_summary=summary)
+    
+    def _remember_turns(self, agent: MCPAgent, context: Dict[str, Any], message: str, ai_response: str):
+        key = self._conversation_key(agent, context)
+        if key is None:
+            return
+        try:
+            conversation_store.append(agent.id, *key, [('user', message), ('assistant', ai_response)])
+        except Exception:
+            db.session.rollback()
+            logger.exception("Could not store conversation turns for agent %s", agent.id)
+    
+    def _finalize_response(self, agent: MCPAgent, message: str, ai_response: str, tokens_used: Optional[int],
+                           cache_hit: Optional[str] = None,
+                           prompt_report: Optional[Dict[str, Any]] = None,
+                           context: Optional[Dict[str, Any]] = None,
+                           routing: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Analyze the finished reply, update metrics, store the turns and build the result payload."""
+        
+        # Keep the server-side history of this customer
+        self._remember_turns(agent, context or {}, message, ai_response)
+        
+        # Analyze sentiment and stage
+        analysis = self._analyze_interaction(message, ai_response, agent.language)
+        
+        # Update agent metrics
+        self._update_agent_metrics(agent, analysis)
+        
+        return {
+            'response': ai_response,
+            'sentiment': analysis['sentiment'],
+            'stage': analysis['stage'],
+            'confidence': analysis['confidence'],
+            'suggested_actions': analysis['suggested_actions'],
+            'metadata': {
+                'model_used': routing['model'] if routing else agent.model_name,
+                'routing': routing,
+                'tokens_used': tokens_used,
+                'cache_hit': cache_hit,
+                'prompt': prompt_report,
+                'response_time': datetime.utcnow().isoformat()
             }
+        }
+    
+    def _error_response(self, error: Exception) -> Dict[str, Any]:
+        return {
+            'response': 'Desculpe, ocorreu um erro técnico. Nossa equipe foi notificada e entrará em contato em breve.',
+            'error': str(error),
+            'sentiment': 'neutral',
+            'stage': 'error',
+            'confidence': 0.0
+        }
     
     def handle_sales_interaction(self, campaign_id: int, platform: str, customer_data: Dict[str, Any], message: str) -> Dict[str, Any]:
         """
@@ -148,12 +350,12 @@ class MCPAgentService:
             Dict containing response and interaction data
         """
         
-        # Get campaign and agent
-        campaign = Campaign.query.get(campaign_id)
+        # Get campaign and agent (cached snapshots: no queries once warm)
+        campaign = agent_cache.campaign(campaign_id)
         if not campaign:
             return {'error': 'Campaign not found'}
         
-        # Get or create agent for this campaign
+        # Agent bound to this campaign, or the owner's active agent
         agent = self._get_campaign_agent(campaign)
         
         # Build context for this interaction
@@ -168,15 +370,15 @@ class MCPAgentService:
         # Process the message
         ai_result = self.process_message(agent, message, context)
         
-        # Save interaction to database
-        interaction = SalesInteraction(
+        # Save interaction to database (buffered: written in the next multi-row INSERT)
+        write_behind.add_interaction(
             campaign_id=campaign_id,
             platform=platform,
             customer_id=customer_data.get('id'),
             customer_name=customer_data.get('name'),
             customer_phone=customer_data.get('phone'),
             customer_email=customer_data.get('email'),
-            interaction_type=self._determine_interaction_type(context, message),
+            interaction_type=self._determine_interaction_type(context, message, agent.language),
             message_content=message,
             ai_response=ai_result['response'],
             sentiment=ai_result['sentiment'],
@@ -184,25 +386,28 @@ class MCPAgentService:
             conversion_probability=ai_result.get('confidence', 0.0)
         )
         
-        # Save to database (would need db session here)
-        # db.session.add(interaction)
-        # db.session.commit()
-        
         return {
             'response': ai_result['response'],
-            'interaction_id': interaction.id if hasattr(interaction, 'id') else None,
+            'interaction_id': None,  # assigned when the buffer is flushed
             'metadata': ai_result.get('metadata', {}),
             'suggested_actions': ai_result.get('suggested_actions', [])
         }
     
+    def get_coalescing_window(self, agent: Optional[MCPAgent]) -> Tuple[float, float]:
+        """Debounce window and maximum wait (seconds) for merging consecutive customer messages."""
+        runtime = agent.get_runtime_config() if agent else {}
+        window = float(runtime.get('coalesce_window_seconds', self.coalesce_window))
+        max_wait = float(runtime.get('coalesce_max_wait_seconds', self.coalesce_max_wait))
+        return window, max(window, max_wait)
+    
     def _build_conversation_context(self, agent: MCPAgent, context: Dict[str, Any]) -> str:
         """Build conversation context string for the AI."""
         
         context_parts = []
         
-        if 'campaign' in context:
+        if context.get('campaign'):
             campaign = context['campaign']
-            context_parts.append(f"Campanha: {campaign['name']} (Objetivo: {campaign['objective']})")
+            context_parts.append(f"Campanha: {campaign.get('name')} (Objetivo: {campaign.get('objective')})")
         
         if 'platform' in context:
             context_parts.append(f"Plataforma: {context['platform']}")
@@ -216,79 +421,57 @@ class MCPAgentService:
         
         return " | ".join(context_parts)
     
-    def _get_relevant_knowledge(self, agent_id: int, message: str, context: Dict[str, Any]) -> str:
-        """Get relevant knowledge base entries for the current interaction."""
-        
-        # This would query the AgentKnowledge table based on message content and context
-        # For now, return a placeholder
-        return "Base de conhecimento: Produtos e serviços de marketing digital disponíveis."
+    def _get_relevant_knowledge(self, agent_id: Optional[int], message: str, context: Dict[str, Any],
+                                retrieval: str = 'bm25') -> List[str]:
+        """Get relevant knowledge base entries for the current interaction, best first, as prompt lines."""
+        
+        if agent_id is None:
+            entries = []
+        elif retrieval in ('dense', 'hybrid'):
+            entries = vector_index.search(agent_id, message, hybrid=(retrieval == 'hybrid'))
+        else:
+            entries = knowledge_index.search(agent_id, message)
+        return knowledge_index.snippet_lines(entries) or [
+            "Base de conhecimento: Produtos e serviços de marketing digital disponíveis."
+        ]
     
-    def _analyze_interaction(self, message: str, response: str) -> Dict[str, Any]:
+    def _analyze_interaction(self, message: str, response: str, language: Optional[str] = None) -> Dict[str, Any]:
         """Analyze the interaction to determine sentiment, stage, and suggested actions."""
         
-        # Simple sentiment analysis (could be enhanced with ML models)
-        positive_words = ['ótimo', 'excelente', 'perfeito', 'interessante', 'quero', 'sim', 'gostei']
-        negative_words = ['não', 'ruim', 'caro', 'difícil', 'complicado', 'problema']
-        
-        message_lower = message.lower()
-        positive_count = sum(1 for word in positive_words if word in message_lower)
-        negative_count = sum(1 for word in negative_words if word in message_lower)
-        
-        if positive_count > negative_count:
-            sentiment = 'positive'
-            confidence = min(0.8, 0.5 + (positive_count * 0.1))
-        elif negative_count > positive_count:
-            sentiment = 'negative'
-            confidence = min(0.8, 0.5 + (negative_count * 0.1))
-        else:
-            sentiment = 'neutral'
-            confidence = 0.5
-        
-        # Determine conversation stage
-        if any(word in message_lower for word in ['olá', 'oi', 'bom dia', 'boa tarde']):
-            stage = 'awareness'
-        elif any(word in message_lower for word in ['preço', 'valor', 'quanto custa']):
-            stage = 'consideration'
-        elif any(word in message_lower for word in ['quero', 'comprar', 'fechar']):
-            stage = 'purchase'
-        else:
-            stage = 'interest'
-        
-        # Suggest actions based on analysis
-        suggested_actions = []
-        if sentiment == 'positive' and stage == 'consideration':
-            suggested_actions.append('send_proposal')
-        elif sentiment == 'negative':
-            suggested_actions.append('address_objection')
-        elif stage == 'purchase':
-            suggested_actions.append('close_deal')
-        
+        # One pass of the compiled lexicon classifier (memoized, so the routing call is free to repeat)
+        analysis = interaction_classifier.classify(message, language)
         return {
-            'sentiment': sentiment,
-            'stage': stage,
-            'confidence': confidence,
-            'suggested_actions': suggested_actions
+            'sentiment': analysis['sentiment'],
+            'stage': analysis['stage'],
+            'confidence': analysis['confidence'],
+            'suggested_actions': analysis['suggested_actions']
         }
     
     def _update_agent_metrics(self, agent: MCPAgent, analysis: Dict[str, Any]):
         """Update agent performance metrics."""
         
-        agent.total_interactions += 1
-        
-        # Update other metrics based on analysis
-        if analysis['sentiment'] == 'positive':
-            agent.customer_satisfaction = (agent.customer_satisfaction + analysis['confidence']) / 2
+        # Only stored agents; the placeholder campaign agent has no row of its own
+        if not self._is_stored(agent):
+            return
         
-        # Would save to database here
-        # db.session.commit()
+        # Deltas are aggregated per agent, added to a sharded counter and rolled up into mcp_agents
+        write_behind.add_agent_metrics(
+            agent.id,
+            interactions=1,
+            satisfaction=analysis['confidence'] if analysis['sentiment'] == 'positive' else None
+        )
     
-    def _get_campaign_agent(self, campaign: Campaign) -> MCPAgent:
-        """Get or create an agent for the specified campaign."""
+    def _get_campaign_agent(self, campaign: CampaignBinding) -> MCPAgent:
+        """Get the agent for the specified campaign."""
+        
+        agent = agent_cache.agent_for_campaign(campaign)
+        if agent is not None:
+            return agent
         
-        # For now, create a default agent
-        # In production, this would check if campaign has a specific agent assigned
+        # No agent bound nor active for the owner: answer with a default agent
+        # (no id: it must never read or write another agent's knowledge, history or cached replies)
         return MCPAgent(
-            id=1,
+            user_id=campaign.user_id,
             name=f"Agente {campaign.name}",
             sales_approach=campaign.sales_strategy or 'consultative',
             model_name='gpt-4',
@@ -310,18 +493,11 @@ class MCPAgentService:
             ]
         }
     
-    def _determine_interaction_type(self, context: Dict[str, Any], message: str) -> str:
+    def _determine_interaction_type(self, context: Dict[str, Any], message: str,
+                                    language: Optional[str] = None) -> str:
         """Determine the type of interaction based on context and message."""
         
-        # Simple logic to determine interaction type
-        if 'olá' in message.lower() or 'oi' in message.lower():
-            return 'initial_contact'
-        elif 'preço' in message.lower() or 'valor' in message.lower():
-            return 'pricing_inquiry'
-        elif 'quero' in message.lower() or 'comprar' in message.lower():
-            return 'purchase_intent'
-        else:
-            return 'follow_up'
+        return interaction_classifier.classify(message, language)['interaction_type']
 
 # Singleton instance
 mcp_agent_service = MCPAgentService()
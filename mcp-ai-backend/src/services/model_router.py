@@ -0,0 +1,180 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque, Counter
+from typing import Dict, Any, List, Optional, Tuple
+from src.models.mcp_agent import MCPAgent
+
+# USD per 1M tokens (input, output); override/extend with MODEL_PRICES='{"model": [in, out]}'
+MODEL_PRICES = {
+    'gpt-4': (30.0, 60.0),
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4o': (2.5, 10.0),
+    'gpt-4o-mini': (0.15, 0.6),
+    'gpt-3.5-turbo': (0.5, 1.5),
+}
+
+# Phrases that show the cheap model is unsure of its answer
+HEDGES = ('não sei', 'nao sei', 'não tenho certeza', 'não tenho essa informação', 'não consigo responder',
+          "i'm not sure", 'i am not sure', "i don't know")
+
+
+class ModelRouter:
+    """
+    Cheap-first model cascade for agent replies.
+
+    Each turn is routed by the stage detected in the customer's message,
+    the message length and the agent policy (runtime_config
+    'model_routing'): greetings, questions and price checks go to the cheap
+    model, while purchase-stage and long messages go straight to the
+    agent's own model. A cheap answer is escalated to the agent's model
+    when its confidence (mean token probability from logprobs, or a hedging
+    reply) is below the policy minimum. Every decision and the latency,
+    tokens and estimated cost of every call are recorded per model.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('MODEL_ROUTING_ENABLED', 'true').lower() == 'true'
+        self.cheap_model = os.getenv('MODEL_ROUTING_CHEAP_MODEL', 'gpt-4o-mini')
+        self.cheap_stages = ('awareness', 'interest', 'consideration')
+        self.max_cheap_chars = int(os.getenv('MODEL_ROUTING_MAX_CHEAP_CHARS', 400))
+        self.min_confidence = float(os.getenv('MODEL_ROUTING_MIN_CONFIDENCE', 0.55))
+        self.use_logprobs = os.getenv('MODEL_ROUTING_LOGPROBS', 'true').lower() == 'true'
+        self.prices = dict(MODEL_PRICES)
+        self.prices.update({model: tuple(price) for model, price in json.loads(os.getenv('MODEL_PRICES', '{}')).items()})
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._models: Dict[str, Dict[str, float]] = {}
+        self._decisions = Counter()
+        self.escalations = 0
+
+    def policy(self, agent: MCPAgent) -> Dict[str, Any]:
+        """Effective routing policy of an agent (runtime_config 'model_routing' over the env defaults)."""
+        routing = agent.get_runtime_config().get('model_routing', {})
+        if routing is False:
+            routing = {'enabled': False}
+        return {
+            'enabled': bool(routing.get('enabled', self.enabled)),
+            'cheap_model': routing.get('cheap_model', self.cheap_model),
+            'strong_model': routing.get('strong_model', agent.model_name),
+            'cheap_stages': tuple(routing.get('cheap_stages', self.cheap_stages)),
+            'max_cheap_chars': int(routing.get('max_cheap_chars', self.max_cheap_chars)),
+            'min_confidence': float(routing.get('min_confidence', self.min_confidence))
+        }
+
+    def route(self, agent: MCPAgent, message: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick the first model for a turn: {'model', 'tier', 'reason', 'cascade'}."""
+        policy = self.policy(agent)
+        strong = {'model': policy['strong_model'], 'tier': 'strong', 'cascade': False}
+        if not policy['enabled'] or policy['cheap_model'] == policy['strong_model']:
+            decision = dict(strong, reason='disabled')
+        elif analysis['stage'] not in policy['cheap_stages']:
+            decision = dict(strong, reason=f"stage:{analysis['stage']}")
+        elif len(message) > policy['max_cheap_chars']:
+            decision = dict(strong, reason='long_message')
+        else:
+            decision = {'model': policy['cheap_model'], 'tier': 'cheap', 'cascade': True,
+                        'reason': f"stage:{analysis['stage']}"}
+        decision['strong_model'] = policy['strong_model']
+        decision['min_confidence'] = policy['min_confidence']
+        with self._lock:
+            self._decisions[(decision['tier'], decision['reason'])] += 1
+        return decision
+
+    def complete(self, client, agent: MCPAgent, messages: List[Dict[str, str]],
+                 decision: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        """Run the routed completion, escalating a low-confidence cheap answer; returns (response, routing)."""
+        routing = {'model': decision['model'], 'tier': decision['tier'], 'reason': decision['reason'],
+                   'escalated': False, 'answer_confidence': None}
+        response = self._create(client, agent, messages, decision['model'], logprobs=decision['cascade'])
+        if not decision['cascade']:
+            return response, routing
+
+        confidence = self.answer_confidence(response)
+        routing['answer_confidence'] = round(confidence, 4)
+        if confidence >= decision['min_confidence']:
+            return response, routing
+
+        with self._lock:
+            self.escalations += 1
+            self._decisions[('strong', 'low_confidence')] += 1
+        routing.update(model=decision['strong_model'], tier='strong', escalated=True)
+        return self._create(client, agent, messages, decision['strong_model']), routing
+
+    def _create(self, client, agent: MCPAgent, messages: List[Dict[str, str]], model: str, logprobs: bool = False):
+        kwargs = self.user_param(agent)
+        if logprobs and self.use_logprobs:
+            kwargs['logprobs'] = True
+        started = time.perf_counter()
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=agent.temperature,
+            max_tokens=agent.max_tokens,
+            **kwargs
+        )
+        self.record(model, time.perf_counter() - started, getattr(response, 'usage', None))
+        return response
+
+    @staticmethod
+    def user_param(agent: MCPAgent) -> Dict[str, str]:
+        """OpenAI `user` of the agent owner (also the gateway's per-user concurrency key)."""
+        return {'user': f"user-{agent.user_id}"} if agent.user_id else {}
+
+    @staticmethod
+    def answer_confidence(response) -> float:
+        """Mean token probability of the answer (1.0 without logprobs); hedging answers score 0."""
+        choice = response.choices[0]
+        text = (choice.message.content or '').strip().lower()
+        if not text or any(hedge in text for hedge in HEDGES):
+            return 0.0
+        logprobs = getattr(choice, 'logprobs', None)
+        tokens = getattr(logprobs, 'content', None) if logprobs is not None else None
+        if not tokens:
+            return 1.0
+        return math.exp(sum(token.logprob for token in tokens) / len(tokens))
+
+    def record(self, model: str, seconds: float, usage=None):
+        """Record one completion call (latency, tokens, estimated cost)."""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        price_in, price_out = self.prices.get(model, (0.0, 0.0))
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=2000)).append(seconds)
+            totals = self._models.setdefault(model, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0})
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            totals['cost_usd'] += (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+    @staticmethod
+    def _percentile(samples: List[float], q: float) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for model, totals in self._models.items():
+                latencies = list(self._latencies.get(model, ()))
+                models[model] = dict(
+                    totals,
+                    cost_usd=round(totals['cost_usd'], 6),
+                    p50_ms=round(self._percentile(latencies, 0.5) * 1000, 1),
+                    p95_ms=round(self._percentile(latencies, 0.95) * 1000, 1)
+                )
+            all_latencies = [s for samples in self._latencies.values() for s in samples]
+            return {
+                'enabled': self.enabled,
+                'cheap_model': self.cheap_model,
+                'decisions': {f"{tier}:{reason}": count for (tier, reason), count in self._decisions.items()},
+                'escalations': self.escalations,
+                'p50_ms': round(self._percentile(all_latencies, 0.5) * 1000, 1),
+                'cost_usd': round(sum(totals['cost_usd'] for totals in self._models.values()), 6),
+                'models': models
+            }
+
+# Singleton instance
+model_router = ModelRouter()
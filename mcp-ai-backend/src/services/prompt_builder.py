@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+from src.services.cache import TTLCache
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; without it the local tokenizer approximates the counts
+    tiktoken = None
+
+logger = logging.getLogger("prompt_builder")
+
+# Context window (tokens) per model family; the longest matching prefix wins
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4.1': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+MESSAGE_OVERHEAD = 4  # role/separator tokens OpenAI adds around every chat message
+REPLY_PRIMING = 3     # tokens that prime the assistant reply
+SAFETY_MARGIN = 32
+
+# Words, runs of digits and single punctuation marks, roughly as the BPE pre-tokenizer splits them
+_PIECES = re.compile(r"\s*[^\W\d_]+|\s*\d{1,3}|\s*(?:[^\w\s]|_)|\s+", re.UNICODE)
+
+
+def _local_cost(piece: str) -> int:
+    """BPE-like cost of one piece: short words are one token, longer/accented ones split further."""
+    word = piece.lstrip()
+    if not word:
+        return 1 if len(piece) > 1 else 0
+    if word.isascii():
+        return 1 + (len(word) - 1) // 5
+    return 1 + (len(word) - 1) // 3
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens with tiktoken when it is installed, otherwise with a
+    local approximation tuned to overestimate slightly. Counts of static
+    pieces (system prompts, knowledge snippets, product lines) are cached.
+    """
+
+    def __init__(self):
+        self.cache = TTLCache(
+            maxsize=int(os.getenv('PROMPT_TOKEN_CACHE_MAXSIZE', 20000)),
+            ttl=float(os.getenv('PROMPT_TOKEN_CACHE_TTL', 3600))
+        )
+        self._encodings: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def encoding(self, model: Optional[str]):
+        if tiktoken is None:
+            return None
+        model = model or 'gpt-4'
+        encoding = self._encodings.get(model)
+        if encoding is None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                # The BPE file is downloaded on first use; without it the local approximation is used
+                logger.warning("tiktoken encoding for %s unavailable, using the local tokenizer: %s", model, e)
+                encoding = False
+            with self._lock:
+                self._encodings[model] = encoding
+        return encoding or None
+
+    def tokenizer_name(self, model: Optional[str] = None) -> str:
+        encoding = self.encoding(model)
+        return encoding.name if encoding is not None else 'local'
+
+    def count(self, text: Optional[str], model: Optional[str] = None, static: bool = False) -> int:
+        if not text:
+            return 0
+        key = (self.tokenizer_name(model), text) if static else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        encoding = self.encoding(model)
+        if encoding is not None:
+            tokens = len(encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = sum(_local_cost(piece) for piece in _PIECES.findall(text))
+        if key is not None:
+            self.cache.set(key, tokens)
+        return tokens
+
+    def truncate(self, text: str, max_tokens: int, model: Optional[str] = None, suffix: str = '...') -> str:
+        """Cut `text` to at most `max_tokens` tokens (suffix included)."""
+        if self.count(text, model) <= max_tokens:
+            return text
+        limit = max(0, max_tokens - self.count(suffix, model))
+        encoding = self.encoding(model)
+        if encoding is not None:
+            return encoding.decode(encoding.encode(text, disallowed_special=())[:limit]).rstrip() + suffix
+        used, end = 0, 0
+        for match in _PIECES.finditer(text):
+            used += _local_cost(match.group())
+            if used > limit:
+                break
+            end = match.end()
+        return text[:end].rstrip() + suffix
+
+
+class PromptBudget:
+    """
+    Token budget of one prompt, filled section by section.
+
+    Callers take() sections in priority order (system, knowledge, history,
+    products): each keeps as many of its items as still fit, so lower
+    priority sections shrink first. report() gives the size per section.
+    """
+
+    def __init__(self, builder: "PromptBuilder", model: str, budget: int):
+        self.builder = builder
+        self.model = model
+        self.budget = budget
+        self.used = REPLY_PRIMING
+        self.sections: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.budget - self.used)
+
+    def reserve(self, name: str, text: str, static: bool = False) -> int:
+        """Account for a mandatory message (e.g. the customer's message), even past the budget."""
+        tokens = self.builder.counter.count(text, self.model, static) + MESSAGE_OVERHEAD
+        self._record(name, tokens, 1, 0, False)
+        return tokens
+
+    def take(self, name: str, items: List[str], header: str = '', per_item: int = 1,
+             limit: Optional[int] = None, newest_first: bool = False, truncate: bool = True,
+             static: bool = True) -> List[str]:
+        """
+        Keep the leading items that fit (the trailing ones with `newest_first`).
+
+        `header` and the message overhead are charged once; `per_item` is the
+        separator cost of each item; `limit` caps the section on its own. When
+        `truncate` is set the first item that does not fit is cut to the space
+        left instead of being dropped. Returns the kept items in input order.
+        """
+        items = [item for item in items if item]
+        available = self.remaining if limit is None else min(self.remaining, limit)
+        counter = self.builder.counter
+        fixed = MESSAGE_OVERHEAD + counter.count(header, self.model, static=True)
+        used = fixed
+        kept: List[str] = []
+        truncated = False
+        for item in (reversed(items) if newest_first else items):
+            cost = counter.count(item, self.model, static) + per_item
+            if used + cost > available:
+                room = available - used - per_item
+                if truncate and room >= self.builder.min_truncate_tokens:
+                    kept.append(counter.truncate(item, room, self.model))
+                    used += counter.count(kept[-1], self.model) + per_item
+                    truncated = True
+                break
+            kept.append(item)
+            used += cost
+        if newest_first:
+            kept.reverse()
+        tokens = used if kept else 0
+        self._record(name, tokens, len(kept), len(items) - len(kept), truncated)
+        return kept
+
+    def _record(self, name: str, tokens: int, items: int, dropped: int, truncated: bool):
+        section = self.sections.setdefault(name, {'tokens': 0, 'items': 0, 'dropped': 0, 'truncated': False})
+        section['tokens'] += tokens
+        section['items'] += items
+        section['dropped'] += dropped
+        section['truncated'] = section['truncated'] or truncated
+        self.used += tokens
+        self.builder._observe(name, tokens, dropped, truncated)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'model': self.model,
+            'tokenizer': self.builder.counter.tokenizer_name(self.model),
+            'budget': self.budget,
+            'total_tokens': self.used,
+            'sections': {name: dict(section) for name, section in self.sections.items()}
+        }
+
+
+class PromptBuilder:
+    """
+    Per-model prompt budgets.
+
+    The budget of a prompt is the model's context window minus the tokens
+    reserved for the completion, capped by PROMPT_TOKEN_BUDGET (or a per
+    model value from PROMPT_MODEL_BUDGETS, a JSON object, or an explicit
+    cap such as the agent's runtime_config 'prompt_token_budget') so we do
+    not pay for context the answer does not need.
+    """
+
+    def __init__(self):
+        self.counter = TokenCounter()
+        self.default_cap = int(os.getenv('PROMPT_TOKEN_BUDGET', 3000))
+        self.model_caps: Dict[str, int] = json.loads(os.getenv('PROMPT_MODEL_BUDGETS', '{}'))
+        self.min_truncate_tokens = int(os.getenv('PROMPT_MIN_TRUNCATE_TOKENS', 20))
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self._sections: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def context_window(model: Optional[str]) -> int:
+        model = model or ''
+        best = max((prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)), key=len, default=None)
+        return MODEL_CONTEXT_WINDOWS[best] if best else DEFAULT_CONTEXT_WINDOW
+
+    def budget_for(self, model: Optional[str], completion_tokens: Optional[int] = None, cap: Optional[int] = None) -> int:
+        available = self.context_window(model) - (completion_tokens or 0) - SAFETY_MARGIN
+        cap = cap or self.model_caps.get(model or '', self.default_cap)
+        return max(0, min(available, int(cap)))
+
+    def start(self, model: Optional[str], completion_tokens: Optional[int] = None, cap: Optional[int] = None) -> PromptBudget:
+        with self._lock:
+            self.prompts += 1
+        return PromptBudget(self, model or 'gpt-4', self.budget_for(model, completion_tokens, cap))
+
+    def count(self, text: Optional[str], model: Optional[str] = None, static: bool = False) -> int:
+        return self.counter.count(text, model, static)
+
+    def _observe(self, name: str, tokens: int, dropped: int, truncated: bool):
+        with self._lock:
+            section = self._sections.setdefault(name, {'tokens': 0, 'dropped_items': 0, 'truncations': 0})
+            section['tokens'] += tokens
+            section['dropped_items'] += dropped
+            section['truncations'] += int(truncated)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sections = {
+                name: {
+                    'avg_tokens': round(section['tokens'] / self.prompts, 1) if self.prompts else 0.0,
+                    'dropped_items': section['dropped_items'],
+                    'truncations': section['truncations']
+                } for name, section in self._sections.items()
+            }
+        return {
+            'tokenizer': self.counter.tokenizer_name(),
+            'default_budget': self.default_cap,
+            'prompts': self.prompts,
+            'sections': sections,
+            'count_cache': self.counter.cache.stats()
+        }
+
+
+def product_line(product: Dict[str, Any], description_tokens: int = 40, model: Optional[str] = None) -> str:
+    """One product as a prompt line, the description cut to `description_tokens` tokens."""
+    line = f"- {product.get('name', 'Produto sem nome')}"
+    if 'price' in product:
+        line += f" (R$ {product['price']})"
+    if product.get('description'):
+        line += f": {prompt_builder.counter.truncate(str(product['description']), description_tokens, model)}"
+    if 'category' in product:
+        line += f" [Categoria: {product['category']}]"
+    return line
+
+# Singleton instance
+prompt_builder = PromptBuilder()
@@ -0,0 +1,164 @@
+import os
+import math
+import time
+import random
+import threading
+from typing import Dict, Any, Optional
+from flask import jsonify
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a circuit breaker is open."""
+
+    def __init__(self, key: str, retry_in: float):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f"Circuit open for {key}; retry in {retry_in:.1f}s")
+
+
+
+def error_response(e: Exception):
+    """
+    JSON error for a route's generic exception handler: 503 with Retry-After
+    for an open circuit (a fast-fail, not a server bug), 500 otherwise.
+    """
+    if isinstance(e, CircuitOpenError):
+        # The breaker key (host|session) stays out of the body
+        return jsonify({'success': False, 'error': f'Upstream temporarily unavailable; retry in {e.retry_in:.1f}s',
+                        'retry_in': round(e.retry_in, 1)}), 503, {
+            'Retry-After': str(max(1, math.ceil(e.retry_in)))
+        }
+    return jsonify({'success': False, 'error': str(e)}), 500
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Idempotent methods (GET, PUT, DELETE) are retried automatically; POST is
+    retried only when the caller supplies an idempotency key. Connect
+    timeouts are always retryable because the request never left the client.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+    RETRY_STATUSES = frozenset((429, 502, 503, 504))
+
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        self.max_attempts = max_attempts or int(os.getenv('WHATSAPI_RETRY_ATTEMPTS', 3))
+        self.base_delay = base_delay or float(os.getenv('WHATSAPI_RETRY_BASE_DELAY', 0.2))
+        self.max_delay = max_delay or float(os.getenv('WHATSAPI_RETRY_MAX_DELAY', 5.0))
+
+    def can_retry(self, method: str, idempotency_key: Optional[str] = None) -> bool:
+        return method.upper() in self.IDEMPOTENT_METHODS or bool(idempotency_key)
+
+    def should_retry_status(self, status_code: int) -> bool:
+        return status_code in self.RETRY_STATUSES
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to sleep before retry number `attempt` (1-based)."""
+        if retry_after:
+            try:
+                return min(self.max_delay, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after `failure_threshold` failures in a row; open rejects
+    calls for `recovery_timeout` seconds, then half_open lets a single probe
+    through, whose outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, key: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def retry_in(self) -> float:
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+            'retry_in': round(self.retry_in(), 1) if self.state == self.OPEN else 0.0
+        }
+
+
+class CircuitBreakerRegistry:
+    """Lazily creates one CircuitBreaker per key (e.g. host|session)."""
+
+    def __init__(self, failure_threshold: Optional[int] = None, recovery_timeout: Optional[float] = None):
+        self.failure_threshold = failure_threshold or int(os.getenv('WHATSAPI_BREAKER_THRESHOLD', 5))
+        self.recovery_timeout = recovery_timeout or float(os.getenv('WHATSAPI_BREAKER_RECOVERY', 30))
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(key, self.failure_threshold, self.recovery_timeout)
+                    self._breakers[key] = breaker
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        # Counts only: breaker keys carry the upstream host and users' session names
+        breakers = list(self._breakers.values())
+        states = [breaker.state for breaker in breakers]
+        return {
+            'open': states.count(CircuitBreaker.OPEN),
+            'half_open': states.count(CircuitBreaker.HALF_OPEN),
+            'closed': states.count(CircuitBreaker.CLOSED),
+            'rejected': sum(breaker.rejected for breaker in breakers)
+        }
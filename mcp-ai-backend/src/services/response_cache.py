@@ -0,0 +1,197 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from sqlalchemy import event, inspect
+from src.models.db_instance import db
+from src.models.mcp_agent import MCPAgent, AgentKnowledge
+from src.services.cache import TTLCache
+
+_NON_WORD = re.compile(r'[^a-z0-9 ]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, strip accents/punctuation and collapse whitespace: 'Quanto custa?' -> 'quanto custa'."""
+    text = (message or '').lower()
+    if not text.isascii():
+        # Accents decompose into ASCII letter + combining mark; everything else non-ASCII is dropped below
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _SPACES.sub(' ', _NON_WORD.sub(' ', text)).strip()
+
+
+def char_ngrams(text: str, n: int = 3) -> frozenset:
+    padded = f" {text} "
+    if len(padded) <= n:
+        return frozenset((padded,))
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+class ResponseCache:
+    """
+    Cache of agent replies in front of the OpenAI call.
+
+    Exact tier: key (agent id, fingerprint, normalized message), where the
+    fingerprint hashes what every customer of the agent shares: model
+    settings, system prompt, config_version, the campaign and a version of
+    the agent's knowledge (count/max(updated_at), re-read every
+    KNOWLEDGE_INDEX_CHECK_SECONDS), so editing the agent or its knowledge
+    yields new keys in every worker. Per-customer context (name, history)
+    stays out of the key; callers only store replies written without it.
+    Similarity tier: on an exact miss the agent's recent entries with the
+    same fingerprint are compared by character-trigram Jaccard similarity.
+    TTL is per agent (runtime_config 'response_cache_ttl_seconds', 0 turns the
+    cache off); size is LRU bounded. Local entries are dropped as soon as an
+    agent or its knowledge is written through the ORM.
+    """
+
+    def __init__(self):
+        self.default_ttl = float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+        self.similarity_threshold = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.8))
+        self.similar_scan_limit = int(os.getenv('RESPONSE_CACHE_SIMILAR_SCAN', 500))
+        self.cache = TTLCache(maxsize=int(os.getenv('RESPONSE_CACHE_MAXSIZE', 5000)), ttl=self.default_ttl)
+        # agent_id -> OrderedDict[key -> trigrams], scanned by the similarity tier
+        self._ngrams: Dict[int, "OrderedDict[tuple, frozenset]"] = {}
+        self._knowledge_versions = TTLCache(maxsize=int(os.getenv('RESPONSE_CACHE_MAXSIZE', 5000)),
+                                            ttl=float(os.getenv('KNOWLEDGE_INDEX_CHECK_SECONDS', 60)))
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    def settings(self, agent: MCPAgent) -> Tuple[float, bool]:
+        """(ttl seconds, similarity tier enabled) for an agent."""
+        runtime = agent.get_runtime_config()
+        ttl = float(runtime.get('response_cache_ttl_seconds', self.default_ttl))
+        return ttl, bool(runtime.get('response_cache_similarity', True))
+
+    def fingerprint(self, agent: MCPAgent, context: Optional[Dict[str, Any]] = None) -> str:
+        """Hash of the agent's prompt and settings, its knowledge version and the campaign (no customer data)."""
+        campaign = (context or {}).get('campaign') or {}
+        digest = hashlib.sha1()
+        for part in (agent.model_name, agent.temperature, agent.max_tokens, agent.system_prompt,
+                     getattr(agent, 'config_version', None), self.knowledge_version(agent.id), campaign.get('id')):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def knowledge_version(self, agent_id: Optional[int]) -> Optional[tuple]:
+        """(active entries, last updated_at) of the agent's knowledge, cached for the index check interval."""
+        if agent_id is None:
+            return None
+        version = self._knowledge_versions.get(agent_id)
+        if version is None:
+            version = tuple(db.session.query(
+                db.func.count(AgentKnowledge.id), db.func.max(AgentKnowledge.updated_at)
+            ).filter(AgentKnowledge.agent_id == agent_id, AgentKnowledge.is_active.is_(True)).one())
+            self._knowledge_versions.set(agent_id, version)
+        return version
+
+    def lookup(self, agent: MCPAgent, message: str, fingerprint: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (cached entry, 'exact' | 'similar') or (None, None)."""
+        if agent.id is None:
+            return None, None
+        ttl, similarity = self.settings(agent)
+        if ttl <= 0:
+            return None, None
+        normalized = normalize_message(message)
+        entry = self.cache.get((agent.id, fingerprint, normalized))
+        if entry is not None:
+            self.exact_hits += 1
+            self.saved_tokens += entry.get('tokens_used') or 0
+            return entry, 'exact'
+
+        if similarity and normalized:
+            entry = self._lookup_similar(agent.id, fingerprint, char_ngrams(normalized))
+            if entry is not None:
+                self.similar_hits += 1
+                self.saved_tokens += entry.get('tokens_used') or 0
+                return entry, 'similar'
+        self.misses += 1
+        return None, None
+
+    def store(self, agent: MCPAgent, message: str, fingerprint: str, response: str, tokens_used: Optional[int]):
+        if agent.id is None or not response:
+            return
+        ttl, _ = self.settings(agent)
+        if ttl <= 0:
+            return
+        normalized = normalize_message(message)
+        key = (agent.id, fingerprint, normalized)
+        self.cache.set(key, {'response': response, 'tokens_used': tokens_used}, ttl)
+        with self._lock:
+            grams = self._ngrams.setdefault(agent.id, OrderedDict())
+            grams[key] = char_ngrams(normalized)
+            grams.move_to_end(key)
+            while len(grams) > self.similar_scan_limit:
+                grams.popitem(last=False)
+
+    def invalidate_agent(self, agent_id: Optional[int]) -> int:
+        if agent_id is None:
+            return 0
+        with self._lock:
+            self._ngrams.pop(agent_id, None)
+        self._knowledge_versions.delete(agent_id)
+        return self.cache.invalidate(lambda key: key[0] == agent_id)
+
+    def _lookup_similar(self, agent_id: int, fingerprint: str, grams: frozenset) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            candidates = list(self._ngrams.get(agent_id, {}).items())
+        best_key, best_score = None, self.similarity_threshold
+        for key, other in reversed(candidates):
+            if key[1] != fingerprint:
+                continue
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        entry = self.cache.get(best_key)
+        if entry is None:
+            with self._lock:
+                self._ngrams.get(agent_id, {}).pop(best_key, None)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            'exact_hits': self.exact_hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'saved_tokens': self.saved_tokens,
+            'entries': len(self.cache),
+            'evictions': self.cache.evictions
+        }
+
+# Singleton instance
+response_cache = ResponseCache()
+
+
+# Agent columns that change what a cached reply would be (metric updates don't)
+_PROMPT_ATTRIBUTES = ('system_prompt', 'model_name', 'temperature', 'max_tokens', 'runtime_config',
+                      'sales_approach', 'personality', 'language')
+
+
+@event.listens_for(MCPAgent, 'after_update')
+def _agent_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _PROMPT_ATTRIBUTES):
+        response_cache.invalidate_agent(target.id)
+
+
+@event.listens_for(MCPAgent, 'after_delete')
+def _agent_deleted(mapper, connection, target):
+    response_cache.invalidate_agent(target.id)
+
+
+@event.listens_for(AgentKnowledge, 'after_insert')
+@event.listens_for(AgentKnowledge, 'after_update')
+@event.listens_for(AgentKnowledge, 'after_delete')
+def _knowledge_changed(mapper, connection, target):
+    response_cache.invalidate_agent(target.agent_id)
@@ -1,30 +1,36 @@
 import json
-import openai
 import os
-from typing import Dict, List, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Iterator, Tuple
 from datetime import datetime
+from src.services.prompt_builder import prompt_builder, product_line
+from src.services.llm_gateway import llm_gateway, PRIORITY_BATCH
+from src.services.structured_output import structured_output, StructuredOutputError
 
 class SalesStrategyService:
     def __init__(self):
-        api_key = os.getenv('OPENAI_API_KEY')
-        if api_key:
-            self.openai_client = openai.OpenAI(
-                api_key=api_key,
-                base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-            )
-        else:
-            self.openai_client = None
+        # Geração em lote: passa pelo gateway com prioridade abaixo do chat ao vivo
+        self.openai_client = llm_gateway.client(PRIORITY_BATCH) if llm_gateway.configured else None
+        
+        # Modelo com suporte a structured outputs: as respostas seguem os schemas JSON
+        self.model = os.getenv('SALES_STRATEGY_MODEL', 'gpt-4o')
+        
+        # Descrições longas são cortadas por tokens, não por caracteres
+        self.product_description_tokens = int(os.getenv('PROMPT_PRODUCT_DESCRIPTION_TOKENS', 40))
+        
+        # Otimizações por plataforma rodam em paralelo até este limite
+        self.optimize_concurrency = int(os.getenv('STRATEGY_OPTIMIZE_CONCURRENCY', 4))
     
     def analyze_product_database(self, products: List[Dict]) -> Dict[str, Any]:
         """
         Analisa o banco de dados de produtos/serviços e gera insights para estratégias de vendas.
         """
         try:
-            # Preparar dados dos produtos para análise
-            product_summary = self._prepare_product_summary(products)
+            system_prompt = "Você é um especialista em estratégias de vendas e marketing digital. Analise produtos e forneça insights estratégicos detalhados."
             
             # Prompt para análise de produtos
-            analysis_prompt = f"""
+            analysis_template = """
             Analise o seguinte banco de dados de produtos/serviços e forneça insights estratégicos para vendas:
 
             PRODUTOS/SERVIÇOS:
@@ -42,23 +48,27 @@ class SalesStrategyService:
             Responda em formato JSON estruturado em português brasileiro.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um especialista em estratégias de vendas e marketing digital. Analise produtos e forneça insights estratégicos detalhados."},
-                    {"role": "user", "content": analysis_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
+            # Preparar dados dos produtos para análise: o que sobrar do orçamento de tokens vai para os produtos
+            prompt = prompt_builder.start(self.model, completion_tokens=2000)
+            prompt.take('system', [system_prompt, analysis_template], per_item=0)
+            product_summary = self._prepare_product_summary(products, prompt)
+            analysis_prompt = analysis_template.format(product_summary=product_summary)
             
-            # Tentar parsear a resposta como JSON
             try:
-                analysis_result = json.loads(response.choices[0].message.content)
-            except json.JSONDecodeError:
-                # Se não for JSON válido, estruturar a resposta
+                analysis_result, _ = structured_output.complete(
+                    self.openai_client, 'product_analysis',
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": analysis_prompt}
+                    ],
+                    model=self.model,
+                    temperature=0.7,
+                    max_tokens=2000
+                )
+            except StructuredOutputError as e:
+                # Se nem o reparo nem a nova tentativa deram JSON válido, estruturar a resposta
                 analysis_result = {
-                    "analysis": response.choices[0].message.content,
+                    "analysis": e.raw,
                     "timestamp": datetime.now().isoformat(),
                     "status": "success"
                 }
@@ -67,6 +77,7 @@ class SalesStrategyService:
                 "success": True,
                 "analysis": analysis_result,
                 "products_analyzed": len(products),
+                "prompt": prompt.report(),
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -77,9 +88,11 @@ class SalesStrategyService:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def generate_sales_strategies(self, product_analysis: Dict, target_audience: Dict, campaign_objective: str) -> List[Dict]:
+    def generate_sales_strategies(self, product_analysis: Dict, target_audience: Dict, campaign_objective: str,
+                                  fallback: bool = True) -> List[Dict]:
         """
         Gera estratégias de vendas personalizadas baseadas na análise de produtos e público-alvo.
+        Com fallback=False (jobs em background) uma falha é levantada em vez de virar as estratégias padrão.
         """
         try:
             strategy_prompt = f"""
@@ -108,23 +121,21 @@ class SalesStrategyService:
             Responda em formato JSON com array de estratégias em português brasileiro.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um especialista em estratégias de vendas multicanal. Crie estratégias detalhadas e práticas para diferentes plataformas digitais."},
-                    {"role": "user", "content": strategy_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=3000
-            )
-            
             try:
-                strategies = json.loads(response.choices[0].message.content)
-                if isinstance(strategies, dict) and 'strategies' in strategies:
-                    strategies = strategies['strategies']
-                elif not isinstance(strategies, list):
-                    strategies = [strategies]
-            except json.JSONDecodeError:
+                result, _ = structured_output.complete(
+                    self.openai_client, 'sales_strategies',
+                    messages=[
+                        {"role": "system", "content": "Você é um especialista em estratégias de vendas multicanal. Crie estratégias detalhadas e práticas para diferentes plataformas digitais."},
+                        {"role": "user", "content": strategy_prompt}
+                    ],
+                    model=self.model,
+                    temperature=0.8,
+                    max_tokens=3000
+                )
+                strategies = result['strategies']
+            except StructuredOutputError:
+                if not fallback:
+                    raise
                 # Fallback para estratégias padrão
                 strategies = self._generate_default_strategies(campaign_objective)
             
@@ -137,12 +148,15 @@ class SalesStrategyService:
             return strategies
             
         except Exception as e:
+            if not fallback:
+                raise
             # Retornar estratégias padrão em caso de erro
             return self._generate_default_strategies(campaign_objective)
     
-    def optimize_strategy_for_platform(self, strategy: Dict, platform: str) -> Dict:
+    def optimize_strategy_for_platform(self, strategy: Dict, platform: str, fallback: bool = True) -> Dict:
         """
         Otimiza uma estratégia específica para uma plataforma (WhatsApp, Instagram, Facebook, etc.).
+        Com fallback=False (jobs em background) um erro é levantado em vez de devolver a estratégia original.
         """
         try:
             platform_prompt = f"""
@@ -166,22 +180,21 @@ class SalesStrategyService:
             Retorne a estratégia otimizada em formato JSON em português brasileiro.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": f"Você é um especialista em marketing e vendas na plataforma {platform}. Otimize estratégias para maximizar conversões nesta plataforma específica."},
-                    {"role": "user", "content": platform_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
             try:
-                optimized_strategy = json.loads(response.choices[0].message.content)
-            except json.JSONDecodeError:
+                optimized_strategy, _ = structured_output.complete(
+                    self.openai_client, 'platform_strategy',
+                    messages=[
+                        {"role": "system", "content": f"Você é um especialista em marketing e vendas na plataforma {platform}. Otimize estratégias para maximizar conversões nesta plataforma específica."},
+                        {"role": "user", "content": platform_prompt}
+                    ],
+                    model=self.model,
+                    temperature=0.7,
+                    max_tokens=2000
+                )
+            except StructuredOutputError as e:
                 # Manter estratégia original se não conseguir otimizar
                 optimized_strategy = strategy.copy()
-                optimized_strategy['platform_optimization'] = response.choices[0].message.content
+                optimized_strategy['platform_optimization'] = e.raw
             
             optimized_strategy['optimized_for'] = platform
             optimized_strategy['optimization_timestamp'] = datetime.now().isoformat()
@@ -189,14 +202,38 @@ class SalesStrategyService:
             return optimized_strategy
             
         except Exception as e:
+            if not fallback:
+                raise
             # Retornar estratégia original em caso de erro
             strategy_copy = strategy.copy()
             strategy_copy['optimization_error'] = str(e)
             return strategy_copy
     
-    def create_conversation_flow(self, strategy: Dict, platform: str) -> Dict:
+    def optimize_strategy_for_platforms(self, strategy: Dict, platforms: List[str],
+                                        max_concurrency: Optional[int] = None) -> Iterator[Tuple[str, Dict, float]]:
+        """
+        Otimiza a mesma estratégia para várias plataformas em paralelo.
+        
+        Gera (plataforma, estratégia otimizada, segundos) na ordem em que cada
+        otimização termina; no máximo `max_concurrency` (limitado por
+        STRATEGY_OPTIMIZE_CONCURRENCY) chamadas rodam ao mesmo tempo.
+        """
+        workers = max(1, min(max_concurrency or self.optimize_concurrency, self.optimize_concurrency, len(platforms) or 1))
+        
+        def timed(platform):
+            started = time.perf_counter()
+            result = self.optimize_strategy_for_platform(strategy, platform)
+            return platform, result, time.perf_counter() - started
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='strategy-optimize') as executor:
+            futures = [executor.submit(timed, platform) for platform in platforms]
+            for future in as_completed(futures):
+                yield future.result()
+    
+    def create_conversation_flow(self, strategy: Dict, platform: str, fallback: bool = True) -> Dict:
         """
         Cria um fluxo de conversa detalhado para uma estratégia específica.
+        Com fallback=False (jobs em background) uma falha é levantada em vez de virar o fluxo básico.
         """
         try:
             flow_prompt = f"""
@@ -227,19 +264,20 @@ class SalesStrategyService:
             Responda em formato JSON estruturado em português brasileiro.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": f"Você é um especialista em criação de fluxos de conversa para vendas automatizadas na plataforma {platform}. Crie fluxos detalhados e eficazes."},
-                    {"role": "user", "content": flow_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=3000
-            )
-            
             try:
-                conversation_flow = json.loads(response.choices[0].message.content)
-            except json.JSONDecodeError:
+                conversation_flow, _ = structured_output.complete(
+                    self.openai_client, 'conversation_flow',
+                    messages=[
+                        {"role": "system", "content": f"Você é um especialista em criação de fluxos de conversa para vendas automatizadas na plataforma {platform}. Crie fluxos detalhados e eficazes."},
+                        {"role": "user", "content": flow_prompt}
+                    ],
+                    model=self.model,
+                    temperature=0.7,
+                    max_tokens=3000
+                )
+            except StructuredOutputError:
+                if not fallback:
+                    raise
                 # Criar fluxo básico se não conseguir parsear
                 conversation_flow = self._create_basic_flow(strategy, platform)
             
@@ -250,6 +288,8 @@ class SalesStrategyService:
             return conversation_flow
             
         except Exception as e:
+            if not fallback:
+                raise
             return self._create_basic_flow(strategy, platform)
     
     def evaluate_strategy_performance(self, strategy_id: str, metrics: Dict) -> Dict:
@@ -275,21 +315,20 @@ class SalesStrategyService:
             Responda em formato JSON estruturado em português brasileiro.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um analista de performance de vendas. Avalie métricas e forneça insights acionáveis para otimização."},
-                    {"role": "user", "content": evaluation_prompt}
-                ],
-                temperature=0.6,
-                max_tokens=2000
-            )
-            
             try:
-                evaluation = json.loads(response.choices[0].message.content)
-            except json.JSONDecodeError:
+                evaluation, _ = structured_output.complete(
+                    self.openai_client, 'strategy_evaluation',
+                    messages=[
+                        {"role": "system", "content": "Você é um analista de performance de vendas. Avalie métricas e forneça insights acionáveis para otimização."},
+                        {"role": "user", "content": evaluation_prompt}
+                    ],
+                    model=self.model,
+                    temperature=0.6,
+                    max_tokens=2000
+                )
+            except StructuredOutputError as e:
                 evaluation = {
-                    "analysis": response.choices[0].message.content,
+                    "analysis": e.raw,
                     "performance_score": self._calculate_performance_score(metrics)
                 }
             
@@ -306,20 +345,17 @@ class SalesStrategyService:
                 "evaluation_date": datetime.now().isoformat()
             }
     
-    def _prepare_product_summary(self, products: List[Dict]) -> str:
-        """Prepara um resumo dos produtos para análise."""
-        summary = []
-        for product in products:
-            product_info = f"- {product.get('name', 'Produto sem nome')}"
-            if 'price' in product:
-                product_info += f" (R$ {product['price']})"
-            if 'description' in product:
-                product_info += f": {product['description'][:100]}..."
-            if 'category' in product:
-                product_info += f" [Categoria: {product['category']}]"
-            summary.append(product_info)
+    def _prepare_product_summary(self, products: List[Dict], prompt=None) -> str:
+        """Prepara um resumo dos produtos para análise, limitado ao orçamento de tokens do prompt."""
+        if prompt is None:
+            prompt = prompt_builder.start(self.model, completion_tokens=2000)
+        
+        lines = [product_line(product, self.product_description_tokens, prompt.model) for product in products]
+        summary = prompt.take('products', lines, truncate=False)
+        if len(summary) < len(lines):
+            summary.append(f"- ... e mais {len(lines) - len(summary)} produtos não listados")
         
-        return "\n".join(summary[:20])  # Limitar a 20 produtos para não exceder tokens
+        return "\n".join(summary)
     
     def _generate_default_strategies(self, objective: str) -> List[Dict]:
         """Gera estratégias padrão quando a IA falha."""
@@ -0,0 +1,24 @@
+import json
+from typing import Any, Dict, Iterable
+from flask import Response, stream_with_context
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(frames: Iterable[str]) -> Response:
+    """Stream pre-formatted SSE frames, keeping the request context alive and proxies unbuffered."""
+    return Response(
+        stream_with_context(frames),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def wants_stream(data: Dict[str, Any], request) -> bool:
+    """Streaming is opt-in: JSON {"stream": true}, ?stream=1 or Accept: text/event-stream."""
+    if data.get('stream') or request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
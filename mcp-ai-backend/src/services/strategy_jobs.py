@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from src.models.db_instance import db
+from src.models.strategy_job import StrategyJob
+from src.services.sales_strategy_service import sales_strategy_service
+
+logger = logging.getLogger("strategy_jobs")
+
+
+class StrategyJobService:
+    """
+    Background jobs for the slow SalesStrategyService generations.
+
+    Submitting a job only INSERTs it and returns its id; worker threads in
+    every process claim queued jobs with a lease (locked_by + heartbeat_at,
+    renewed while the model is generating), run the service method and
+    persist the result. Jobs are de-duplicated by a hash of the kind and
+    the canonical JSON parameters: an identical submission returns the
+    existing job (queued, running or completed), a failed one is requeued
+    in place, and force=True regenerates a completed one.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv('STRATEGY_JOB_WORKERS', 2))
+        self.poll_interval = float(os.getenv('STRATEGY_JOB_POLL_INTERVAL', 2.0))
+        self.lease_seconds = int(os.getenv('STRATEGY_JOB_LEASE_SECONDS', 120))
+        self.max_attempts = int(os.getenv('STRATEGY_JOB_MAX_ATTEMPTS', 2))
+        self.app = None
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers_pid = None
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self._run_total = 0.0
+
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app):
+        """Bind to the Flask app and start the worker threads in this process."""
+        self.app = app
+        app.before_request(self._ensure_workers)
+        self._ensure_workers()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        """`handler(params)` returns the JSON-serializable result of a job kind."""
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self):
+        return sorted(self._handlers)
+
+    @staticmethod
+    def input_hash(kind: str, params: Dict[str, Any]) -> str:
+        canonical = json.dumps({'kind': kind, 'params': params}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    # Producer side
+    def submit(self, kind: str, params: Dict[str, Any], user_id: Optional[int] = None,
+               force: bool = False) -> Tuple[StrategyJob, bool]:
+        """Queue a job; returns (job, deduplicated)."""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de job desconhecido: {kind}")
+        digest = self.input_hash(kind, params)
+        job = StrategyJob(kind=kind, input_hash=digest, user_id=user_id, status='queued',
+                          params=json.dumps(params, ensure_ascii=False), attempts=0, requests=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(job)
+            db.session.commit()
+            self._ensure_workers()
+            self._wakeup.set()
+            return job, False
+        except IntegrityError:
+            db.session.rollback()
+
+        job = StrategyJob.query.filter_by(input_hash=digest).first()
+        requeue = job.status == 'failed' or (force and job.status == 'completed')
+        values = {'requests': StrategyJob.requests + 1}
+        if requeue:
+            values.update({'status': 'queued', 'error': None, 'attempts': 0, 'locked_by': None,
+                           'started_at': None, 'finished_at': None})
+        StrategyJob.query.filter_by(id=job.id).update(values, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(job)
+        if requeue:
+            self._ensure_workers()
+            self._wakeup.set()
+        else:
+            self.deduplicated += 1
+        return job, not requeue
+
+    def get_job(self, job_id: int) -> Optional[StrategyJob]:
+        return db.session.get(StrategyJob, job_id)
+
+    def wait(self, job_id: int, timeout: float, interval: float = 0.5) -> Optional[StrategyJob]:
+        """Long-poll: return the job once it is finished or `timeout` seconds have passed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job is None or job.status in ('completed', 'failed') or time.monotonic() >= deadline:
+                return job
+            db.session.commit()  # end the transaction so the next read sees the worker's commit
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(db.session.query(StrategyJob.status, db.func.count(StrategyJob.id)).group_by(StrategyJob.status).all())
+        finished = self.completed + self.failed
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'completed': counts.get('completed', 0),
+            'failed': counts.get('failed', 0),
+            'worker': {
+                'id': self.worker_id,
+                'threads': self.workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'deduplicated': self.deduplicated,
+                'avg_run_seconds': round(self._run_total / finished, 3) if finished else 0.0
+            }
+        }
+
+    # Worker pool
+    def _ensure_workers(self):
+        if self.app is None or self._workers_pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'strategy-job-worker-{n}', daemon=True)
+                thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    while self._run_next():
+                        pass
+            except Exception:
+                logger.exception("Strategy job worker iteration failed")
+            finally:
+                if self.app is not None:
+                    with self.app.app_context():
+                        db.session.remove()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run_next(self) -> bool:
+        """Claim and run one queued (or abandoned) job; False when there is none."""
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        candidates = [row.id for row in db.session.query(StrategyJob.id).filter(db.or_(
+            StrategyJob.status == 'queued',
+            db.and_(StrategyJob.status == 'running', StrategyJob.heartbeat_at < stale)
+        )).order_by(StrategyJob.id).limit(10).all()]
+        db.session.commit()
+        for job_id in candidates:
+            if self._claim(job_id, stale):
+                self._execute(job_id)
+                return True
+        return False
+
+    def _claim(self, job_id: int, stale: datetime) -> bool:
+        now = datetime.utcnow()
+        claimed = StrategyJob.query.filter(
+            StrategyJob.id == job_id,
+            db.or_(StrategyJob.status == 'queued',
+                   db.and_(StrategyJob.status == 'running', StrategyJob.heartbeat_at < stale))
+        ).update({'status': 'running', 'locked_by': self.worker_id, 'heartbeat_at': now,
+                  'started_at': now, 'attempts': StrategyJob.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        """Renew the lease while the generation runs in the worker thread."""
+        with self.app.app_context():
+            while not done.wait(self.lease_seconds / 3):
+                StrategyJob.query.filter_by(id=job_id, locked_by=self.worker_id, status='running').update(
+                    {'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+            db.session.remove()
+
+    def _execute(self, job_id: int):
+        job = db.session.get(StrategyJob, job_id)
+        kind, params, attempts = job.kind, job.get_params(), job.attempts
+        db.session.commit()
+
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, done), name=f'strategy-job-{job_id}-lease',
+                         daemon=True).start()
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No strategy job handler registered for '{kind}'")
+            result = handler(params)
+            if isinstance(result, dict) and result.get('success') is False:
+                error = result.get('error') or 'generation failed'
+        except Exception as e:
+            logger.exception(f"Strategy job {job_id} failed")
+            db.session.rollback()
+            error = str(e) or e.__class__.__name__
+        finally:
+            done.set()
+
+        retry = error is not None and attempts < self.max_attempts
+        StrategyJob.query.filter_by(id=job_id, locked_by=self.worker_id).update({
+            'status': 'queued' if retry else ('failed' if error else 'completed'),
+            'result': json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+            'error': error,
+            'locked_by': None,
+            'finished_at': None if retry else datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if not retry:
+            self._run_total += time.monotonic() - started
+            if error:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+# Singleton instance
+strategy_jobs = StrategyJobService()
+
+strategy_jobs.register('analyze_products', lambda params: sales_strategy_service.analyze_product_database(
+    params['products']))
+# Generations raise instead of returning their canned fallbacks, so an outage fails (and retries) the job
+# rather than being stored as its completed result
+strategy_jobs.register('generate_strategies', lambda params: sales_strategy_service.generate_sales_strategies(
+    params['product_analysis'], params['target_audience'], params['campaign_objective'], fallback=False))
+strategy_jobs.register('create_conversation_flow', lambda params: sales_strategy_service.create_conversation_flow(
+    params['strategy'], params['platform'], fallback=False))
+strategy_jobs.register('optimize_strategy', lambda params: sales_strategy_service.optimize_strategy_for_platform(
+    params['strategy'], params['platform'], fallback=False))
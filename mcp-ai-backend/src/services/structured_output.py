@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger("structured_output")
+
+
+def _strings(description: str) -> Dict[str, Any]:
+    return {'type': 'array', 'items': {'type': 'string'}, 'description': description}
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # Strict structured outputs require every property to be listed and no extras
+    return {'type': 'object', 'properties': properties, 'required': list(properties), 'additionalProperties': False}
+
+
+_STRATEGY = {
+    'name': {'type': 'string'},
+    'description': {'type': 'string'},
+    'target_audience': {'type': 'string'},
+    'recommended_products': _strings('Produtos/serviços recomendados'),
+    'recommended_channels': _strings('WhatsApp, Instagram, Facebook, ...'),
+    'message_sequence': _strings('Sequência de mensagens/abordagem'),
+    'success_metrics': _strings('Métricas de sucesso esperadas'),
+    'investment_level': {'type': 'string'},
+    'expected_conversion': {'type': 'string'},
+    'timeline': {'type': 'string'},
+    'key_arguments': _strings('Argumentos de vendas principais'),
+}
+
+# JSON schemas of the SalesStrategyService generations (keys match the fallback structures)
+SCHEMAS: Dict[str, Dict[str, Any]] = {
+    'product_analysis': _object({
+        'summary': {'type': 'string'},
+        'categories': {'type': 'array', 'items': _object({
+            'name': {'type': 'string'},
+            'value_tier': {'type': 'string', 'enum': ['low', 'mid', 'high']},
+            'price_range': {'type': 'string'},
+            'products': _strings('Nomes dos produtos da categoria'),
+        })},
+        'anchor_products': _strings('Produtos âncora (high-ticket)'),
+        'entry_products': _strings('Produtos de entrada (low-ticket)'),
+        'upsell_opportunities': _strings('Oportunidades de upsell'),
+        'cross_sell_opportunities': _strings('Oportunidades de cross-sell'),
+        'audience_segments': {'type': 'array', 'items': _object({
+            'segment': {'type': 'string'},
+            'description': {'type': 'string'},
+            'products': _strings('Produtos indicados ao segmento'),
+        })},
+        'pricing_strategies': _strings('Estratégias de precificação recomendadas'),
+        'selling_points': {'type': 'array', 'items': _object({
+            'category': {'type': 'string'},
+            'arguments': _strings('Argumentos de venda únicos'),
+        })},
+    }),
+    'sales_strategies': _object({
+        'strategies': {'type': 'array', 'items': _object(_STRATEGY)},
+    }),
+    'platform_strategy': _object(dict(_STRATEGY, platform_adaptations=_object({
+        'content_formats': _strings('Formatos de conteúdo mais eficazes'),
+        'engagement_practices': _strings('Melhores práticas de engajamento'),
+        'best_times': _strings('Timing ideal para interações'),
+        'personalization': _strings('Personalização de mensagens'),
+        'automations': _strings('Automações possíveis'),
+        'limitations': _strings('Limitações e oportunidades da plataforma'),
+    }))),
+    'conversation_flow': _object({
+        'flow_name': {'type': 'string'},
+        'steps': {'type': 'array', 'items': _object({
+            'step': {'type': 'integer'},
+            'type': {'type': 'string', 'description': 'opening, follow_up, objection, closing, post_sale, ...'},
+            'message': {'type': 'string'},
+            'timing': {'type': 'string'},
+            'conditions': {'type': 'string'},
+            'expected_responses': _strings('Possíveis respostas do cliente'),
+            'next_step': {'type': 'string'},
+        })},
+        'objection_handling': {'type': 'array', 'items': _object({
+            'objection': {'type': 'string'},
+            'response': {'type': 'string'},
+        })},
+        'automation_triggers': _strings('Triggers para automação'),
+        'escalation_points': _strings('Pontos de escalação para humano'),
+    }),
+    'strategy_evaluation': _object({
+        'performance_score': {'type': 'number', 'description': '0 a 100'},
+        'overall_analysis': {'type': 'string'},
+        'strengths': _strings('Pontos fortes identificados'),
+        'improvements': _strings('Áreas de melhoria'),
+        'optimization_suggestions': _strings('Sugestões de otimização específicas'),
+        'strategy_adjustments': _strings('Ajustes recomendados na estratégia'),
+        'expected_improvements': _strings('Previsões de melhoria'),
+        'next_steps': _strings('Próximos passos recomendados'),
+    }),
+}
+
+# Models that accept response_format json_schema / json_object; the longest matching prefix wins
+JSON_SCHEMA_MODELS = ('gpt-4o', 'gpt-4.1', 'gpt-5', 'o1', 'o3', 'o4')
+JSON_OBJECT_MODELS = ('gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125', 'gpt-3.5-turbo')
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '„': '"'})
+_TYPES = {'object': dict, 'array': list, 'string': str, 'integer': int, 'number': (int, float), 'boolean': bool}
+
+
+class StructuredOutputError(Exception):
+    """The model output is not valid for the schema, even after repair and the retry."""
+
+    def __init__(self, message: str, raw: str = ''):
+        super().__init__(message)
+        self.raw = raw
+
+
+def repair_json(text: str) -> Any:
+    """
+    Parse near-valid JSON: markdown fences, prose around the document,
+    typographic quotes, trailing commas and output cut at max_tokens
+    (open strings and brackets are closed, a dangling member is dropped).
+    Raises ValueError when nothing parseable is left.
+    """
+    text = (text or '').strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        raise ValueError('no JSON document in the output')
+    text = text[min(starts):].translate(_SMART_QUOTES)
+
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+    except json.JSONDecodeError:
+        pass
+
+    # Walk the document tracking strings and open brackets; remember the last member boundary
+    stack, in_string, escaped = [], False, False
+    end, cut = len(text), None
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1  # prose after the document is ignored
+                break
+        elif char == ',':
+            cut = (i, list(stack))
+
+    candidates = [text[:end] + ('"' if in_string and end == len(text) else '') + ''.join(reversed(stack))]
+    if cut is not None and end == len(text):
+        candidates.append(text[:cut[0]] + ''.join(reversed(cut[1])))
+    for candidate in candidates:
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r'\1', candidate))
+        except json.JSONDecodeError:
+            continue
+    raise ValueError('output is not repairable JSON')
+
+
+def validate(data: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """Errors of `data` against the subset of JSON schema used in SCHEMAS (type, required, items, enum)."""
+    expected = _TYPES.get(schema.get('type'))
+    if expected is not None and (not isinstance(data, expected) or
+                                 (isinstance(data, bool) and schema.get('type') != 'boolean')):
+        return [f"{path}: expected {schema['type']}"]
+    if 'enum' in schema and data not in schema['enum']:
+        return [f"{path}: must be one of {schema['enum']}"]
+    errors = []
+    if isinstance(data, dict):
+        errors += [f"{path}.{key}: missing" for key in schema.get('required', []) if key not in data]
+        for key, subschema in schema.get('properties', {}).items():
+            if key in data:
+                errors += validate(data[key], subschema, f"{path}.{key}")
+    elif isinstance(data, list) and 'items' in schema:
+        for n, item in enumerate(data):
+            errors += validate(item, schema['items'], f"{path}[{n}]")
+    return errors
+
+
+class StructuredOutput:
+    """
+    Schema-constrained completions for the sales strategy generations.
+
+    The request asks for the schema as response_format (json_schema on
+    models that support structured outputs, json_object plus the schema in
+    the prompt on older ones, prompt only otherwise). The reply is parsed,
+    repaired locally when it is near-valid JSON and validated; only when
+    that fails is the completion retried, at most STRUCTURED_OUTPUT_RETRIES
+    times, with the validation error (and more max_tokens when the reply
+    was cut). Parse failures, repairs and retries are counted per schema.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv('STRUCTURED_OUTPUT_MODE', 'auto')  # auto, json_schema, json_object, prompt
+        self.retries = int(os.getenv('STRUCTURED_OUTPUT_RETRIES', 1))
+        self.retry_token_factor = float(os.getenv('STRUCTURED_OUTPUT_RETRY_TOKEN_FACTOR', 1.5))
+        self.schemas = dict(SCHEMAS)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Counter] = {}
+
+    def mode_for(self, model: str) -> str:
+        if self.mode != 'auto':
+            return self.mode
+        if model.startswith(JSON_SCHEMA_MODELS):
+            return 'json_schema'
+        if model.startswith(JSON_OBJECT_MODELS):
+            return 'json_object'
+        return 'prompt'
+
+    def complete(self, client, schema_name: str, messages: List[Dict[str, str]], model: str,
+                 **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """chat.completions.create constrained to a schema; returns (data, {'mode', 'attempts', 'repaired'})."""
+        schema = self.schemas[schema_name]
+        mode = self.mode_for(model)
+        messages = list(messages)
+        if mode == 'json_schema':
+            kwargs['response_format'] = {'type': 'json_schema',
+                                         'json_schema': {'name': schema_name, 'schema': schema, 'strict': True}}
+        else:
+            if mode == 'json_object':
+                kwargs['response_format'] = {'type': 'json_object'}
+            messages.insert(1 if messages and messages[0]['role'] == 'system' else 0, {
+                'role': 'system',
+                'content': 'Responda somente com um objeto JSON válido neste schema, sem texto fora do JSON:\n'
+                           + json.dumps(schema, ensure_ascii=False, separators=(',', ':'))
+            })
+
+        raw, error = '', None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count(schema_name, 'retries')
+                messages = messages + [
+                    {'role': 'assistant', 'content': raw},
+                    {'role': 'user', 'content': f"A resposta anterior não era válida ({error}). "
+                                                "Gere novamente a resposta completa, somente o JSON."}
+                ]
+            response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+            choice = response.choices[0]
+            raw = choice.message.content or ''
+            self._count(schema_name, 'calls')
+            data, repaired, error = self._parse(raw, schema)
+            if error is None:
+                self._count(schema_name, 'ok' if not repaired else 'repaired')
+                if attempt:
+                    self._count(schema_name, 'retry_recovered')
+                return data, {'mode': mode, 'attempts': attempt + 1, 'repaired': repaired}
+            self._count(schema_name, 'parse_failures')
+            logger.warning("Structured output '%s' invalid (attempt %d): %s", schema_name, attempt + 1, error)
+            if getattr(choice, 'finish_reason', None) == 'length' and kwargs.get('max_tokens'):
+                kwargs['max_tokens'] = int(kwargs['max_tokens'] * self.retry_token_factor)
+
+        self._count(schema_name, 'failed')
+        raise StructuredOutputError(f"Resposta inválida para o schema '{schema_name}': {error}", raw)
+
+    @staticmethod
+    def _parse(raw: str, schema: Dict[str, Any]) -> Tuple[Any, bool, Optional[str]]:
+        """(data, repaired, error) of one reply."""
+        repaired = False
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            try:
+                data, repaired = repair_json(raw), True
+            except ValueError as e:
+                return None, False, str(e)
+        # A bare array where the schema wraps it in its single array property
+        properties = schema.get('properties', {})
+        if isinstance(data, list) and len(properties) == 1:
+            key, = properties
+            if properties[key].get('type') == 'array':
+                data, repaired = {key: data}, True
+        errors = validate(data, schema)
+        if errors:
+            return None, repaired, '; '.join(errors[:5])
+        return data, repaired, None
+
+    def _count(self, schema_name: str, key: str):
+        with self._lock:
+            self._counts.setdefault(schema_name, Counter())[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            schemas = {}
+            for name, counts in self._counts.items():
+                calls = counts['calls']
+                requests = calls - counts['retries']
+                schemas[name] = {
+                    'requests': requests,
+                    'calls': calls,
+                    'ok': counts['ok'],
+                    'repaired': counts['repaired'],
+                    'retries': counts['retries'],
+                    'retry_recovered': counts['retry_recovered'],
+                    'failed': counts['failed'],
+                    'parse_failure_rate': round(counts['parse_failures'] / calls, 4) if calls else 0.0,
+                    'failure_rate': round(counts['failed'] / requests, 4) if requests else 0.0
+                }
+            calls = sum(counts['calls'] for counts in self._counts.values())
+            failures = sum(counts['parse_failures'] for counts in self._counts.values())
+            return {
+                'mode': self.mode,
+                'retries': self.retries,
+                'parse_failure_rate': round(failures / calls, 4) if calls else 0.0,
+                'schemas': schemas
+            }
+
+# Singleton instance
+structured_output = StructuredOutput()
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import event, bindparam, inspect
+from sqlalchemy.orm import Session
+from src.models.db_instance import db
+from src.models.mcp_agent import AgentKnowledge
+from src.services.embeddings import Embedder, get_embedder
+from src.services.knowledge_index import knowledge_index, knowledge_prior, KnowledgeIndex
+
+logger = logging.getLogger("vector_index")
+
+PRIOR_WEIGHT = 0.1
+
+
+def knowledge_text(title: Optional[str], content: Optional[str], tags: Any) -> str:
+    if isinstance(tags, str):
+        try:
+            tags = json.loads(tags)
+        except ValueError:
+            tags = [tags]
+    return ' '.join(filter(None, [title, ' '.join(str(t) for t in (tags or [])), content]))
+
+
+class _AgentVectors:
+    """Embeddings of one agent's active knowledge, stacked lazily into a matrix."""
+
+    def __init__(self):
+        self.vectors: Dict[int, np.ndarray] = {}
+        self.meta: Dict[int, Dict[str, Any]] = {}
+        self.signature = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self._ids: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._priors: Optional[np.ndarray] = None
+        self._positions: Dict[int, int] = {}
+
+    def put(self, doc_id: int, vector: np.ndarray, meta: Dict[str, Any]):
+        self.vectors[doc_id] = vector
+        self.meta[doc_id] = meta
+        self._matrix = None
+
+    def remove(self, doc_id: int):
+        if self.vectors.pop(doc_id, None) is not None:
+            self.meta.pop(doc_id, None)
+            self._matrix = None
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[int, int]]:
+        if self._matrix is None:
+            ids = list(self.vectors.keys())
+            self._ids = np.array(ids, dtype=np.int64)
+            self._matrix = np.stack([self.vectors[i] for i in ids]) if ids else np.zeros((0, 1), dtype=np.float32)
+            # Priority/effectiveness nudge dense scores instead of dominating cosine noise
+            self._priors = 1.0 + PRIOR_WEIGHT * (np.array([self.meta[i]['prior'] for i in ids], dtype=np.float32) - 1.0)
+            self._positions = {doc_id: pos for pos, doc_id in enumerate(ids)}
+        return self._ids, self._matrix, self._priors, self._positions
+
+
+class VectorIndex:
+    """
+    Dense retrieval over AgentKnowledge.
+
+    Each row's embedding is computed once after the write that changed its
+    text commits (the knowledge index change listener) and stored as float16
+    bytes in agent_knowledge.embedding from a separate session; rows still
+    missing an embedding from the current embedder are backfilled on the
+    first search. Per agent the vectors are kept as one float32 matrix and a
+    query is a single matrix-vector product plus argpartition top-k. Hybrid
+    mode blends the cosine score with the BM25 keyword score (normalized to
+    0-1) using KNOWLEDGE_HYBRID_ALPHA as the dense weight.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None):
+        self.embedder = embedder or get_embedder()
+        self.top_k = int(os.getenv('KNOWLEDGE_TOP_K', 5))
+        self.hybrid_alpha = float(os.getenv('KNOWLEDGE_HYBRID_ALPHA', 0.6))
+        self.hybrid_candidates = int(os.getenv('KNOWLEDGE_HYBRID_CANDIDATES', 50))
+        self.check_interval = float(os.getenv('KNOWLEDGE_INDEX_CHECK_SECONDS', 60))
+        self._indexes: Dict[int, _AgentVectors] = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.backfilled = 0
+        self._query_seconds = 0.0
+
+    def search(self, agent_id: int, query: str, top_k: Optional[int] = None, hybrid: bool = False) -> List[Dict[str, Any]]:
+        if agent_id is None or not query or not query.strip():
+            return []
+        index = self._get_index(agent_id)
+        top_k = top_k or self.top_k
+        keyword = knowledge_index.search(agent_id, query, self.hybrid_candidates) if hybrid else []
+
+        started = time.perf_counter()
+        query_vector = self.embedder.embed([query])[0]
+        with index.lock:
+            ids, matrix, priors, positions = index.arrays()
+            if not len(ids):
+                return []
+            scores = matrix @ query_vector
+            if hybrid:
+                keyword_scores = np.zeros(len(ids), dtype=np.float32)
+                best = keyword[0]['score'] if keyword else 0.0
+                for entry in keyword:
+                    pos = positions.get(entry['id'])
+                    if pos is not None and best > 0:
+                        keyword_scores[pos] = entry['score'] / best
+                scores = self.hybrid_alpha * scores + (1 - self.hybrid_alpha) * keyword_scores
+            scores = scores * priors
+            k = min(top_k, len(ids))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = [dict(index.meta[int(ids[pos])], score=round(float(scores[pos]), 4)) for pos in top]
+        self.queries += 1
+        self._query_seconds += time.perf_counter() - started
+        for entry in results:
+            entry.pop('prior', None)
+        return results
+
+    def apply(self, changes: List[Tuple[str, Dict[str, Any]]]):
+        """Embed and store committed knowledge changes, then apply them to indexes already in memory."""
+        missing = [row for op, row in changes if op != 'delete' and row.get('is_active', True)
+                   and (not row.get('embedding') or row.get('embedding_model') != self.embedder.name)]
+        if missing:
+            try:
+                self._backfill(missing)
+            except Exception:
+                # The rows are committed already; the next search backfills them
+                logger.exception("Embedding %d knowledge rows failed", len(missing))
+        for op, row in changes:
+            index = self._indexes.get(row['agent_id'])
+            if index is None:
+                continue
+            with index.lock:
+                if op == 'delete' or not row.get('is_active', True):
+                    index.remove(row['id'])
+                elif row.get('embedding') and row.get('embedding_model') == self.embedder.name:
+                    index.put(row['id'], self.embedder.from_bytes(row['embedding']), self._meta(row))
+                else:
+                    # Embedding failed: rebuild (and backfill) on the next search
+                    with self._lock:
+                        self._indexes.pop(row['agent_id'], None)
+                    continue
+                index.signature = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'embedder': self.embedder.name,
+            'agents_indexed': len(self._indexes),
+            'vectors': sum(len(index.vectors) for index in list(self._indexes.values())),
+            'backfilled': self.backfilled,
+            'queries': self.queries,
+            'avg_query_ms': round(self._query_seconds / self.queries * 1000, 4) if self.queries else 0.0
+        }
+
+    @staticmethod
+    def _meta(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'category': row['category'],
+            'title': row['title'],
+            'content': row['content'],
+            'prior': knowledge_prior(row.get('priority'), row.get('effectiveness_score'))
+        }
+
+    def _get_index(self, agent_id: int) -> _AgentVectors:
+        index = self._indexes.get(agent_id)
+        now = time.monotonic()
+        if index is not None and now - index.checked_at < self.check_interval:
+            return index
+        with db.session.no_autoflush:
+            signature = KnowledgeIndex._signature(agent_id)
+        if index is not None:
+            index.checked_at = now
+            if index.signature is None:
+                index.signature = signature
+            if index.signature == signature:
+                return index
+        return self._build(agent_id, signature)
+
+    def _build(self, agent_id: int, signature) -> _AgentVectors:
+        # Committed rows only: the caller's pending changes reach the index through apply() after commit
+        with Session(db.engine) as session:
+            rows = [row._asdict() for row in session.query(
+                AgentKnowledge.id, AgentKnowledge.agent_id, AgentKnowledge.category, AgentKnowledge.title,
+                AgentKnowledge.content, AgentKnowledge.tags, AgentKnowledge.priority,
+                AgentKnowledge.effectiveness_score, AgentKnowledge.embedding, AgentKnowledge.embedding_model
+            ).filter(AgentKnowledge.agent_id == agent_id, AgentKnowledge.is_active.is_(True)).all()]
+
+        index = _AgentVectors()
+        missing = [row for row in rows if not row['embedding'] or row['embedding_model'] != self.embedder.name]
+        if missing:
+            self._backfill(missing)
+        for row in rows:
+            index.put(row['id'], self.embedder.from_bytes(row['embedding']), self._meta(row))
+        index.signature = signature
+        index.checked_at = time.monotonic()
+        with self._lock:
+            self._indexes[agent_id] = index
+        return index
+
+    def _backfill(self, rows: List[Dict[str, Any]], batch_size: int = 256):
+        """
+        Embed rows stored without a (current) embedding and persist them without touching updated_at.
+
+        Runs in its own session so it never commits (or waits on) the caller's transaction.
+        """
+        table = AgentKnowledge.__table__
+        statement = table.update().where(table.c.id == bindparam('_id')).values(
+            embedding=bindparam('_embedding'),
+            embedding_model=bindparam('_model'),
+            updated_at=table.c.updated_at
+        )
+        with Session(db.engine) as session:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                vectors = self.embedder.embed([knowledge_text(r['title'], r['content'], r['tags']) for r in batch])
+                params = []
+                for row, vector in zip(batch, vectors):
+                    row['embedding'] = self.embedder.to_bytes(vector)
+                    row['embedding_model'] = self.embedder.name
+                    params.append({'_id': row['id'], '_embedding': row['embedding'], '_model': self.embedder.name})
+                session.execute(statement, params)
+                session.commit()
+                self.backfilled += len(batch)
+
+# Singleton instance
+vector_index = VectorIndex()
+knowledge_index.on_change(vector_index.apply)
+
+
+@event.listens_for(AgentKnowledge, 'before_update')
+def _drop_stale_embedding(mapper, connection, target):
+    # The new text is embedded after commit (VectorIndex.apply); don't keep the old vector meanwhile
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('title', 'content', 'tags')):
+        target.embedding = None
+        target.embedding_model = None
@@ -0,0 +1,104 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from sqlalchemy.exc import IntegrityError
+from src.models.db_instance import db
+from src.models.webhook import WebhookMessageId
+from src.services.cache import TTLCache
+
+
+def extract_message_id(payload: Dict[str, Any]) -> Optional[str]:
+    """Provider message id from a Z-API / WhatsAPI webhook payload, if present."""
+    for container in (payload, payload.get('data'), payload.get('message'), payload.get('response')):
+        if not isinstance(container, dict):
+            continue
+        for field in ('messageId', 'message_id', 'id'):
+            value = container.get(field)
+            if isinstance(value, dict):
+                value = value.get('_serialized') or value.get('id')
+            if value:
+                return str(value)
+    return None
+
+
+class WebhookDeduplicator:
+    """
+    Drops webhook redeliveries by provider message id.
+
+    A bounded in-memory TTL set answers most duplicates without touching the
+    database; the `webhook_message_ids` table (primary key provider +
+    message_id) makes the check hold across workers and restarts until the
+    entry expires.
+    """
+
+    def __init__(self):
+        self.ttl = timedelta(hours=float(os.getenv('WEBHOOK_DEDUPE_TTL_HOURS', 24)))
+        self.memory = TTLCache(
+            maxsize=int(os.getenv('WEBHOOK_DEDUPE_MEMORY', 50000)),
+            ttl=self.ttl.total_seconds()
+        )
+        self.checked = 0
+        self.duplicates = 0
+        self.memory_hits = 0
+
+    def is_duplicate(self, provider: str, message_id: Optional[str], commit: bool = True) -> bool:
+        """
+        True if `message_id` was already accepted; otherwise records it.
+
+        With commit=False the id is only flushed inside a savepoint so it is
+        committed together with the caller's own work (e.g. the queued
+        event); call remember() once that commit succeeds.
+        """
+        if not message_id:
+            return False
+        key = (provider, message_id)
+        self.checked += 1
+        if self.memory.get(key) is not None:
+            self.memory_hits += 1
+            self.duplicates += 1
+            return True
+
+        now = datetime.utcnow()
+        try:
+            with db.session.begin_nested():
+                db.session.add(WebhookMessageId(provider=provider, message_id=message_id,
+                                                received_at=now, expires_at=now + self.ttl))
+        except IntegrityError:
+            # Already recorded: still a duplicate unless the old entry expired
+            reused = WebhookMessageId.query.filter(
+                WebhookMessageId.provider == provider,
+                WebhookMessageId.message_id == message_id,
+                WebhookMessageId.expires_at < now
+            ).update({'received_at': now, 'expires_at': now + self.ttl}, synchronize_session=False)
+            if not reused:
+                self.memory.set(key, True)
+                self.duplicates += 1
+                return True
+
+        if commit:
+            db.session.commit()
+            self.remember(provider, message_id)
+        return False
+
+    def remember(self, provider: str, message_id: Optional[str]):
+        if message_id:
+            self.memory.set((provider, message_id), True)
+
+    def purge_expired(self) -> int:
+        deleted = WebhookMessageId.query.filter(
+            WebhookMessageId.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+            'duplicate_rate': round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+            'memory_hits': self.memory_hits,
+            'memory_size': len(self.memory)
+        }
+
+# Singleton instance
+webhook_dedupe = WebhookDeduplicator()
@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, Optional, List, Tuple
+from sqlalchemy.exc import IntegrityError
+from src.models.db_instance import db
+from src.models.webhook import WebhookEvent, WebhookConversationLock
+from src.services.webhook_dedupe import webhook_dedupe
+
+logger = logging.getLogger("webhook_queue")
+
+
+class WebhookQueue:
+    """
+    Database-backed queue for inbound webhook events.
+
+    The webhook view only INSERTs the event and returns; a pool of worker
+    threads per process runs the registered provider handler. Events that
+    share a conversation_key are processed strictly in arrival order: a
+    worker first takes a lease on the conversation (webhook_conversation_locks)
+    and drains its events one by one, so gunicorn workers never interleave
+    replies to the same customer. A heartbeat thread renews the lease while
+    a handler runs (LLM replies can outlast it), and an event another worker
+    marked processing less than a lease ago is never picked up again. Failed events are retried with backoff and
+    block later events of that conversation until they succeed or give up.
+
+    Providers registered with a coalesce policy and a merge function get
+    burst coalescing: every new event pushes the conversation's pending
+    events to a shared deadline (now + window, capped at the oldest pending
+    event + max_wait) and the worker hands the whole burst to the handler as
+    one merged payload.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv('WEBHOOK_WORKERS', 4))
+        self.poll_interval = float(os.getenv('WEBHOOK_POLL_INTERVAL', 1.0))
+        self.lease_seconds = int(os.getenv('WEBHOOK_LEASE_SECONDS', 120))
+        self.max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 3))
+        self.retry_delay = float(os.getenv('WEBHOOK_RETRY_DELAY', 5))
+        self.retention_hours = int(os.getenv('WEBHOOK_RETENTION_HOURS', 24))
+        self.claim_batch = 20
+        self.coalesce_max_batch = int(os.getenv('WEBHOOK_COALESCE_MAX_BATCH', 20))
+        self.app = None
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._coalescers: Dict[str, Callable[[Dict[str, Any], Optional[int]], Tuple[float, float]]] = {}
+        self._mergers: Dict[str, Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = {}
+        self._active = set()  # conversations being processed by this process
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers_pid = None
+        self._last_purge = 0.0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self._lag_total = 0.0
+        self._run_total = 0.0
+
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app):
+        """Bind to the Flask app and start the worker pool in this process."""
+        self.app = app
+        app.before_request(self._ensure_workers)
+        self._ensure_workers()
+
+    def register_handler(self, provider: str, handler: Callable[[Dict[str, Any]], Any],
+                         coalesce: Optional[Callable[[Dict[str, Any], Optional[int]], Tuple[float, float]]] = None,
+                         merge: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None):
+        """
+        Register the handler for a provider's events.
+
+        `coalesce(payload, user_id)` returns (window, max_wait) in seconds and
+        `merge(payloads)` folds a burst into one payload; both are needed to
+        enable coalescing, and a window of 0 disables it for that event.
+        """
+        self._handlers[provider] = handler
+        if coalesce and merge:
+            self._coalescers[provider] = coalesce
+            self._mergers[provider] = merge
+
+    # Producer side
+    def enqueue(self, provider: str, payload: Dict[str, Any], conversation_key: str,
+                user_id: Optional[int] = None, message_id: Optional[str] = None) -> Optional[WebhookEvent]:
+        """Persist an event; returns None if `message_id` was already delivered."""
+        if webhook_dedupe.is_duplicate(provider, message_id, commit=False):
+            db.session.rollback()
+            return None
+        now = datetime.utcnow()
+        event = WebhookEvent(
+            provider=provider,
+            conversation_key=conversation_key,
+            user_id=user_id,
+            payload=json.dumps(payload, ensure_ascii=False),
+            status='pending',
+            created_at=now,
+            available_at=self._coalesce_deadline(provider, payload, conversation_key, user_id, now)
+        )
+        db.session.add(event)
+        db.session.commit()
+        webhook_dedupe.remember(provider, message_id)
+        self._ensure_workers()
+        self._wakeup.set()
+        return event
+
+    def _coalesce_deadline(self, provider: str, payload: Dict[str, Any], conversation_key: str,
+                           user_id: Optional[int], now: datetime) -> datetime:
+        """Push the conversation's untouched pending events to a shared debounce deadline."""
+        policy = self._coalescers.get(provider)
+        if policy is None:
+            return now
+        window, max_wait = policy(payload, user_id)
+        if window <= 0:
+            return now
+        burst = WebhookEvent.query.filter(
+            WebhookEvent.conversation_key == conversation_key,
+            WebhookEvent.status == 'pending',
+            WebhookEvent.attempts == 0
+        )
+        oldest = burst.with_entities(db.func.min(WebhookEvent.created_at)).scalar()
+        deadline = min(now + timedelta(seconds=window), (oldest or now) + timedelta(seconds=max_wait))
+        if oldest:
+            burst.update({'available_at': deadline}, synchronize_session=False)
+        return deadline
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and lag from the database plus this process's counters."""
+        now = datetime.utcnow()
+        counts = dict(db.session.query(WebhookEvent.status, db.func.count(WebhookEvent.id)).filter(
+            WebhookEvent.status.in_(('pending', 'processing'))
+        ).group_by(WebhookEvent.status).all())
+        oldest = db.session.query(db.func.min(WebhookEvent.created_at)).filter(
+            WebhookEvent.status.in_(('pending', 'processing'))
+        ).scalar()
+        done = self.processed + self.failed
+        return {
+            'depth': counts.get('pending', 0) + counts.get('processing', 0),
+            'pending': counts.get('pending', 0),
+            'processing': counts.get('processing', 0),
+            'lag_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+            'dedupe': webhook_dedupe.stats(),
+            'worker': {
+                'id': self.worker_id,
+                'threads': self.workers,
+                'processed': self.processed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'coalesced': self.coalesced,
+                'avg_lag_seconds': round(self._lag_total / done, 3) if done else 0.0,
+                'avg_processing_seconds': round(self._run_total / done, 3) if done else 0.0
+            }
+        }
+
+    # Worker pool
+    def _ensure_workers(self):
+        if self.app is None or self._workers_pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self._active = set()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'webhook-worker-{n}', daemon=True)
+                thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    while self._run_next():
+                        pass
+                    self._maybe_purge()
+            except Exception:
+                logger.exception("Webhook worker iteration failed")
+            finally:
+                if self.app is not None:
+                    with self.app.app_context():
+                        db.session.remove()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run_next(self) -> bool:
+        """Claim one ready conversation and drain it; False when nothing is ready."""
+        now = datetime.utcnow()
+        candidates = db.session.query(WebhookEvent.conversation_key).filter(
+            WebhookEvent.status.in_(('pending', 'processing')),
+            WebhookEvent.available_at <= now
+        ).group_by(WebhookEvent.conversation_key).order_by(
+            db.func.min(WebhookEvent.id)
+        ).limit(self.claim_batch).all()
+        db.session.commit()
+
+        for (key,) in candidates:
+            with self._lock:
+                if key in self._active:
+                    continue
+                self._active.add(key)
+            try:
+                if not self._claim(key):
+                    continue
+                try:
+                    self._drain(key)
+                finally:
+                    self._release(key)
+                return True
+            finally:
+                with self._lock:
+                    self._active.discard(key)
+        return False
+
+    def _claim(self, key: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            db.session.add(WebhookConversationLock(conversation_key=key, locked_by=self.worker_id, locked_at=now))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+        stale = now - timedelta(seconds=self.lease_seconds)
+        claimed = WebhookConversationLock.query.filter(
+            WebhookConversationLock.conversation_key == key,
+            db.or_(WebhookConversationLock.locked_by.is_(None), WebhookConversationLock.locked_at < stale)
+        ).update({'locked_by': self.worker_id, 'locked_at': now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _renew(self, key: str) -> bool:
+        renewed = WebhookConversationLock.query.filter_by(
+            conversation_key=key, locked_by=self.worker_id
+        ).update({'locked_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return renewed == 1
+
+    def _heartbeat(self, key: str, done: threading.Event):
+        """Renew the conversation lease while the handler runs in the worker thread."""
+        with self.app.app_context():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self._renew(key):
+                        logger.warning(f"Lost the lease on conversation {key} while its handler was running")
+                        break
+                except Exception:
+                    logger.exception(f"Could not renew the lease on conversation {key}")
+                    db.session.rollback()
+            db.session.remove()
+
+    def _release(self, key: str):
+        db.session.rollback()
+        WebhookConversationLock.query.filter_by(conversation_key=key, locked_by=self.worker_id).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    def _drain(self, key: str):
+        while self._renew(key):
+            events = WebhookEvent.query.filter(
+                WebhookEvent.conversation_key == key,
+                WebhookEvent.status.in_(('pending', 'processing'))
+            ).order_by(WebhookEvent.id).limit(self.coalesce_max_batch).all()
+            now = datetime.utcnow()
+            if not events or events[0].available_at > now:
+                return
+            head = events[0]
+            if (head.status == 'processing' and head.started_at
+                    and head.started_at > now - timedelta(seconds=self.lease_seconds)):
+                # Still in flight in a worker whose lease lapsed: wait for it rather than reply twice
+                return
+            # Only providers with a merge function take the whole burst at once
+            batch = [e for e in events if e.provider == events[0].provider]
+            if events[0].provider not in self._mergers:
+                batch = batch[:1]
+            if not self._execute(batch):
+                return
+
+    def _execute(self, events: List[WebhookEvent]) -> bool:
+        """Run the handler for one event or a merged burst; False if rescheduled for a retry."""
+        provider, key = events[0].provider, events[0].conversation_key
+        event_ids = [event.id for event in events]
+        attempts = max((event.attempts or 0) for event in events) + 1
+        started_at = datetime.utcnow()
+        for event in events:
+            event.status = 'processing'
+            event.attempts = attempts
+            event.started_at = started_at
+        payloads = [event.get_payload() for event in events]
+        created = [event.created_at for event in events]
+        db.session.commit()
+
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(key, done),
+                         name=f'webhook-lease-{event_ids[0]}', daemon=True).start()
+        started = time.monotonic()
+        error = None
+        try:
+            handler = self._handlers.get(provider)
+            if handler is None:
+                raise LookupError(f"No webhook handler registered for '{provider}'")
+            handler(self._mergers[provider](payloads) if len(payloads) > 1 else payloads[0])
+        except Exception as e:
+            logger.exception(f"Webhook events {event_ids} failed")
+            db.session.rollback()
+            error = str(e) or e.__class__.__name__
+        finally:
+            done.set()
+
+        now = datetime.utcnow()
+        batch = WebhookEvent.query.filter(WebhookEvent.id.in_(event_ids))
+        if error is not None and attempts < self.max_attempts:
+            batch.update({
+                'status': 'pending',
+                'last_error': error,
+                'available_at': now + timedelta(seconds=self.retry_delay * (2 ** (attempts - 1)))
+            }, synchronize_session=False)
+            db.session.commit()
+            self.retried += 1
+            return False
+
+        batch.update({
+            'status': 'done' if error is None else 'failed',
+            'last_error': error,
+            'processed_at': now
+        }, synchronize_session=False)
+        db.session.commit()
+        if error is None:
+            self.processed += len(events)
+        else:
+            self.failed += len(events)
+        self.coalesced += len(events) - 1
+        self._lag_total += sum((now - created_at).total_seconds() for created_at in created)
+        self._run_total += (time.monotonic() - started) * len(events)
+        return True
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge < 600:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(hours=self.retention_hours)
+        WebhookEvent.query.filter(
+            WebhookEvent.status.in_(('done', 'failed')),
+            WebhookEvent.processed_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        webhook_dedupe.purge_expired()
+
+# Singleton instance
+webhook_queue = WebhookQueue()
@@ -1,31 +1,298 @@
+import os
+import json
+import time
+import socket
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 from typing import Dict, Any, Optional, List
+from urllib.parse import urlsplit
 from flask import current_app
+from src.services.resilience import RetryPolicy, CircuitBreakerRegistry, CircuitOpenError
+from src.services.cache import TTLCache
+
+WHATSAPI_BASE_URL = "https://whatsapi-production-5412.up.railway.app"
+
+# Endpoints addressed by secret key rather than session; they share the host-wide breaker
+SECRETKEY_ACTIONS = frozenset(('show-all-sessions', 'start-all', 'backup-sessions', 'restore-sessions'))
+
+# Read-only endpoints whose responses are cached per session (TTL in seconds)
+READ_CACHE_TTLS = {
+    'profile-pic': 3600,
+    'profile-status': 600,
+    'get-all-labels': 300,
+    'get-collections': 300,
+    'get-products': 300,
+    'group-admins': 120,
+    'all-broadcast-list': 300,
+}
+
+# Write endpoints and the cached endpoints they make stale ('*' = whole session)
+_PRODUCT_READS = frozenset(('get-products', 'get-collections'))
+_GROUP_READS = frozenset(('group-admins',))
+WRITE_INVALIDATES = {
+    'add-new-label': frozenset(('get-all-labels',)),
+    'add-or-remove-label': frozenset(('get-all-labels',)),
+    'delete-all-labels': frozenset(('get-all-labels',)),
+    'delete-label': frozenset(('get-all-labels',)),
+    'add-product': _PRODUCT_READS,
+    'edit-product': _PRODUCT_READS,
+    'del-products': _PRODUCT_READS,
+    'change-product-image': _PRODUCT_READS,
+    'add-product-image': _PRODUCT_READS,
+    'remove-product-image': _PRODUCT_READS,
+    'set-product-visibility': _PRODUCT_READS,
+    'create-collection': frozenset(('get-collections',)),
+    'edit-collection': frozenset(('get-collections',)),
+    'del-collection': frozenset(('get-collections',)),
+    'set-profile-pic': frozenset(('profile-pic',)),
+    'profile-status': frozenset(('profile-status',)),
+    'group-subject': _GROUP_READS,
+    'group-description': _GROUP_READS,
+    'group-property': _GROUP_READS,
+    'group-pic': _GROUP_READS,
+    'messages-admins-only': _GROUP_READS,
+    'add-participant-group': _GROUP_READS,
+    'remove-participant-group': _GROUP_READS,
+    'promote-participant-group': _GROUP_READS,
+    'demote-participant-group': _GROUP_READS,
+    'leave-group': _GROUP_READS,
+    'logout-session': frozenset(('*',)),
+    'close-session': frozenset(('*',)),
+    'clear-session-data': frozenset(('*',)),
+}
+
+_CACHE_MISS = object()
+
+# Breakers and the response cache are shared by the sync and async clients
+whatsapi_breakers = CircuitBreakerRegistry()
+whatsapi_response_cache = TTLCache(maxsize=int(os.getenv('WHATSAPI_CACHE_MAXSIZE', 2048)))
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on every pooled socket."""
+
+    def __init__(self, keepalive_idle: int = 60, **kwargs):
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+        kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class WhatsAPIConnectionPool:
+    """
+    Keep-alive HTTP transport shared by every WhatsAPIService instance.
+
+    Wraps a single requests.Session whose urllib3 pools are thread-safe, so
+    all gunicorn threads reuse the same TCP+TLS connections to WhatsAPI.
+    Settings come from the WHATSAPI_* environment variables.
+    """
+
+    def __init__(self, pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 keepalive_idle: Optional[int] = None, pool_block: Optional[bool] = None):
+        self.pool_connections = pool_connections or int(os.getenv('WHATSAPI_POOL_CONNECTIONS', 4))
+        self.pool_maxsize = pool_maxsize or int(os.getenv('WHATSAPI_POOL_MAXSIZE', 20))
+        self.connect_timeout = connect_timeout or float(os.getenv('WHATSAPI_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout or float(os.getenv('WHATSAPI_READ_TIMEOUT', 30))
+        self.keepalive_idle = keepalive_idle or int(os.getenv('WHATSAPI_KEEPALIVE_IDLE', 60))
+        if pool_block is None:
+            pool_block = os.getenv('WHATSAPI_POOL_BLOCK', 'false').lower() == 'true'
+        self.pool_block = pool_block
+
+        self.adapter = _KeepAliveAdapter(
+            keepalive_idle=self.keepalive_idle,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=0
+        )
+        self.session = requests.Session()
+        self.session.headers.update({'Connection': 'keep-alive'})
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    @property
+    def timeout(self):
+        """(connect, read) timeout tuple passed to every request."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection counters aggregated over every host pool."""
+        pools = self.adapter.poolmanager.pools
+        hosts = {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new_connections = pool.num_connections
+            requests_sent = pool.num_requests
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'requests': requests_sent,
+                'new_connections': new_connections,
+                'reused_connections': max(0, requests_sent - new_connections),
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            }
+        total_requests = sum(h['requests'] for h in hosts.values())
+        total_new = sum(h['new_connections'] for h in hosts.values())
+        return {
+            'pool_maxsize': self.pool_maxsize,
+            'timeout': {'connect': self.connect_timeout, 'read': self.read_timeout},
+            'requests': total_requests,
+            'new_connections': total_new,
+            'reused_connections': max(0, total_requests - total_new),
+            'hosts': hosts
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_shared_pool: Optional[WhatsAPIConnectionPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool() -> WhatsAPIConnectionPool:
+    """Return the process-wide WhatsAPI connection pool, creating it on first use."""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = WhatsAPIConnectionPool()
+    return _shared_pool
+
 
 class WhatsAPIService:
-    def __init__(self, base_url: str = "https://whatsapi-production-5412.up.railway.app"):
+    def __init__(self, base_url: str = WHATSAPI_BASE_URL, pool: Optional[WhatsAPIConnectionPool] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breakers: Optional[CircuitBreakerRegistry] = None,
+                 cache: Optional[TTLCache] = None):
         self.base_url = base_url
+        self.pool = pool or get_shared_pool()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or whatsapi_breakers
+        self.cache = cache if cache is not None else whatsapi_response_cache
+        self.retries = 0
+
+    def _breaker_key(self, endpoint: str) -> str:
+        """Circuit breaker key: upstream host plus session when the endpoint has one."""
+        host = urlsplit(self.base_url).netloc
+        parts = endpoint.strip('/').split('/')
+        if len(parts) >= 3 and parts[0] == 'api' and parts[-1] not in SECRETKEY_ACTIONS:
+            return f"{host}|{parts[1]}"
+        return host
+
+    def _cache_key(self, method: str, endpoint: str, params: Optional[Dict] = None) -> Optional[tuple]:
+        """Cache key (base_url, session, endpoint, args, params) for cacheable GETs, else None."""
+        if method != 'GET':
+            return None
+        parts = endpoint.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'api' or parts[2] not in READ_CACHE_TTLS:
+            return None
+        return (self.base_url, parts[1], parts[2], tuple(parts[3:]), json.dumps(params, sort_keys=True) if params else None)
+
+    def _after_response(self, method: str, endpoint: str, cache_key: Optional[tuple], result: Dict[str, Any]):
+        """Store cacheable reads; drop the session's entries made stale by a write."""
+        if cache_key is not None:
+            self.cache.set(cache_key, result, READ_CACHE_TTLS[cache_key[2]])
+            return
+        if method == 'GET':
+            return
+        parts = endpoint.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'api':
+            return
+        stale = WRITE_INVALIDATES.get(parts[2]) or WRITE_INVALIDATES.get(parts[-1])
+        if not stale:
+            return
+        base_url, session = self.base_url, parts[1]
+        self.cache.invalidate(
+            lambda key: key[0] == base_url and key[1] == session and ('*' in stale or key[2] in stale)
+        )
         
-    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None) -> Dict[str, Any]:
-        """Make HTTP request to WhatsAPI"""
+    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None,
+                      idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Make HTTP request to WhatsAPI.
+
+        Transient failures are retried with backoff when the call is safe to
+        repeat (see RetryPolicy); a per host/session circuit breaker fails
+        fast with CircuitOpenError while the upstream is down. Read-only
+        lookups listed in READ_CACHE_TTLS are served from the response cache.
+        """
         url = f"{self.base_url}{endpoint}"
-        try:
-            if method.upper() == 'GET':
-                response = requests.get(url, params=params, timeout=30)
-            elif method.upper() == 'POST':
-                response = requests.post(url, json=data, timeout=30)
-            elif method.upper() == 'PUT':
-                response = requests.put(url, json=data, timeout=30)
-            elif method.upper() == 'DELETE':
-                response = requests.delete(url, timeout=30)
+        method = method.upper()
+        if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        kwargs = {}
+        if method == 'GET':
+            kwargs['params'] = params
+        elif method in ('POST', 'PUT'):
+            kwargs['json'] = data
+        if idempotency_key:
+            kwargs['headers'] = {'Idempotency-Key': idempotency_key}
+
+        cache_key = self._cache_key(method, endpoint, params)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key, _CACHE_MISS)
+            if cached is not _CACHE_MISS:
+                return cached
+
+        breaker = self.breakers.get(self._breaker_key(endpoint))
+        retryable = self.retry_policy.can_retry(method, idempotency_key)
+        attempt = 0
+        while True:
+            attempt += 1
+            if not breaker.allow():
+                raise CircuitOpenError(breaker.key, breaker.retry_in())
+            try:
+                response = self.pool.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                breaker.record_failure()
+                safe = retryable or isinstance(e, requests.exceptions.ConnectTimeout)
+                if safe and attempt < self.retry_policy.max_attempts:
+                    self.retries += 1
+                    time.sleep(self.retry_policy.delay(attempt))
+                    continue
+                current_app.logger.error(f"WhatsAPI request failed: {e}")
+                raise
+
+            if response.status_code >= 500:
+                breaker.record_failure()
             else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            
-            response.raise_for_status()
-            return response.json() if response.text else {}
-        except requests.exceptions.RequestException as e:
-            current_app.logger.error(f"WhatsAPI request failed: {e}")
-            raise
+                breaker.record_success()
+            if (retryable and self.retry_policy.should_retry_status(response.status_code)
+                    and attempt < self.retry_policy.max_attempts):
+                self.retries += 1
+                time.sleep(self.retry_policy.delay(attempt, response.headers.get('Retry-After')))
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                current_app.logger.error(f"WhatsAPI request failed: {e}")
+                raise
+            result = response.json() if response.text else {}
+            self._after_response(method, endpoint, cache_key, result)
+            return result
+
+    def get_client_stats(self) -> Dict[str, Any]:
+        """Local transport metrics (not the upstream /metrics endpoint)."""
+        return {
+            'pool': self.pool.stats(),
+            'retries': self.retries,
+            'circuit_breakers': self.breakers.stats(),
+            'cache': self.cache.stats()
+        }
     
     # Session Management
     def generate_token(self, session: str, secretkey: str) -> Dict[str, Any]:
@@ -197,8 +464,8 @@ class WhatsAPIService:
     def download_media(self, session: str, data: Dict[str, Any]) -> Dict[str, Any]:
         return self._make_request('POST', f'/api/{session}/download-media', data)
     
-    def send_message(self, session: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        return self._make_request('POST', f'/api/{session}/send-message', data)
+    def send_message(self, session: str, data: Dict[str, Any], idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        return self._make_request('POST', f'/api/{session}/send-message', data, idempotency_key=idempotency_key)
     
     def edit_message(self, session: str, data: Dict[str, Any]) -> Dict[str, Any]:
         return self._make_request('POST', f'/api/{session}/edit-message', data)
@@ -482,4 +749,7 @@ class WhatsAPIService:
         return self._make_request('GET', '/unhealthy')
     
     def get_metrics(self) -> Dict[str, Any]:
-        return self._make_request('GET', '/metrics')
\ No newline at end of file
+        return self._make_request('GET', '/metrics')
+
+# Singleton instance shared by every whatsapi_* blueprint
+whatsapi_service = WhatsAPIService()
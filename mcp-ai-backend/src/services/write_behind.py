@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy.exc import OperationalError
+from src.models.db_instance import db
+from src.models.campaign import SalesInteraction
+from src.services.agent_metrics import agent_metrics, COUNTERS
+
+logger = logging.getLogger("write_behind")
+
+
+class WriteBehindBuffer:
+    """
+    Buffered writes for the agent hot path.
+
+    Sales interactions are queued as rows and agent metric changes as
+    per-agent deltas; a flusher thread per process writes them every
+    WRITE_BEHIND_FLUSH_MS or as soon as WRITE_BEHIND_MAX_ROWS are pending:
+    one multi-row INSERT for the interactions and one upsert of the
+    aggregated per-agent deltas into this process's agent metric shard
+    (see agent_metrics), in one transaction. When that batch fails, rows and
+    deltas are written one by one so a single bad row (e.g. an interaction
+    of a deleted campaign) cannot block the rest; what still fails is put
+    back and retried with backoff, and after WRITE_BEHIND_MAX_ATTEMPTS
+    failed writes it is logged with its values and dropped (dead letter).
+    When WRITE_BEHIND_MAX_PENDING rows are waiting (slow database),
+    producers block up to WRITE_BEHIND_BLOCK_SECONDS and then flush the
+    batch themselves. Everything pending is flushed at interpreter exit.
+    Without init_app every write is flushed immediately.
+    """
+
+    def __init__(self):
+        self.flush_interval = int(os.getenv('WRITE_BEHIND_FLUSH_MS', 500)) / 1000.0
+        self.max_rows = int(os.getenv('WRITE_BEHIND_MAX_ROWS', 500))
+        self.max_pending = int(os.getenv('WRITE_BEHIND_MAX_PENDING', 10000))
+        self.block_seconds = float(os.getenv('WRITE_BEHIND_BLOCK_SECONDS', 2.0))
+        self.max_backoff = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', 30.0))
+        self.max_attempts = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', 10))
+        self.app = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one flush at a time per process
+        self._interactions: List[Dict[str, Any]] = []
+        self._interaction_attempts: List[int] = []  # failed writes so far, parallel to _interactions
+        self._metrics: Dict[int, Dict[str, float]] = {}
+        self._metric_attempts: Dict[int, int] = {}
+        self._flusher_pid = None
+        self._failures = 0
+        self._sizes = deque(maxlen=1000)
+        self._latencies = deque(maxlen=1000)
+        self.flushes = 0
+        self.flushed_interactions = 0
+        self.flushed_metric_updates = 0
+        self.errors = 0
+        self.row_retries = 0
+        self.dead_letters = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.producer_flushes = 0
+        self.last_flush_at = None
+
+    def init_app(self, app):
+        """Bind to the Flask app, start the flusher thread and flush at shutdown."""
+        self.app = app
+        app.before_request(self._ensure_flusher)
+        self._ensure_flusher()
+        atexit.register(self.close)
+
+    # Producer side
+    def add_interaction(self, **values):
+        """Queue a sales_interactions row (column values)."""
+        values.setdefault('created_at', datetime.utcnow())
+
+        def append():
+            self._interactions.append(values)
+            self._interaction_attempts.append(0)
+        self._enqueue(append)
+
+    def add_agent_metrics(self, agent_id: int, interactions: int = 0, conversions: int = 0,
+                          satisfaction: Optional[float] = None):
+        """Queue metric deltas of an agent; `satisfaction` is one sample of the satisfaction mean."""
+        def merge():
+            delta = self._metrics.setdefault(agent_id, dict.fromkeys(COUNTERS, 0))
+            delta['interactions'] += interactions
+            delta['conversions'] += conversions
+            if satisfaction is not None:
+                delta['satisfaction_sum'] += satisfaction
+                delta['satisfaction_count'] += 1
+        self._enqueue(merge)
+
+    @property
+    def pending(self) -> int:
+        return len(self._interactions) + len(self._metrics)
+
+    def _enqueue(self, apply):
+        if self.app is None:
+            with self._cond:
+                apply()
+            self.flush()
+            return
+        self._ensure_flusher()
+        with self._cond:
+            if self.pending >= self.max_pending:
+                # Backpressure: wait for the flusher, then write the batch ourselves
+                self.blocked += 1
+                started = time.monotonic()
+                self._cond.wait_for(lambda: self.pending < self.max_pending, timeout=self.block_seconds)
+                self.blocked_seconds += time.monotonic() - started
+            apply()
+            full = self.pending >= self.max_pending
+            if self.pending >= self.max_rows:
+                self._cond.notify_all()
+        if full:
+            self.producer_flushes += 1
+            self._flush_in_context()
+
+    # Flushing
+    def _ensure_flusher(self):
+        if self.app is None or self._flusher_pid == os.getpid():
+            return
+        with self._cond:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            # Rows buffered by the parent before a fork are not ours to write
+            self._interactions, self._interaction_attempts = [], []
+            self._metrics, self._metric_attempts = {}, {}
+        threading.Thread(target=self._run, name='write-behind-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending >= self.max_rows, timeout=self.flush_interval)
+            if self.pending:
+                self._flush_in_context()
+            if self._failures:
+                time.sleep(min(self.max_backoff, self.flush_interval * 2 ** self._failures))
+
+    def _flush_in_context(self):
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            logger.exception("Write-behind flush failed")
+
+    def flush(self) -> int:
+        """Write everything pending now; returns the number of rows and metric updates written."""
+        with self._flush_lock:
+            with self._cond:
+                interactions, self._interactions = self._interactions, []
+                interaction_attempts, self._interaction_attempts = self._interaction_attempts, []
+                metrics, self._metrics = self._metrics, {}
+                metric_attempts, self._metric_attempts = self._metric_attempts, {}
+                self._cond.notify_all()
+            if not interactions and not metrics:
+                return 0
+            started = time.perf_counter()
+            try:
+                if interactions:
+                    db.session.execute(SalesInteraction.__table__.insert(), interactions)
+                if metrics:
+                    agent_metrics.apply(metrics)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.errors += 1
+                logger.exception("Write-behind batch failed; writing %s rows one by one",
+                                 len(interactions) + len(metrics))
+                written_interactions, written_metrics, requeued = self._flush_one_by_one(
+                    interactions, interaction_attempts, metrics, metric_attempts)
+            else:
+                written_interactions, written_metrics, requeued = len(interactions), len(metrics), 0
+            # Back off while writes keep failing
+            self._failures = self._failures + 1 if requeued else 0
+            size = written_interactions + written_metrics
+            self._sizes.append(size)
+            self._latencies.append(time.perf_counter() - started)
+            self.flushes += 1
+            self.flushed_interactions += written_interactions
+            self.flushed_metric_updates += written_metrics
+            self.last_flush_at = datetime.utcnow()
+            return size
+
+    def _flush_one_by_one(self, interactions: List[Dict[str, Any]], interaction_attempts: List[int],
+                          metrics: Dict[int, Dict[str, float]], metric_attempts: Dict[int, int]):
+        """
+        Write each row and delta in its own transaction after a failed batch; what
+        fails is requeued, or dropped once it reached max_attempts. A connection
+        error ends the pass: the rest counts as failed without being tried.
+        Returns (interactions written, metric updates written, writes requeued).
+        """
+        self.row_retries += 1
+        insert = SalesInteraction.__table__.insert()
+        retry_rows, retry_row_attempts = [], []
+        retry_metrics, retry_metric_attempts = {}, {}
+        written_interactions = written_metrics = 0
+        outage = None
+
+        for values, attempts in zip(interactions, interaction_attempts):
+            error = outage or self._try_write(lambda: db.session.execute(insert, [values]))
+            if error is None:
+                written_interactions += 1
+            elif attempts + 1 >= self.max_attempts:
+                self._dead_letter('sales_interactions', values, error)
+            else:
+                retry_rows.append(values)
+                retry_row_attempts.append(attempts + 1)
+            if isinstance(error, OperationalError):
+                outage = error
+
+        for agent_id, delta in metrics.items():
+            attempts = metric_attempts.get(agent_id, 0)
+            error = outage or self._try_write(lambda: agent_metrics.apply({agent_id: delta}))
+            if error is None:
+                written_metrics += 1
+            elif attempts + 1 >= self.max_attempts:
+                self._dead_letter('agent_metric_shards', dict(delta, agent_id=agent_id), error)
+            else:
+                retry_metrics[agent_id] = delta
+                retry_metric_attempts[agent_id] = attempts + 1
+            if isinstance(error, OperationalError):
+                outage = error
+
+        self._requeue(retry_rows, retry_row_attempts, retry_metrics, retry_metric_attempts)
+        return written_interactions, written_metrics, len(retry_rows) + len(retry_metrics)
+
+    @staticmethod
+    def _try_write(write) -> Optional[Exception]:
+        try:
+            write()
+            db.session.commit()
+            return None
+        except Exception as e:
+            db.session.rollback()
+            return e
+
+    def _dead_letter(self, table: str, values: Dict[str, Any], error):
+        self.dead_letters += 1
+        logger.error("Write-behind dropped a %s write after %s attempts (%s): %s", table, self.max_attempts,
+                     error, json.dumps(values, ensure_ascii=False, default=str))
+
+    def _requeue(self, interactions: List[Dict[str, Any]], interaction_attempts: List[int],
+                 metrics: Dict[int, Dict[str, float]], metric_attempts: Dict[int, int]):
+        """Put failed writes back in front of what was queued meanwhile."""
+        with self._cond:
+            self._interactions[:0] = interactions
+            self._interaction_attempts[:0] = interaction_attempts
+            for agent_id, older in metrics.items():
+                newer = self._metrics.get(agent_id)
+                if newer is not None:
+                    for counter in COUNTERS:
+                        older[counter] += newer[counter]
+                self._metrics[agent_id] = older
+                self._metric_attempts[agent_id] = metric_attempts[agent_id]
+
+    def close(self):
+        """Flush what is pending (registered with atexit)."""
+        if self.app is None or not self.pending or self._flusher_pid != os.getpid():
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            logger.exception("Write-behind flush at shutdown failed; %s writes lost", self.pending)
+
+    @staticmethod
+    def _percentile(samples: List[float], q: float) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        sizes, latencies = list(self._sizes), list(self._latencies)
+        return {
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'flushes': self.flushes,
+            'flushed_interactions': self.flushed_interactions,
+            'flushed_metric_updates': self.flushed_metric_updates,
+            'avg_flush_size': round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            'max_flush_size': max(sizes) if sizes else 0,
+            'avg_flush_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            'p95_flush_ms': round(self._percentile(latencies, 0.95) * 1000, 2),
+            'errors': self.errors,
+            'row_retries': self.row_retries,
+            'dead_letters': self.dead_letters,
+            'blocked': self.blocked,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'producer_flushes': self.producer_flushes,
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None
+        }
+
+# Singleton instance
+write_behind = WriteBehindBuffer()